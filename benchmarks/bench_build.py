@@ -0,0 +1,57 @@
+"""
+Compares OSMParser.build, one object per building, against the batched build
+that creates combined meshes, reporting time and maya command counts.
+Runs headless against the maya stand-in, or against maya under mayapy.
+"""
+
+import os
+import sys
+import time
+import tempfile
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import maya_standin
+scene = maya_standin.install()
+
+import osm_manager
+import synthetic_osm
+
+
+def _timed_build(parser, **kwargs):
+    if scene:
+        maya_standin.reset()
+    else:
+        import maya.cmds as cmds
+        cmds.file(new=True, force=True)
+
+    start = time.time()
+    parser.build(**kwargs)
+    return time.time() - start, scene.total_calls() if scene else None
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument('--buildings', type=int, default=10000)
+    arg_parser.add_argument('--chunk-size', type=int, default=None)
+    args = arg_parser.parse_args()
+
+    osm_file = os.path.join(tempfile.gettempdir(), 'bench_build_{}.osm'.format(args.buildings))
+    if not os.path.exists(osm_file):
+        synthetic_osm.write_osm(osm_file, args.buildings)
+
+    parser = osm_manager.OSMParser(osm_file)
+    parser.parse(use_cache=False)
+
+    single, single_calls = _timed_build(parser)
+    batched, batched_calls = _timed_build(parser, batched=True, chunk_size=args.chunk_size)
+
+    print '{:>10} {:>10} {:>10}'.format('build', 'time', 'commands')
+    print '{:>10} {:>9.2f}s {:>10}'.format('single', single, single_calls)
+    print '{:>10} {:>9.2f}s {:>10}'.format('batched', batched, batched_calls)
+    print 'speedup: {:.1f}x'.format(single / batched)
+
+
+if __name__ == '__main__':
+    main()
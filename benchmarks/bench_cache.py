@@ -0,0 +1,58 @@
+"""
+Compares a cold OSMParser.parse, which parses the xml and writes the binary
+cache, against a warm parse that loads the cache.
+Runs headless against the maya stand-in, or under mayapy.
+"""
+
+import os
+import sys
+import time
+import tempfile
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import maya_standin
+maya_standin.install()
+
+import osm_manager
+import synthetic_osm
+
+
+def _timed_parse(osm_file, streaming):
+    parser = osm_manager.OSMParser(osm_file)
+    start = time.time()
+    parser.parse(streaming=streaming)
+    return time.time() - start
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument('--osm', help='osm file to parse, a synthetic one is written if not given')
+    arg_parser.add_argument('--buildings', type=int, default=100000)
+    arg_parser.add_argument('--extra-nodes', type=int, default=200000)
+    args = arg_parser.parse_args()
+
+    osm_file = args.osm
+    if not osm_file:
+        osm_file = os.path.join(tempfile.gettempdir(), 'bench_cache_{}_{}.osm'.format(args.buildings, args.extra_nodes))
+        if not os.path.exists(osm_file):
+            synthetic_osm.write_osm(osm_file, args.buildings, extra_nodes=args.extra_nodes)
+
+    print 'File size: {:.1f}MB'.format(os.path.getsize(osm_file) / 1048576.0)
+
+    for streaming in (False, True):
+        mode = 'streaming' if streaming else 'full'
+        cache_file = '{}.{}{}'.format(osm_file, mode, osm_manager.CACHE_EXTENSION)
+        if os.path.exists(cache_file):
+            os.remove(cache_file)
+
+        cold = _timed_parse(osm_file, streaming)
+        warm = _timed_parse(osm_file, streaming)
+
+        print '{:>10}: cold {:.2f}s, warm {:.2f}s ({:.1f}x), cache {:.1f}MB'.format(
+            mode, cold, warm, cold / warm, os.path.getsize(cache_file) / 1048576.0)
+
+
+if __name__ == '__main__':
+    main()
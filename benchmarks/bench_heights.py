@@ -0,0 +1,82 @@
+"""
+Times the height control evaluation of buildings_manager, the pure python
+get_heights against the numpy get_heights_np, and checks they agree.
+Runs headless against the maya stand-in, or under mayapy.
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import maya_standin
+maya_standin.install()
+
+import numpy as np
+
+import buildings_manager
+
+
+def random_scene(num_buildings, num_ctrls, size=100000.0, seed=0):
+    """
+    Get random building pivots and height ctrls spread over a square
+    """
+
+    rng = random.Random(seed)
+
+    bld_positions = [(rng.uniform(0, size), rng.uniform(0, size), 0.0) for i in range(num_buildings)]
+    ctrls = [{'ctrl_pos': (rng.uniform(0, size), rng.uniform(0, size), 0.0),
+              'ctrl_radius': rng.uniform(size * 0.02, size * 0.2),
+              'ctrl_height': rng.uniform(1000, 10000),
+              'ctrl_name': 'ctrl{}'.format(i)} for i in range(num_ctrls)]
+
+    return bld_positions, ctrls
+
+
+def check_parity(bld_positions, ctrls, heights, heights_np, in_range):
+    """
+    Check the numpy heights match the python ones
+    :return: True if every building agrees
+    """
+
+    expected = np.array([height is not None for height in heights])
+    if not np.array_equal(expected, in_range):
+        return False
+
+    reference = np.array([height or 0 for height in heights])
+    return np.allclose(reference[expected], heights_np[expected], rtol=1e-9, atol=1e-6)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument('--buildings', type=int, nargs='+', default=[1000, 10000, 20000])
+    arg_parser.add_argument('--ctrls', type=int, default=50)
+    args = arg_parser.parse_args()
+
+    print '{:>10} {:>6} {:>10} {:>10} {:>8} {:>7}'.format('buildings', 'ctrls', 'python', 'numpy', 'speedup', 'parity')
+
+    for num_buildings in args.buildings:
+        bld_positions, ctrls = random_scene(num_buildings, args.ctrls)
+
+        start = time.time()
+        heights = buildings_manager.get_heights(bld_positions, ctrls)
+        python_time = time.time() - start
+
+        start = time.time()
+        heights_np, in_range = buildings_manager.get_heights_np(
+            np.array(bld_positions),
+            np.array([ctrl['ctrl_pos'] for ctrl in ctrls]),
+            np.array([ctrl['ctrl_radius'] for ctrl in ctrls]),
+            np.array([ctrl['ctrl_height'] for ctrl in ctrls]))
+        numpy_time = time.time() - start
+
+        print '{:>10} {:>6} {:>9.3f}s {:>9.3f}s {:>7.1f}x {:>7}'.format(
+            num_buildings, args.ctrls, python_time, numpy_time, python_time / numpy_time,
+            str(check_parity(bld_positions, ctrls, heights, heights_np, in_range)))
+
+
+if __name__ == '__main__':
+    main()
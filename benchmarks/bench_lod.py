@@ -0,0 +1,74 @@
+"""
+Reports polygon counts and generation/build times for each level of detail
+of osm_lod against the full detail buildings, and the time to swap every
+tile back to a level that is already built.
+Runs headless against the maya stand-in, or against maya under mayapy.
+"""
+
+import os
+import sys
+import time
+import tempfile
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import maya_standin
+scene = maya_standin.install()
+
+import maya.cmds as cmds
+
+import osm_manager
+import osm_lod
+import synthetic_osm
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument('--buildings', type=int, default=20000)
+    arg_parser.add_argument('--nodes-per-building', type=int, default=12)
+    arg_parser.add_argument('--tile-size', type=float, default=50000.0)
+    args = arg_parser.parse_args()
+
+    osm_file = os.path.join(tempfile.gettempdir(), 'bench_lod_{}_{}.osm'.format(args.buildings, args.nodes_per_building))
+    if not os.path.exists(osm_file):
+        synthetic_osm.write_osm(osm_file, args.buildings, nodes_per_building=args.nodes_per_building)
+
+    parser = osm_manager.OSMParser(osm_file)
+    parser.parse(use_cache=False)
+
+    lod_builder = osm_lod.LODBuilder(parser, tile_size=args.tile_size)
+    print '{} buildings in {} tiles'.format(len(lod_builder.counts), len(lod_builder.tiles))
+
+    print '{:>6} {:>10} {:>10} {:>8} {:>10} {:>10}'.format('level', 'faces', 'vertices', 'ratio', 'generate', 'build')
+
+    full_vertices = None
+    for level in (osm_lod.LOD_FULL, osm_lod.LOD_SIMPLE, osm_lod.LOD_BLOCK):
+        faces, vertices = lod_builder.poly_counts(level)
+        full_vertices = full_vertices or vertices
+
+        if scene:
+            maya_standin.reset()
+        else:
+            cmds.file(new=True, force=True)
+        lod_builder.built = {}
+        lod_builder.shown = {}
+
+        start = time.time()
+        lod_builder.build(level=level)
+        build_time = time.time() - start
+
+        print '{:>6} {:>10} {:>10} {:>7.1f}% {:>9.3f}s {:>9.3f}s'.format(
+            level, faces, vertices, 100.0 * vertices / full_vertices, lod_builder.times[level], build_time)
+
+    # every level is built now, going back to one only swaps visibility
+    for level in (osm_lod.LOD_FULL, osm_lod.LOD_SIMPLE, osm_lod.LOD_BLOCK):
+        lod_builder.build(level=level)
+
+    start = time.time()
+    lod_builder.build(level=osm_lod.LOD_FULL)
+    print 'swap back to full detail: {:.3f}s'.format(time.time() - start)
+
+
+if __name__ == '__main__':
+    main()
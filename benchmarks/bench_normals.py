@@ -0,0 +1,95 @@
+"""
+Times setting the up normal on a synthetic set of building footprints, one
+select and polyNormalPerVertex per vertex (how OSMParser.build used to do it)
+against one polyNormalPerVertex per building and one setVertexNormals call for
+a combined mesh.
+Runs headless against the maya stand-in, or against maya under mayapy.
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import maya_standin
+scene = maya_standin.install()
+
+import maya.cmds as cmds
+import maya.api.OpenMaya as om2
+
+import osm_manager
+
+
+def _footprints(num_buildings, num_vertices, seed=0):
+    rng = random.Random(seed)
+    footprints = []
+    for i in range(num_buildings):
+        x, y = rng.uniform(0, 100000), rng.uniform(0, 100000)
+        footprints.append([(x + rng.uniform(0, 1000), y + rng.uniform(0, 1000), 0) for j in range(num_vertices)])
+    return footprints
+
+
+def _create(footprints):
+    if scene:
+        maya_standin.reset()
+    else:
+        cmds.file(new=True, force=True)
+    return [cmds.polyCreateFacet(p=positions)[0] for positions in footprints]
+
+
+def _calls():
+    return scene.total_calls() if scene else None
+
+
+def per_vertex(buildings):
+    for building in buildings:
+        for i in range(cmds.polyEvaluate(building, vertex=True)):
+            cmds.select('{}.vtx[{}]'.format(building, i))
+            cmds.polyNormalPerVertex(xyz=osm_manager.UP)
+
+
+def per_building(buildings):
+    for building in buildings:
+        cmds.polyNormalPerVertex('{}.vtx[*]'.format(building), xyz=osm_manager.UP)
+
+
+def combined(footprints):
+    points = [point for positions in footprints for point in positions]
+    mesh_fn = om2.MFnMesh()
+    mesh_fn.create(om2.MPointArray(points),
+                   om2.MIntArray([len(positions) for positions in footprints]),
+                   om2.MIntArray(range(len(points))))
+
+    start = time.time()
+    mesh_fn.setVertexNormals(om2.MVectorArray([osm_manager.UP] * len(points)), om2.MIntArray(range(len(points))))
+    return time.time() - start
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument('--buildings', type=int, default=2000)
+    arg_parser.add_argument('--vertices', type=int, default=6)
+    args = arg_parser.parse_args()
+
+    footprints = _footprints(args.buildings, args.vertices)
+
+    print '{:>14} {:>10} {:>10}'.format('normals', 'time', 'commands')
+
+    for func in (per_vertex, per_building):
+        buildings = _create(footprints)
+        calls = _calls()
+        start = time.time()
+        func(buildings)
+        elapsed = time.time() - start
+        print '{:>14} {:>9.3f}s {:>10}'.format(func.__name__, elapsed, _calls() - calls if scene else '-')
+
+    _create([])
+    elapsed = combined(footprints)
+    print '{:>14} {:>9.3f}s {:>10}'.format('combined', elapsed, 1)
+
+
+if __name__ == '__main__':
+    main()
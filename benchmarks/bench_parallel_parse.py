@@ -0,0 +1,84 @@
+"""
+Benchmarks OSMParser.parse_parallel against the serial parse on a large
+synthetic osm file and reports the speedup for each worker count.
+Runs headless against the maya stand-in, or under mayapy.
+"""
+
+import os
+import sys
+import time
+import tempfile
+import argparse
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import maya_standin
+maya_standin.install()
+
+import osm_manager
+import synthetic_osm
+
+
+def _parse(osm_file, workers):
+    parser = osm_manager.OSMParser(osm_file)
+    start = time.time()
+    if workers:
+        parser.parse_parallel(workers)
+    else:
+        parser.parse_serial()
+    return parser, time.time() - start
+
+
+def _same_result(a, b):
+    """
+    Check two parsers hold exactly the same data
+    """
+
+    if (a.nodes.ids, a.nodes.lat, a.nodes.lon) != (b.nodes.ids, b.nodes.lat, b.nodes.lon):
+        return False
+    if a.nodes.tags != b.nodes.tags:
+        return False
+    if [n.id for n in a.tagged_nodes] != [n.id for n in b.tagged_nodes]:
+        return False
+    if (a.min_lat, a.max_lat, a.min_long, a.max_long) != (b.min_lat, b.max_lat, b.min_long, b.max_long):
+        return False
+
+    return [(w.id, w.tags, w.nodes) for w in a.ways] == [(w.id, w.tags, w.nodes) for w in b.ways]
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument('--osm', help='osm file to parse, a synthetic one is written if not given')
+    arg_parser.add_argument('--buildings', type=int, default=400000)
+    arg_parser.add_argument('--extra-nodes', type=int, default=1000000)
+    args = arg_parser.parse_args()
+
+    osm_file = args.osm
+    if not osm_file:
+        osm_file = os.path.join(tempfile.gettempdir(), 'bench_parallel_{}_{}.osm'.format(args.buildings, args.extra_nodes))
+        if not os.path.exists(osm_file):
+            print 'Writing {}'.format(osm_file)
+            synthetic_osm.write_osm(osm_file, args.buildings, extra_nodes=args.extra_nodes)
+
+    print 'File size: {:.1f}MB'.format(os.path.getsize(osm_file) / 1048576.0)
+
+    serial, serial_time = _parse(osm_file, None)
+    print 'serial: {:.2f}s'.format(serial_time)
+
+    cores = multiprocessing.cpu_count()
+    worker_counts = sorted(set([1, 2, 4, 8, 16, cores]))
+
+    print '{:>8} {:>10} {:>8} {:>6}'.format('workers', 'time', 'speedup', 'match')
+    for workers in worker_counts:
+        if workers > cores:
+            break
+        parallel, parallel_time = _parse(osm_file, workers)
+        print '{:>8} {:>9.2f}s {:>7.2f}x {:>6}'.format(workers,
+                                                      parallel_time,
+                                                      serial_time / parallel_time,
+                                                      str(_same_result(serial, parallel)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""
+Compares working out a particle initial state (closest goal uvs and the per
+particle random arrays) against reading it back from particle_cache, and
+checks the cached arrays match. Also checks a moved goal or particle misses.
+Runs headless against the maya stand-in, or under mayapy.
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import maya_standin
+maya_standin.install()
+
+import numpy as np
+
+import uv_lookup
+import random_streams
+import particle_cache
+from synthetic_particles import sphere_mesh, random_particles
+
+
+PARAMS = {'goalWeight_min': 0.2,
+          'goalWeight_max': 0.4,
+          'verticleSpeed_min': 0.005,
+          'verticleSpeed_max': 0.0075,
+          'rotationSpeed': 0.1,
+          'jitterInterval': 10,
+          'jitterRange': 0.01}
+
+
+def initial_state(mesh, positions, ids):
+    """
+    Work out the arrays particles._compute_initial_state caches
+    """
+
+    goal_weights = random_streams.uniform('particles', 'goalWeight', ids,
+                                          PARAMS['goalWeight_min'], PARAMS['goalWeight_max'])
+    rotation_rates = random_streams.uniform('particles', 'rotationRate', ids)
+
+    return {'goalU': np.mod(uv_lookup.UVLookup.from_mesh(mesh).uvs(positions)[:, 0], 1),
+            'goalV': random_streams.uniform('particles', 'goalV', ids, 0, 0),
+            'goalWeight': goal_weights,
+            'verticalSpeed': random_streams.uniform('particles', 'verticalSpeed', ids,
+                                                    PARAMS['verticleSpeed_min'], PARAMS['verticleSpeed_max']),
+            'rotationRate': rotation_rates * PARAMS['rotationSpeed'] * (1.1 - goal_weights),
+            'jitterInterval': random_streams.randint('particles', 'jitterInterval', ids,
+                                                     1, PARAMS['jitterInterval'] + 1),
+            'jitterValue': random_streams.uniform('particles', 'jitterValue', ids,
+                                                  -PARAMS['jitterRange'], PARAMS['jitterRange'])}
+
+
+def cached_state(mesh, positions, ids):
+    """
+    Same as initial_state but through the cache, the way _compute_initial_state does it
+    :return: (arrays, True if it was a hit)
+    """
+
+    key = particle_cache.state_key(positions, ids, mesh, PARAMS)
+    arrays = particle_cache.load(key)
+    if arrays is not None:
+        return arrays, True
+
+    arrays = initial_state(mesh, positions, ids)
+    particle_cache.save(key, arrays)
+    return arrays, False
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument('--particles', type=int, nargs='+', default=[1000, 10000, 100000])
+    arg_parser.add_argument('--density', type=int, default=64,
+                            help='rings of the goal sphere, it has twice as many segments')
+    args = arg_parser.parse_args()
+
+    particle_cache.CACHE_DIR = tempfile.mkdtemp(prefix='bench_particle_cache')
+    mesh = sphere_mesh(args.density, args.density * 2)
+
+    print '{:>10} {:>8} {:>8} {:>8} {:>9} {:>7} {:>7}'.format(
+        'particles', 'compute', 'miss', 'hit', 'speedup', 'parity', 'misses')
+
+    try:
+        for count in args.particles:
+            positions = random_particles(count)
+            ids = np.arange(count)
+
+            start = time.time()
+            reference = initial_state(mesh, positions, ids)
+            compute_time = time.time() - start
+
+            start = time.time()
+            _, hit = cached_state(mesh, positions, ids)
+            miss_time = time.time() - start
+            parity = not hit
+
+            start = time.time()
+            arrays, hit = cached_state(mesh, positions, ids)
+            hit_time = time.time() - start
+
+            parity &= hit and all(np.array_equal(arrays[name], reference[name]) for name in reference)
+
+            # anything the state is made from changing has to miss
+            moved = positions.copy()
+            moved[0, 0] += 1e-3
+            misses = particle_cache.load(particle_cache.state_key(moved, ids, mesh, PARAMS)) is None
+            misses &= particle_cache.load(particle_cache.state_key(positions, ids + 1, mesh, PARAMS)) is None
+            params = dict(PARAMS, rotationSpeed=0.2)
+            misses &= particle_cache.load(particle_cache.state_key(positions, ids, mesh, params)) is None
+
+            print '{:>10} {:>7.3f}s {:>7.3f}s {:>7.3f}s {:>8.1f}x {:>7} {:>7}'.format(
+                count, compute_time, miss_time, hit_time, compute_time / hit_time,
+                str(bool(parity)), str(bool(misses)))
+
+        # the least recently used entries go first
+        particle_cache.evict(max_entries=1)
+        print 'entries after evicting to 1: {}'.format(len(particle_cache._entries()))
+        print 'entries invalidated: {}'.format(particle_cache.invalidate())
+
+    finally:
+        shutil.rmtree(particle_cache.CACHE_DIR)
+
+
+if __name__ == '__main__':
+    main()
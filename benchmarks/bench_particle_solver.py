@@ -0,0 +1,139 @@
+"""
+Steps N particles for K frames with particle_solver.step, the whole system
+at once, against step_reference, the old runtime expression run one particle
+at a time, and checks they end up in the same place. Headless it also plays
+an attached system through the stand-in's timeline, checking it follows step,
+goes back to its initial state at the start frame and never calls setAttr.
+Runs headless, maya is only needed for the stand-in imports.
+"""
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import maya_standin
+scene = maya_standin.install()
+
+import numpy as np
+import maya.cmds as cmds
+
+import random_streams
+import particle_solver
+
+
+def initial_state(count):
+    """
+    Get the state set_initial_state would give count particles
+    :return: (state, ids)
+    """
+
+    ids = np.arange(count)
+    goal_weights = random_streams.uniform('particles', 'goalWeight', ids, 0.2, 0.4)
+
+    state = {'goalU': random_streams.uniform('particles', 'goalU', ids),
+             'goalV': np.zeros(count),
+             'verticalSpeedPP': random_streams.uniform('particles', 'verticalSpeed', ids, 0.005, 0.0075),
+             'rotationRatePP': random_streams.uniform('particles', 'rotationRate', ids) * 0.1 * (1.1 - goal_weights),
+             'jitterIntervalPP': random_streams.randint('particles', 'jitterInterval', ids, 1, 11).astype(np.float64),
+             'jitterStepPP': np.zeros(count),
+             'jitterRangePP': np.full(count, 0.01),
+             'jitterValuePP': random_streams.uniform('particles', 'jitterValue', ids, -0.01, 0.01)}
+
+    return state, ids
+
+
+def run(stepper, count, frames):
+    state, ids = initial_state(count)
+
+    start = time.time()
+    for frame in range(1, frames + 1):
+        stepper(state, ids, frame)
+
+    return time.time() - start, state
+
+
+def check_playback(count, frames):
+    """
+    Attach the solver to a stand-in particle system and play it, checking it
+    ends up where step does from the start frame, including after scrubbing
+    back and playing forward again and after jumping straight from the start
+    frame to the end, without a setAttr
+    """
+
+    maya_standin.reset()
+    np_shape = cmds.nParticle(p=[(0, 0, 0)] * count)[1]
+
+    state, ids = initial_state(count)
+    node = scene.get(np_shape)
+    for attr in particle_solver.STATE_ATTRS:
+        node.attrs[attr] = state[attr].tolist()
+        node.attrs[attr + '0'] = state[attr].tolist()
+
+    particle_solver.attach(np_shape)
+
+    for frame in range(2, frames + 2):
+        particle_solver.step(state, ids, frame)
+
+    def matches():
+        played, _ = particle_solver.get_state(np_shape)
+        return all(np.allclose(played[attr], state[attr], rtol=0, atol=1e-12) for attr in particle_solver.STATE_ATTRS)
+
+    for frame in range(2, frames + 2):
+        maya_standin.set_time(frame)
+    played = matches()
+
+    # scrubbing back leaves the system where it got to, playing forward again
+    # only steps the frames after it
+    for frame in range(frames + 1, frames // 2, -1) + range(frames // 2, frames + 3):
+        maya_standin.set_time(frame)
+    particle_solver.step(state, ids, frames + 2)
+    scrubbed = matches()
+
+    state, ids = initial_state(count)
+    for frame in range(2, frames + 2):
+        particle_solver.step(state, ids, frame)
+
+    maya_standin.set_time(1)
+    maya_standin.set_time(frames + 1)
+    jumped = matches()
+
+    particle_solver.detach(np_shape)
+
+    return played and scrubbed and jumped and cmds.objExists(particle_solver.SCRIPT_NODE) and not scene.calls['setAttr']
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument('--particles', type=int, nargs='+', default=[1000, 10000, 100000])
+    arg_parser.add_argument('--frames', type=int, default=100)
+    arg_parser.add_argument('--reference-max', type=int, default=10000,
+                            help='most particles to run the per particle reference on')
+    args = arg_parser.parse_args()
+
+    print '{:>10} {:>7} {:>10} {:>10} {:>12} {:>8} {:>7}'.format(
+        'particles', 'frames', 'solver', 'reference', 'per frame', 'speedup', 'parity')
+
+    for count in args.particles:
+        solver_time, state = run(particle_solver.step, count, args.frames)
+
+        # the reference is slow, time it on fewer particles and scale up
+        check = min(count, args.reference_max)
+        reference_time, reference = run(particle_solver.step_reference, check, args.frames)
+        reference_time *= float(count) / check
+
+        parity = all(np.allclose(state[attr][:check], reference[attr], rtol=0, atol=1e-12)
+                     for attr in particle_solver.STATE_ATTRS)
+
+        print '{:>10} {:>7} {:>9.3f}s {:>9.3f}s {:>10.2f}ms {:>7.1f}x {:>7}'.format(
+            count, args.frames, solver_time, reference_time, solver_time / args.frames * 1000,
+            reference_time / solver_time, str(parity))
+
+    if scene is not None:
+        print 'playback check: {}'.format(check_playback(min(args.particles), args.frames))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+Runs a parse, a single and a batched build and a batched extrude with
+profiling off and on, reports what turning it on costs and writes the
+profiling report (and optionally a cProfile dump) of the profiled run.
+Runs headless against the maya stand-in, or against maya under mayapy.
+"""
+
+import os
+import sys
+import time
+import tempfile
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import maya_standin
+scene = maya_standin.install()
+
+import profiling
+import osm_manager
+import buildings_manager
+import synthetic_osm
+
+
+def _new_scene():
+    if scene:
+        maya_standin.reset()
+    else:
+        import maya.cmds as cmds
+        cmds.file(new=True, force=True)
+
+
+def run(osm_file):
+    """
+    Parse and build everything once
+    :return: seconds taken
+    """
+
+    start = time.time()
+
+    parser = osm_manager.OSMParser(osm_file)
+    parser.parse(use_cache=False)
+
+    _new_scene()
+    parser.build()
+
+    _new_scene()
+    parser.build(batched=True)
+    buildings_manager.extrude_batched()
+
+    return time.time() - start
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument('--buildings', type=int, default=5000)
+    arg_parser.add_argument('--report', default=os.path.join(tempfile.gettempdir(), 'bench_profiling.json'),
+                            help='json file to write the profiling report to')
+    arg_parser.add_argument('--profile', help='file to write the cProfile stats to')
+    args = arg_parser.parse_args()
+
+    osm_file = os.path.join(tempfile.gettempdir(), 'bench_build_{}.osm'.format(args.buildings))
+    if not os.path.exists(osm_file):
+        synthetic_osm.write_osm(osm_file, args.buildings)
+
+    # once to warm up, then off and on
+    run(osm_file)
+    off_time = run(osm_file)
+
+    profiling.enable(profile=bool(args.profile))
+    on_time = run(osm_file)
+    profiling.disable()
+
+    profiling.print_report()
+    profiling.write_report(args.report, args.profile)
+
+    print 'off: {:.2f}s on: {:.2f}s overhead: {:.1f}%'.format(off_time, on_time, 100 * (on_time / off_time - 1))
+    print 'report written to {}'.format(args.report)
+
+
+if __name__ == '__main__':
+    main()
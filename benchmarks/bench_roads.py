@@ -0,0 +1,99 @@
+"""
+Compares building the roads of an osm file with a cmds.curve per way against
+osm_roads building each road class in one go as a ribbon mesh, reporting
+time and maya command counts. Also checks the ribbons are centred on the
+roads and at least as wide as them.
+Runs headless against the maya stand-in, or against maya under mayapy.
+"""
+
+import os
+import sys
+import time
+import tempfile
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import maya_standin
+scene = maya_standin.install()
+
+import numpy as np
+import maya.cmds as cmds
+
+import osm_roads
+import osm_manager
+import synthetic_osm
+
+
+def build_per_way(parser):
+    """
+    Build every road as its own curve, the way it would be done one command at a time
+    """
+
+    cmds.group(empty=True, n='_roads_per_way')
+
+    for way_class, (ways, points, counts, _) in osm_roads.get_roads(parser).iteritems():
+        for way, road in zip(ways, np.split(points, np.cumsum(counts)[:-1])):
+            curve = cmds.curve(d=1, p=[tuple(point) for point in road.tolist()], n='road_{}'.format(way.id))
+            cmds.parent(curve, '_roads_per_way')
+
+
+def _timed_build(func, *args, **kwargs):
+    if scene:
+        maya_standin.reset()
+    else:
+        cmds.file(new=True, force=True)
+
+    start = time.time()
+    func(*args, **kwargs)
+    return time.time() - start, scene.total_calls() if scene else None
+
+
+def check_ribbons(parser):
+    """
+    Check every ribbon vertex pair is centred on its road point and at
+    least the road's width apart, no more than twice it at the mitres
+    """
+
+    for ways, points, counts, widths in osm_roads.get_roads(parser).itervalues():
+        vertices, face_counts, face_connects = osm_roads.road_ribbons(points, counts, widths)
+
+        if len(vertices) != 2 * len(points) or len(face_counts) != len(points) - len(counts):
+            return False
+
+        centres = (vertices[0::2] + vertices[1::2]) / 2
+        if not np.allclose(centres, points):
+            return False
+
+        spans = np.sqrt(((vertices[0::2] - vertices[1::2])**2).sum(axis=1))
+        point_widths = np.repeat(widths, counts)
+        if (spans < point_widths * (1 - 1e-9)).any() or (spans > point_widths * 2 * (1 + 1e-9)).any():
+            return False
+
+    return True
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument('--roads', type=int, default=10000)
+    arg_parser.add_argument('--nodes-per-road', type=int, default=8)
+    args = arg_parser.parse_args()
+
+    osm_file = os.path.join(tempfile.gettempdir(), 'bench_roads_{}_{}.osm'.format(args.roads, args.nodes_per_road))
+    if not os.path.exists(osm_file):
+        synthetic_osm.write_osm(osm_file, 0, roads=args.roads, nodes_per_road=args.nodes_per_road)
+
+    parser = osm_manager.OSMParser(osm_file)
+    parser.parse(use_cache=False)
+
+    per_way, per_way_calls = _timed_build(build_per_way, parser)
+    ribbons, ribbons_calls = _timed_build(osm_roads.build_roads, parser)
+
+    print '{:>10} {:>10} {:>10} {:>8}'.format('build', 'time', 'commands', 'speedup')
+    print '{:>10} {:>9.2f}s {:>10} {:>8}'.format('per way', per_way, per_way_calls, '')
+    print '{:>10} {:>9.2f}s {:>10} {:>7.1f}x'.format('ribbons', ribbons, ribbons_calls, per_way / ribbons)
+    print 'ribbons check: {}'.format(check_ribbons(parser))
+
+
+if __name__ == '__main__':
+    main()
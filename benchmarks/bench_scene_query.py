@@ -0,0 +1,95 @@
+"""
+Times gathering building pivots and height ctrl data with one command per
+object (how buildings_manager.build used to) against the bulk api walk in
+scene_query.
+Runs headless against the maya stand-in, or against maya under mayapy.
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import maya_standin
+scene = maya_standin.install()
+
+import maya.cmds as cmds
+
+import scene_query
+
+
+def make_scene(num_buildings, num_ctrls, seed=0):
+    """
+    Fill the buildings and height ctrl groups with transforms
+    """
+
+    rng = random.Random(seed)
+
+    if scene:
+        maya_standin.reset()
+    else:
+        cmds.file(new=True, force=True)
+
+    cmds.group(empty=True, n='_buildings')
+    cmds.group(empty=True, n='_height_ctrls')
+
+    for i in range(num_buildings):
+        bld = cmds.group(empty=True, n='building_{0:03d}'.format(i + 1))
+        cmds.xform(bld, ws=True, piv=(rng.uniform(0, 100000), rng.uniform(0, 100000), 0))
+        cmds.parent(bld, '_buildings')
+
+    for i in range(num_ctrls):
+        ctrl = cmds.group(empty=True, n='height_ctrl_{}'.format(i + 1))
+        cmds.setAttr('{}.translate'.format(ctrl), rng.uniform(0, 100000), rng.uniform(0, 100000), 0)
+        cmds.setAttr('{}.sx'.format(ctrl), rng.uniform(1000, 20000))
+        cmds.addAttr(ctrl, ln='height', dv=rng.uniform(1000, 10000))
+        cmds.parent(ctrl, '_height_ctrls')
+
+
+def per_object():
+    ctrls = []
+    for ctrl in cmds.listRelatives('_height_ctrls', children=True):
+        ctrls.append((cmds.getAttr('{}.translate'.format(ctrl))[0],
+                      cmds.getAttr('{}.sx'.format(ctrl)),
+                      cmds.getAttr('{}.height'.format(ctrl))))
+
+    return [cmds.xform(bld, q=True, rp=True, ws=True) for bld in cmds.listRelatives('_buildings', children=True)], ctrls
+
+
+def bulk():
+    return scene_query.get_pivots('_buildings'), scene_query.get_height_ctrls('_height_ctrls')
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument('--buildings', type=int, nargs='+', default=[1000, 10000, 20000])
+    arg_parser.add_argument('--ctrls', type=int, default=50)
+    args = arg_parser.parse_args()
+
+    print '{:>10} {:>12} {:>10} {:>10} {:>10}'.format('buildings', 'query', 'time', 'commands', 'api calls')
+
+    for num_buildings in args.buildings:
+        make_scene(num_buildings, args.ctrls)
+
+        for func in (per_object, bulk):
+            if scene:
+                scene.calls.clear()
+
+            start = time.time()
+            func()
+            elapsed = time.time() - start
+
+            if scene:
+                api_calls = sum(count for name, count in scene.calls.items() if name.startswith('api.'))
+                commands = scene.total_calls() - api_calls
+            else:
+                api_calls = commands = '-'
+
+            print '{:>10} {:>12} {:>9.3f}s {:>10} {:>10}'.format(num_buildings, func.__name__, elapsed, commands, api_calls)
+
+
+if __name__ == '__main__':
+    main()
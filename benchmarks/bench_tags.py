@@ -0,0 +1,99 @@
+"""
+Compares parsing with the interning TagCleaner against cleaning every tag
+from scratch like OSMNode/OSMWay used to, with and without a key whitelist.
+Memory is the size of the distinct tag key and value strings the parse keeps.
+Runs headless against the maya stand-in, or under mayapy.
+"""
+
+import os
+import re
+import sys
+import time
+import tempfile
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import maya_standin
+maya_standin.install()
+
+import osm_manager
+import synthetic_osm
+
+
+class UncachedCleaner(osm_manager.TagCleaner):
+    """
+    Cleans every key with an uncompiled pattern and keeps every value as parsed
+    """
+
+    def key(self, key):
+        clean_key = re.sub('[^a-zA-Z0-9]', '_', key)
+        if self.keep is not None and key not in self.keep and clean_key not in self.keep:
+            return None
+        return clean_key
+
+    def value(self, value):
+        return value
+
+
+def _tag_strings(parser):
+    """
+    Get the number and total size of the distinct key and value objects kept
+    """
+
+    strings = {}
+    tag_dicts = parser.nodes.tags.values() + [way.tags for way in parser.ways]
+    for tags in tag_dicts:
+        for key, value in tags.iteritems():
+            strings[id(key)] = key
+            strings[id(value)] = value
+
+    return len(strings), sum(sys.getsizeof(string) for string in strings.itervalues())
+
+
+def _timed_parse(osm_file, cleaner):
+    parser = osm_manager.OSMParser(osm_file)
+    parser.tag_cleaner = cleaner
+    start = time.time()
+    parser.parse_serial()
+    return time.time() - start, parser
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument('--osm', help='osm file to parse, a synthetic one is written if not given')
+    arg_parser.add_argument('--buildings', type=int, default=100000)
+    arg_parser.add_argument('--extra-nodes', type=int, default=100000)
+    arg_parser.add_argument('--extra-tags', type=int, default=len(synthetic_osm.EXTRA_TAGS))
+    arg_parser.add_argument('--keep', nargs='*', default=['building', 'height', 'building:levels'])
+    args = arg_parser.parse_args()
+
+    osm_file = args.osm
+    if not osm_file:
+        osm_file = os.path.join(tempfile.gettempdir(), 'bench_tags_{}_{}_{}.osm'.format(
+            args.buildings, args.extra_nodes, args.extra_tags))
+        if not os.path.exists(osm_file):
+            synthetic_osm.write_osm(osm_file, args.buildings, extra_nodes=args.extra_nodes,
+                                    extra_tags=args.extra_tags)
+
+    print 'File size: {:.1f}MB'.format(os.path.getsize(osm_file) / 1048576.0)
+
+    baseline = None
+    for label, cleaner in (('uncached', UncachedCleaner()),
+                           ('interned', osm_manager.TagCleaner()),
+                           ('uncached+keep', UncachedCleaner(args.keep)),
+                           ('interned+keep', osm_manager.TagCleaner(args.keep))):
+        seconds, parser = _timed_parse(osm_file, cleaner)
+        count, size = _tag_strings(parser)
+
+        tags = [way.tags for way in parser.ways]
+        if baseline is None:
+            baseline = tags
+        elif cleaner.keep is None and tags != baseline:
+            print 'MISMATCH: {} tags differ from uncached'.format(label)
+
+        print '{:>14}: {:.2f}s, {} tag strings {:.1f}MB'.format(label, seconds, count, size / 1048576.0)
+
+
+if __name__ == '__main__':
+    main()
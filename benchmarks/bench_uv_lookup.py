@@ -0,0 +1,121 @@
+"""
+Times the batched closest uv lookup of uv_lookup against testing every
+triangle for every particle, over particle count and goal mesh density, and
+checks they agree. Particles are scattered in a shell around the goal and
+through the inside of it, where most are far from the surface. Under mayapy it also checks against MFnMesh.getUVAtPoint.
+Runs headless against the maya stand-in, or under mayapy.
+"""
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import maya_standin
+scene = maya_standin.install()
+
+import numpy as np
+import maya.api.OpenMaya as om2
+
+import uv_lookup
+from synthetic_particles import sphere_mesh, random_particles
+
+
+def brute_force_uvs(lookup, points):
+    """
+    Get the uvs by testing every triangle for every point
+    """
+
+    num_points = len(points)
+    best_d2 = np.full(num_points, np.inf)
+    best_tri = np.zeros(num_points, dtype=np.int64)
+    best_bary = np.zeros((num_points, 3))
+
+    lookup._test_all(points, np.arange(num_points), best_d2, best_tri, best_bary)
+
+    return (best_bary[:, :, None] * lookup.triangle_uvs[best_tri]).sum(axis=1), best_d2
+
+
+def uv_difference(uvs, reference):
+    """
+    Get the largest difference in u or v of each uv, with u wrapping at 1
+    """
+
+    difference = np.abs(uvs - reference)
+    difference[:, 0] = np.minimum(difference[:, 0], 1 - difference[:, 0])
+
+    return difference.max(axis=1)
+
+
+def maya_uvs(mesh, points):
+    """
+    Get the uvs with getUVAtPoint one point at a time, only under mayapy
+    """
+
+    sel_list = om2.MSelectionList()
+    sel_list.add(mesh)
+    mesh_fn = om2.MFnMesh(sel_list.getDagPath(0))
+
+    return np.array([mesh_fn.getUVAtPoint(om2.MPoint(point), om2.MSpace.kWorld)[:2] for point in points.tolist()])
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument('--particles', type=int, nargs='+', default=[1000, 10000, 100000])
+    arg_parser.add_argument('--density', type=int, nargs='+', default=[16, 64, 128],
+                            help='rings of the goal sphere, it has twice as many segments')
+    arg_parser.add_argument('--spread', type=float, default=0.1,
+                            help='distance of the particles from the goal as a fraction of its radius, '
+                                 'particles further away check more cells')
+    arg_parser.add_argument('--layout', nargs='+', choices=['shell', 'volume'], default=['shell', 'volume'],
+                            help='scatter the particles in a shell of --spread around the goal, '
+                                 'or through the volume inside it')
+    arg_parser.add_argument('--brute-force-max', type=int, default=10000,
+                            help='most particles to time the brute force on')
+    args = arg_parser.parse_args()
+
+    print '{:>7} {:>9} {:>10} {:>8} {:>9} {:>9} {:>8} {:>7}'.format(
+        'layout', 'triangles', 'particles', 'build', 'lookup', 'brute', 'speedup', 'parity')
+
+    for rings in args.density:
+        mesh = sphere_mesh(rings, rings * 2)
+
+        start = time.time()
+        lookup = uv_lookup.UVLookup.from_mesh(mesh)
+        build_time = time.time() - start
+
+        for layout, count in ((layout, count) for layout in args.layout for count in args.particles):
+            points = random_particles(count, spread=args.spread, fill=layout == 'volume')
+
+            start = time.time()
+            _, triangles, barycentrics = lookup.closest(points)
+            uvs = (barycentrics[:, :, None] * lookup.triangle_uvs[triangles]).sum(axis=1)
+            lookup_time = time.time() - start
+
+            # the brute force is the reference, only time it on smaller counts
+            check = points[:args.brute_force_max]
+            start = time.time()
+            reference, reference_d2 = brute_force_uvs(lookup, check)
+            brute_time = (time.time() - start) * len(points) / len(check)
+
+            # points on the seam can land on either side of it, the goal u
+            # wraps so compare u around the seam
+            positions, _, _ = lookup.closest(check)
+            d2 = ((positions - check)**2).sum(axis=1)
+            parity = np.allclose(d2, reference_d2, rtol=1e-9, atol=1e-9)
+            parity &= (uv_difference(uvs[:len(check)], reference) < 1e-6).all()
+
+            # maya's uvs are floats and it can pick either triangle on a tie
+            if scene is None:
+                maya_check = points[:1000]
+                parity &= np.mean(uv_difference(uvs[:len(maya_check)], maya_uvs(mesh, maya_check)) < 1e-4) > 0.99
+
+            print '{:>7} {:>9} {:>10} {:>7.3f}s {:>8.3f}s {:>8.3f}s {:>7.1f}x {:>7}'.format(
+                layout, len(lookup.triangles), count, build_time, lookup_time, brute_time,
+                brute_time / lookup_time, str(bool(parity)))
+
+
+if __name__ == '__main__':
+    main()
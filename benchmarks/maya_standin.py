@@ -0,0 +1,1028 @@
+"""
+A recording stand-in for the maya modules so the tools can be imported and
+benchmarked outside of maya. Commands are counted rather than executed, with
+just enough of a scene kept around for the tools to run.
+
+Call install() before importing any of the tools. If maya itself can be
+imported (e.g. under mayapy) it is initialised and used instead.
+"""
+
+import sys
+import types
+import itertools
+import collections
+
+
+_uuids = itertools.count(1)
+
+
+class _Node(object):
+
+    def __init__(self, name, node_type='transform', parent=None):
+        self.name = name
+        self.type = node_type
+        self.parent = parent
+        self.attrs = {}
+        self.pivot = (0.0, 0.0, 0.0)
+        self.points = []
+        self.counts = []
+        self.history = []
+        self.uuid = '{:08X}-0000-0000-0000-000000000000'.format(next(_uuids))
+
+
+class _Scene(object):
+    """
+    The nodes the stand-in knows about and a count of every command called
+    """
+
+    def __init__(self):
+        self.nodes = collections.OrderedDict()
+        self.selection = []
+        self.calls = collections.Counter()
+        self.names = collections.Counter()
+        self.time = 1.0
+        self.callbacks = {}
+
+    def unique_name(self, prefix):
+        self.names[prefix] += 1
+        name = '{}{}'.format(prefix, self.names[prefix])
+        while name in self.nodes:
+            self.names[prefix] += 1
+            name = '{}{}'.format(prefix, self.names[prefix])
+        return name
+
+    def add(self, name, node_type='transform', parent=None):
+        node = _Node(name, node_type, parent)
+        self.nodes[name] = node
+        return node
+
+    def get(self, name):
+        # components and attributes refer to their node
+        return self.nodes.get(name.split('.')[0].split('|')[-1])
+
+    def get_uuid(self, uuid):
+        for node in self.nodes.itervalues():
+            if node.uuid == uuid:
+                return node
+        return None
+
+    def children(self, name):
+        parent = self.get(name)
+        return [node.name for node in self.nodes.itervalues() if node.parent is parent]
+
+    def total_calls(self):
+        return sum(self.calls.values())
+
+
+scene = _Scene()
+
+
+def reset():
+    """
+    Clear the scene and the command counts
+    """
+
+    scene.__init__()
+
+
+def _record(func):
+    def wrapper(*args, **kwargs):
+        scene.calls[func.__name__] += 1
+        return func(*args, **kwargs)
+    wrapper.__name__ = func.__name__
+    return wrapper
+
+
+def _polygon_area(points):
+    area = 0.0
+    for i in range(len(points)):
+        x1, y1 = points[i][0], points[i][1]
+        x2, y2 = points[(i + 1) % len(points)][0], points[(i + 1) % len(points)][1]
+        area += x1 * y2 - x2 * y1
+    return abs(area) / 2.0
+
+
+class _Cmds(types.ModuleType):
+    """
+    maya.cmds, any command without its own stand-in is counted and returns None
+    """
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+
+        def command(*args, **kwargs):
+            scene.calls[name] += 1
+            return None
+        return command
+
+    @staticmethod
+    @_record
+    def ls(*args, **kwargs):
+        if kwargs.get('sl') or kwargs.get('selection'):
+            return list(scene.selection)
+        node_type = kwargs.get('type')
+        names = []
+        if not args and node_type:
+            return [name for name, node in scene.nodes.items() if node.type == node_type]
+        for arg in args:
+            for name in (arg if isinstance(arg, (list, tuple)) else [arg]):
+                node = scene.get(name)
+                if node is None:
+                    # uuids resolve to the node's name
+                    node = scene.get_uuid(name)
+                    name = node and node.name
+                if node and (node_type is None or node.type == node_type):
+                    names.append(node.uuid if kwargs.get('uuid') else name)
+        return names
+
+    @staticmethod
+    @_record
+    def objExists(name):
+        return scene.get(name) is not None
+
+    @staticmethod
+    @_record
+    def group(*args, **kwargs):
+        name = kwargs.get('n') or kwargs.get('name') or scene.unique_name('group')
+        scene.add(name)
+        return name
+
+    @staticmethod
+    @_record
+    def circle(*args, **kwargs):
+        name = scene.unique_name('nurbsCircle')
+        scene.add(name)
+        return [name, scene.unique_name('makeNurbCircle')]
+
+    @staticmethod
+    @_record
+    def curve(*args, **kwargs):
+        name = kwargs.get('n') or kwargs.get('name') or scene.unique_name('curve')
+        node = scene.add(name)
+        node.points = [tuple(p) for p in kwargs['p']]
+        return name
+
+    @staticmethod
+    @_record
+    def polyCreateFacet(*args, **kwargs):
+        name = scene.unique_name('polySurface')
+        node = scene.add(name)
+        node.points = [tuple(p) for p in kwargs['p']]
+        node.counts = [len(node.points)]
+        return [name, scene.unique_name('polyCreateFacet')]
+
+    @staticmethod
+    @_record
+    def polyEvaluate(*args, **kwargs):
+        node = scene.get(args[0])
+        if kwargs.get('vertex'):
+            return len(node.points)
+        if kwargs.get('face'):
+            return len(node.counts)
+        if kwargs.get('worldArea') or kwargs.get('area'):
+            return _polygon_area(node.points)
+        return None
+
+    @staticmethod
+    @_record
+    def polyExtrudeFacet(*args, **kwargs):
+        extrude = scene.add(scene.unique_name('polyExtrudeFace'), 'polyExtrudeFace')
+        extrude.attrs['localTranslateZ'] = kwargs.get('ltz', 0.0)
+        scene.get(args[0]).history.insert(0, extrude.name)
+        return [extrude.name]
+
+    @staticmethod
+    @_record
+    def listHistory(*args, **kwargs):
+        node = scene.get(args[0])
+        return [node.name] + node.history
+
+    @staticmethod
+    @_record
+    def xform(*args, **kwargs):
+        node = scene.get(args[0])
+        if kwargs.get('q') or kwargs.get('query'):
+            if kwargs.get('rp') or kwargs.get('rotatePivot'):
+                return list(node.pivot)
+            return [0.0, 0.0, 0.0]
+        if 'piv' in kwargs:
+            node.pivot = tuple(kwargs['piv'])
+        return None
+
+    @staticmethod
+    @_record
+    def rename(old, new):
+        node = scene.nodes.pop(scene.get(old).name)
+        node.name = new
+        scene.nodes[new] = node
+        return new
+
+    @staticmethod
+    @_record
+    def parent(*args, **kwargs):
+        children, parent = args[:-1], scene.get(args[-1])
+        for child in children:
+            scene.get(child).parent = parent
+        return list(children)
+
+    @staticmethod
+    @_record
+    def select(*args, **kwargs):
+        if kwargs.get('clear') or kwargs.get('cl'):
+            scene.selection = []
+        elif args:
+            scene.selection = list(args[0]) if isinstance(args[0], (list, tuple)) else list(args)
+        return None
+
+    @staticmethod
+    @_record
+    def listRelatives(*args, **kwargs):
+        node = scene.get(args[0])
+        if kwargs.get('parent') or kwargs.get('p'):
+            return [node.parent.name] if node.parent else None
+        return scene.children(node.name) or None
+
+    @staticmethod
+    @_record
+    def addAttr(*args, **kwargs):
+        name = kwargs.get('ln') or kwargs.get('longName')
+        scene.get(args[0]).attrs[name] = kwargs.get('dv', kwargs.get('defaultValue', 0.0))
+        return None
+
+    @staticmethod
+    @_record
+    def setAttr(attr, *values, **kwargs):
+        node_name, name = attr.split('.', 1)
+        if kwargs.get('type') in ('vectorArray', 'pointArray'):
+            values = values[1:]
+        scene.get(node_name).attrs[name] = values[0] if len(values) == 1 else values
+        return None
+
+    @staticmethod
+    @_record
+    def getAttr(attr, *args, **kwargs):
+        node_name, name = attr.split('.', 1)
+        node = scene.get(node_name)
+        attrs = node.attrs
+        if name == 'particleId':
+            return list(node.ids)
+        if name in ('translate', 't'):
+            return [tuple(attrs.get(name, (0.0, 0.0, 0.0)))]
+        return attrs.get(name, 1.0 if name in ('sx', 'sy', 'sz') else 0.0)
+
+    @staticmethod
+    @_record
+    def attributeQuery(name, **kwargs):
+        node = scene.get(kwargs.get('node') or kwargs.get('n'))
+        return name in node.attrs
+
+    @staticmethod
+    @_record
+    def objectType(name, **kwargs):
+        return scene.get(name).type
+
+    @staticmethod
+    @_record
+    def nParticle(*args, **kwargs):
+        # a transform with an nParticle shape under it, a particle per position
+        transform = scene.add(scene.unique_name('nParticle'))
+        shape = scene.add(scene.unique_name('nParticleShape'), 'nParticle', transform)
+        shape.points = [tuple(p) for p in kwargs.get('p') or kwargs.get('position') or []]
+        shape.ids = range(len(shape.points))
+        shape.goals = []
+        shape.attrs['goalGeometry'] = None
+        shape.attrs['startFrame'] = 1.0
+        return [transform.name, shape.name]
+
+    @staticmethod
+    @_record
+    def scriptNode(*args, **kwargs):
+        node = scene.add(kwargs.get('n') or kwargs.get('name') or scene.unique_name('script'), 'script')
+        node.attrs['before'] = kwargs.get('bs') or kwargs.get('beforeScript')
+        node.attrs['scriptType'] = kwargs.get('st', kwargs.get('scriptType', 0))
+        return node.name
+
+    @staticmethod
+    @_record
+    def goal(*args, **kwargs):
+        shape = scene.get(args[0])
+        if shape.type != 'nParticle':
+            shape = scene.get(scene.children(shape.name)[0])
+        shape.goals.append(scene.get(kwargs.get('g') or kwargs.get('goal')))
+        return [shape.name]
+
+    @staticmethod
+    @_record
+    def playbackOptions(*args, **kwargs):
+        if kwargs.get('q') or kwargs.get('query'):
+            return 1.0
+        return None
+
+    @staticmethod
+    @_record
+    def currentTime(*args, **kwargs):
+        if kwargs.get('q') or kwargs.get('query'):
+            return scene.time
+        scene.time = float(args[0])
+        return scene.time
+
+    @staticmethod
+    @_record
+    def delete(*args, **kwargs):
+        for arg in args:
+            for name in (arg if isinstance(arg, (list, tuple)) else [arg]):
+                node = scene.get(name)
+                if node:
+                    scene.nodes.pop(node.name)
+        return None
+
+
+class MObject(object):
+
+    kNullObj = None
+
+    def __init__(self, node=None):
+        self.node = node
+
+    def isNull(self):
+        return self.node is None
+
+    def hasFn(self, fn_type):
+        if fn_type == MFn.kTransform:
+            return self.node.type == 'transform'
+        return False
+
+
+MObject.kNullObj = MObject()
+
+
+class _ArrayData(MObject):
+
+    def __init__(self, values, fn_type):
+        super(_ArrayData, self).__init__()
+        self.values = values
+        self.fn_type = fn_type
+
+    def hasFn(self, fn_type):
+        return fn_type == self.fn_type
+
+
+class MFn(object):
+    kTransform = 110
+    kMesh = 296
+    kDoubleArrayData = 573
+    kVectorArrayData = 584
+
+
+class MSpace(object):
+    kInvalid = 0
+    kTransform = 1
+    kPreTransform = 2
+    kPostTransform = 3
+    kWorld = 4
+    kObject = kPreTransform
+
+
+class MVector(object):
+
+    def __init__(self, x=0.0, y=0.0, z=0.0):
+        self.x, self.y, self.z = x, y, z
+
+
+class MPoint(MVector):
+    pass
+
+
+class MDagPath(object):
+
+    def __init__(self, other=None):
+        self._node = other._node if other is not None else None
+
+    def push(self, mobject):
+        self._node = mobject.node
+
+    def node(self):
+        return MObject(self._node)
+
+    def partialPathName(self):
+        return self._node.name
+
+    def fullPathName(self):
+        return '|' + self._node.name
+
+
+class MSelectionList(object):
+
+    def __init__(self):
+        self.nodes = []
+
+    def add(self, name):
+        node = scene.get(name)
+        if node is None:
+            raise RuntimeError('(kInvalidParameter): Object does not exist')
+        self.nodes.append(node)
+
+    def getDagPath(self, index):
+        path = MDagPath()
+        path._node = self.nodes[index]
+        return path
+
+    def getDependNode(self, index):
+        return MObject(self.nodes[index])
+
+
+class MPlug(object):
+
+    def __init__(self, node, name):
+        self.node = node
+        self.attr = name
+
+    def asDouble(self):
+        scene.calls['api.MPlug.asDouble'] += 1
+        return float(self.node.attrs.get(self.attr, 0.0))
+
+    def asMObject(self):
+        scene.calls['api.MPlug.asMObject'] += 1
+        # particle positions and ids are kept on the node rather than in attrs
+        if self.attr == 'position':
+            return _ArrayData([tuple(point) for point in self.node.points], MFn.kVectorArrayData)
+        if self.attr == 'particleId':
+            return _ArrayData([float(i) for i in self.node.ids], MFn.kDoubleArrayData)
+        return _ArrayData(list(self.node.attrs[self.attr]), MFn.kDoubleArrayData)
+
+
+class MFnDoubleArrayData(object):
+
+    def __init__(self, data):
+        self.data = data
+
+    def array(self):
+        return MDoubleArray(self.data.values)
+
+
+class MFnVectorArrayData(MFnDoubleArrayData):
+
+    def array(self):
+        return MVectorArray(self.data.values)
+
+class MPointArray(list):
+    pass
+
+
+class MFloatPointArray(list):
+    pass
+
+
+class MIntArray(list):
+    pass
+
+
+class MFloatArray(list):
+    pass
+
+
+class MDoubleArray(list):
+    pass
+
+
+class MVectorArray(list):
+    pass
+
+
+class MUuid(object):
+
+    def __init__(self, uuid):
+        self.uuid = uuid
+
+    def asString(self):
+        return self.uuid
+
+
+class MFnDependencyNode(object):
+
+    def __init__(self, mobject=None):
+        # function sets take an MObject or an MDagPath
+        if isinstance(mobject, MDagPath):
+            self.node = mobject._node
+        else:
+            self.node = getattr(mobject, 'node', None)
+
+    def name(self):
+        return self.node.name
+
+    def uuid(self):
+        return MUuid(self.node.uuid)
+
+    def setName(self, name):
+        scene.calls['api.setName'] += 1
+        scene.nodes.pop(self.node.name)
+        self.node.name = name
+        scene.nodes[name] = self.node
+        return name
+
+    def hasAttribute(self, name):
+        return name in self.node.attrs
+
+    def findPlug(self, name, want_networked_plug=False):
+        if name not in self.node.attrs and not (self.node.type == 'nParticle' and name in ('position', 'particleId')):
+            raise RuntimeError('(kInvalidParameter): No element at given index')
+        return MPlug(self.node, name)
+
+
+class MFnDagNode(MFnDependencyNode):
+
+    def create(self, node_type, name=None, parent=None):
+        scene.calls['api.MFnDagNode.create'] += 1
+        self.node = scene.add(name or scene.unique_name(node_type), node_type, getattr(parent, 'node', None))
+        return MObject(self.node)
+
+    def partialPathName(self):
+        return self.node.name
+
+    def fullPathName(self):
+        return '|' + self.node.name
+
+    def childCount(self):
+        self._children = scene.children(self.node.name)
+        return len(self._children)
+
+    def child(self, index):
+        if not hasattr(self, '_children'):
+            self._children = scene.children(self.node.name)
+        return MObject(scene.get(self._children[index]))
+
+
+class MFnTransform(MFnDagNode):
+
+    def rotatePivot(self, space):
+        scene.calls['api.MFnTransform.rotatePivot'] += 1
+        return MPoint(*self.node.pivot)
+
+    def translation(self, space):
+        scene.calls['api.MFnTransform.translation'] += 1
+        return MVector(*self.node.attrs.get('translate', (0.0, 0.0, 0.0)))
+
+    def scale(self):
+        scene.calls['api.MFnTransform.scale'] += 1
+        return [float(self.node.attrs.get(axis, 1.0)) for axis in ('sx', 'sy', 'sz')]
+
+
+class MFnMesh(MFnDagNode):
+
+    def create(self, vertices, polygonCounts, polygonConnects, uValues=None, vValues=None, parent=None):
+        scene.calls['api.MFnMesh.create'] += 1
+        node = scene.add(scene.unique_name('polySurface'))
+        node.points = list(vertices)
+        node.counts = list(polygonCounts)
+        node.connects = list(polygonConnects)
+        node.uvs = (list(uValues or []), list(vValues or []))
+        self.node = node
+        return MObject(node)
+
+    def setVertexNormals(self, normals, vertexIds, space=None):
+        scene.calls['api.MFnMesh.setVertexNormals'] += 1
+        self.node.normals = dict(zip(vertexIds, normals))
+
+    def createInPlace(self, vertices, polygonCounts, polygonConnects):
+        scene.calls['api.MFnMesh.createInPlace'] += 1
+        self.node.points = list(vertices)
+        self.node.counts = list(polygonCounts)
+        self.node.connects = list(polygonConnects)
+
+    def getPoints(self, space=None):
+        scene.calls['api.MFnMesh.getPoints'] += 1
+        return MPointArray(tuple(point) + (1.0,) for point in self.node.points)
+
+    def getVertices(self):
+        scene.calls['api.MFnMesh.getVertices'] += 1
+        connects = getattr(self.node, 'connects', range(len(self.node.points)))
+        return MIntArray(self.node.counts), MIntArray(connects)
+
+    def getTriangles(self):
+        # fan triangulation, good enough for the convex faces benchmarks use
+        scene.calls['api.MFnMesh.getTriangles'] += 1
+        tri_counts = []
+        tri_vertices = []
+        start = 0
+        for count in self.node.counts:
+            face = self.node.connects[start:start + count]
+            tri_counts.append(count - 2)
+            for i in range(1, count - 1):
+                tri_vertices.extend((face[0], face[i], face[i + 1]))
+            start += count
+        return MIntArray(tri_counts), MIntArray(tri_vertices)
+
+    def getUVs(self, uvSet=None):
+        scene.calls['api.MFnMesh.getUVs'] += 1
+        us, vs = getattr(self.node, 'uvs', ([], []))
+        return MFloatArray(us), MFloatArray(vs)
+
+    def getAssignedUVs(self, uvSet=None):
+        # uvs are shared with the vertices, one per vertex
+        scene.calls['api.MFnMesh.getAssignedUVs'] += 1
+        if not getattr(self.node, 'uvs', ([], []))[0]:
+            return MIntArray([0] * len(self.node.counts)), MIntArray()
+        return MIntArray(self.node.counts), MIntArray(self.node.connects)
+
+    def numVertices(self):
+        return len(self.node.points)
+
+    def numPolygons(self):
+        return len(self.node.counts)
+
+
+# api 1.0 (maya.OpenMaya and maya.OpenMayaFX), used by the particle tools.
+# Results come back through out arguments rather than return values so these
+# are kept apart from the api 2.0 classes above
+
+class MObject1(object):
+
+    def __init__(self, node=None):
+        self.node = node
+
+    def isNull(self):
+        return self.node is None
+
+
+class MDagPath1(object):
+
+    def __init__(self):
+        self._node = None
+
+    @staticmethod
+    def getAPathTo(mobject, path):
+        path._node = mobject.node
+
+    def node(self):
+        return MObject1(self._node)
+
+    def extendToShape(self):
+        children = [child for child in scene.children(self._node.name) if scene.get(child).type != 'transform']
+        if children:
+            self._node = scene.get(children[0])
+
+    def partialPathName(self):
+        return self._node.name
+
+    def fullPathName(self):
+        return '|' + self._node.name
+
+
+class MSelectionList1(object):
+
+    def __init__(self):
+        self.nodes = []
+
+    def add(self, name):
+        node = scene.get(name)
+        if node is None:
+            raise RuntimeError('(kInvalidParameter): Object does not exist')
+        self.nodes.append(node)
+
+    def getDependNode(self, index, mobject):
+        mobject.node = self.nodes[index]
+
+    def getDagPath(self, index, path):
+        path._node = self.nodes[index]
+
+
+class _Array1(list):
+
+    def length(self):
+        return len(self)
+
+
+class MPlugArray1(_Array1):
+    pass
+
+
+class MIntArray1(_Array1):
+    pass
+
+
+class MVectorArray1(_Array1):
+    pass
+
+
+class MDoubleArray1(_Array1):
+
+    def __init__(self, *args):
+        # (), (length, value) or (double pointer, length)
+        if not args:
+            values = []
+        elif isinstance(args[0], list):
+            values = args[0][:args[1]]
+        else:
+            values = [args[1] if len(args) > 1 else 0.0] * args[0]
+        super(MDoubleArray1, self).__init__(values)
+
+
+class MScriptUtil(object):
+
+    def __init__(self):
+        self.values = []
+
+    def createFromList(self, values, length):
+        self.values = list(values)[:length]
+
+    def asDoublePtr(self):
+        return self.values
+
+    def asFloat2Ptr(self):
+        return [self.values]
+
+    @staticmethod
+    def getFloat2ArrayItem(ptr, row, column):
+        return ptr[row][column]
+
+
+class MPlug1(object):
+
+    def __init__(self, node, name, index=None):
+        self._node = node
+        self.attr = name
+        self.index = index
+
+    def node(self):
+        return MObject1(self._node)
+
+    def name(self):
+        if self.index is None:
+            return '{}.{}'.format(self._node.name, self.attr)
+        return '{}.{}[{}]'.format(self._node.name, self.attr, self.index)
+
+    def numConnectedElements(self):
+        return len(getattr(self._node, 'goals', []))
+
+    def elementByPhysicalIndex(self, index):
+        return MPlug1(self._node, self.attr, index)
+
+    def connectedTo(self, plugs, as_dst, as_src):
+        if as_dst and self.attr == 'goalGeometry' and self.index is not None:
+            plugs.append(MPlug1(self._node.goals[self.index], 'worldMesh'))
+
+
+class MFnDependencyNode1(object):
+
+    def __init__(self, mobject=None):
+        self.node = getattr(mobject, 'node', None)
+
+    def name(self):
+        return self.node.name
+
+    def object(self):
+        return MObject1(self.node)
+
+    def hasAttribute(self, name):
+        return name in self.node.attrs
+
+    def findPlug(self, name):
+        if name not in self.node.attrs:
+            raise RuntimeError('(kInvalidParameter): No element at given index')
+        return MPlug1(self.node, name)
+
+    def addAttribute(self, attr):
+        scene.calls['api1.MFnDependencyNode.addAttribute'] += 1
+        self.node.attrs.setdefault(attr.name, None)
+
+
+class MFnMesh1(object):
+
+    def __init__(self, path=None):
+        self._node = path._node if path is not None else None
+
+    def setObject(self, path):
+        self._node = path._node
+
+    def fullPathName(self):
+        return '|' + self._node.name
+
+
+class MFnNumericData(object):
+    kDoubleArray = 8
+
+
+class _Attribute1(object):
+
+    def __init__(self, name):
+        self.name = name
+
+
+class MFnTypedAttribute(object):
+
+    def create(self, long_name, short_name, attr_type):
+        return _Attribute1(long_name)
+
+
+class MDGModifier(object):
+
+    def __init__(self):
+        self.queued = []
+
+    def addAttribute(self, mobject, attr):
+        self.queued.append((mobject.node, attr))
+
+    def doIt(self):
+        scene.calls['api1.MDGModifier.doIt'] += 1
+        for node, attr in self.queued:
+            node.attrs.setdefault(attr.name, None)
+        self.queued = []
+
+
+class MFnParticleSystem(object):
+
+    def __init__(self, path=None):
+        self.node = path._node
+
+    def count(self):
+        return len(self.node.points)
+
+    def fullPathName(self):
+        return '|' + self.node.name
+
+    def position(self, positions):
+        scene.calls['api1.MFnParticleSystem.position'] += 1
+        positions.extend(MVector(*point) for point in self.node.points)
+
+    def particleIds(self, ids):
+        scene.calls['api1.MFnParticleSystem.particleIds'] += 1
+        ids.extend(self.node.ids)
+
+    def hasAttribute(self, name):
+        return name in self.node.attrs
+
+    def getPerParticleAttribute(self, name, values):
+        scene.calls['api1.MFnParticleSystem.getPerParticleAttribute'] += 1
+        values.extend(self.node.attrs[name])
+
+    def setPerParticleAttribute(self, name, values):
+        scene.calls['api1.MFnParticleSystem.setPerParticleAttribute'] += 1
+        self.node.attrs[name] = list(values)
+
+    def saveInitialState(self):
+        scene.calls['api1.MFnParticleSystem.saveInitialState'] += 1
+        for name, values in self.node.attrs.items():
+            if isinstance(values, list) and name + '0' in self.node.attrs:
+                self.node.attrs[name + '0'] = list(values)
+
+
+class MTime(object):
+
+    kFilm = 6
+
+    def __init__(self, value=0.0, unit=kFilm):
+        self.value = value
+
+    def asUnits(self, unit):
+        return self.value
+
+    @staticmethod
+    def uiUnit():
+        return MTime.kFilm
+
+
+class MMessage(object):
+
+    @staticmethod
+    def removeCallback(callback_id):
+        scene.callbacks.pop(callback_id, None)
+
+
+class MDGMessage(object):
+
+    @staticmethod
+    def addTimeChangeCallback(func, client_data=None):
+        callback_id = len(scene.callbacks) + 1
+        while callback_id in scene.callbacks:
+            callback_id += 1
+        scene.callbacks[callback_id] = (func, client_data)
+        return callback_id
+
+
+def set_time(frame):
+    """
+    Change the current frame and run the time change callbacks, like
+    scrubbing the timeline
+    """
+
+    scene.time = float(frame)
+
+    # particles go back to their initial state at their start frame
+    for node in scene.nodes.values():
+        if node.type == 'nParticle' and scene.time <= node.attrs['startFrame']:
+            for name, values in node.attrs.items():
+                if isinstance(values, list) and isinstance(node.attrs.get(name + '0'), list):
+                    node.attrs[name] = list(node.attrs[name + '0'])
+
+    for func, client_data in scene.callbacks.values():
+        func(MTime(scene.time), client_data)
+
+
+class MFnNurbsCurve(MFnDagNode):
+
+    kOpen = 1
+    kClosed = 2
+    kPeriodic = 3
+
+    def create(self, cvs, knots, degree, form, is2D, rational, parent=None):
+        scene.calls['api.MFnNurbsCurve.create'] += 1
+        node = scene.add(scene.unique_name('curveShape'), 'nurbsCurve', getattr(parent, 'node', None))
+        node.points = [tuple(cv)[:3] for cv in cvs]
+        node.knots = list(knots)
+        node.degree = degree
+        self.node = node
+        return MObject(node)
+
+
+def _mel_eval(command):
+    scene.calls['mel.eval'] += 1
+    return None
+
+
+def _module(name, **members):
+    module = types.ModuleType(name)
+    module.__dict__.update(members)
+    return module
+
+
+def install():
+    """
+    Put the stand-in maya modules into sys.modules. If maya can really be
+    imported it is initialised and used instead
+    :return: the stand-in scene, or None if real maya is being used
+    """
+
+    # already installed, or maya is already running
+    if 'maya.cmds' in sys.modules:
+        return scene if isinstance(sys.modules['maya.cmds'], _Cmds) else None
+
+    try:
+        import maya.standalone
+        maya.standalone.initialize()
+        return None
+    except ImportError:
+        pass
+
+    api_members = dict(MObject=MObject,
+                       MFn=MFn,
+                       MSpace=MSpace,
+                       MVector=MVector,
+                       MPoint=MPoint,
+                       MDagPath=MDagPath,
+                       MSelectionList=MSelectionList,
+                       MPlug=MPlug,
+                       MUuid=MUuid,
+                       MFnTransform=MFnTransform,
+                       MPointArray=MPointArray,
+                       MFloatPointArray=MFloatPointArray,
+                       MIntArray=MIntArray,
+                       MFloatArray=MFloatArray,
+                       MDoubleArray=MDoubleArray,
+                       MVectorArray=MVectorArray,
+                       MFnDependencyNode=MFnDependencyNode,
+                       MFnDagNode=MFnDagNode,
+                       MFnMesh=MFnMesh,
+                       MFnNurbsCurve=MFnNurbsCurve,
+                       MFnDoubleArrayData=MFnDoubleArrayData,
+                       MFnVectorArrayData=MFnVectorArrayData,
+                       MTime=MTime,
+                       MMessage=MMessage,
+                       MDGMessage=MDGMessage)
+
+    api1_members = dict(MObject=MObject1,
+                        MSpace=MSpace,
+                        MVector=MVector,
+                        MPoint=MPoint,
+                        MDagPath=MDagPath1,
+                        MSelectionList=MSelectionList1,
+                        MPlug=MPlug1,
+                        MPlugArray=MPlugArray1,
+                        MIntArray=MIntArray1,
+                        MDoubleArray=MDoubleArray1,
+                        MVectorArray=MVectorArray1,
+                        MScriptUtil=MScriptUtil,
+                        MFnDependencyNode=MFnDependencyNode1,
+                        MFnMesh=MFnMesh1,
+                        MFnNumericData=MFnNumericData,
+                        MFnTypedAttribute=MFnTypedAttribute,
+                        MDGModifier=MDGModifier)
+
+    cmds = _Cmds('maya.cmds')
+    api = _module('maya.api')
+    api.OpenMaya = _module('maya.api.OpenMaya', **api_members)
+
+    maya = _module('maya', cmds=cmds, api=api)
+    maya.mel = _module('maya.mel', eval=_mel_eval)
+    maya.OpenMaya = _module('maya.OpenMaya', **api1_members)
+    maya.OpenMayaFX = _module('maya.OpenMayaFX', MFnParticleSystem=MFnParticleSystem)
+
+    sys.modules['maya'] = maya
+    sys.modules['maya.cmds'] = cmds
+    sys.modules['maya.mel'] = maya.mel
+    sys.modules['maya.api'] = api
+    sys.modules['maya.api.OpenMaya'] = api.OpenMaya
+    sys.modules['maya.OpenMaya'] = maya.OpenMaya
+    sys.modules['maya.OpenMayaFX'] = maya.OpenMayaFX
+
+    return scene
@@ -0,0 +1,258 @@
+"""
+Times the main stages of the osm, buildings and particle tools at a few
+scales and writes the results to a json file, optionally comparing them with
+the results of an earlier run to catch regressions. Stages:
+
+    parse          OSMParser.parse of a synthetic osm file, no cache
+    parse_cached   OSMParser.parse loading the binary cache
+    build          OSMParser.build, one object per building (up to --single-max)
+    build_batched  OSMParser.build into combined meshes
+    extrude        buildings_manager.extrude_batched
+    heights        height control evaluation of every building
+    initial_state  particles.set_initial_state on a goaled particle system
+    initial_cached the same again, read back from the particle cache
+
+Runs headless against the maya stand-in, where the maya command counts are
+recorded as well, or against maya under mayapy.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import random
+import platform
+import tempfile
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import maya_standin
+scene = maya_standin.install()
+
+import numpy as np
+import maya.cmds as cmds
+import maya.OpenMaya as om
+import maya.OpenMayaFX as omfx
+
+import particles
+import osm_manager
+import particle_cache
+import buildings_manager
+import synthetic_osm
+import synthetic_particles
+
+
+# buildings, height controls, particles and goal sphere rings at each scale
+SCALES = {'small': {'buildings': 1000, 'ctrls': 20, 'particles': 1000, 'rings': 32},
+          'medium': {'buildings': 10000, 'ctrls': 50, 'particles': 10000, 'rings': 64},
+          'large': {'buildings': 50000, 'ctrls': 100, 'particles': 100000, 'rings': 128}}
+
+
+def new_scene():
+    if scene:
+        maya_standin.reset()
+    else:
+        cmds.file(new=True, force=True)
+
+
+def timed(func, *args, **kwargs):
+    """
+    Run a stage
+    :return: dict of the seconds it took and, under the stand-in, the number
+             of maya commands it called
+    """
+
+    calls = scene.total_calls() if scene else None
+
+    start = time.time()
+    func(*args, **kwargs)
+    result = {'seconds': time.time() - start}
+
+    if scene:
+        result['commands'] = scene.total_calls() - calls
+
+    return result
+
+
+def osm_stages(scale, args):
+    """
+    Time the parse, build, extrude and height stages on a synthetic osm file
+    """
+
+    osm_file = os.path.join(tempfile.gettempdir(), 'bench_suite_{}.osm'.format(scale['buildings']))
+    if not os.path.exists(osm_file):
+        synthetic_osm.write_osm(osm_file, scale['buildings'])
+
+    results = {}
+
+    parser = osm_manager.OSMParser(osm_file)
+    results['parse'] = timed(parser.parse, use_cache=False)
+
+    # make sure the cache is written before timing loading it
+    osm_manager.OSMParser(osm_file).parse(use_cache=True)
+
+    parser = osm_manager.OSMParser(osm_file)
+    results['parse_cached'] = timed(parser.parse, use_cache=True)
+
+    if scale['buildings'] <= args.single_max:
+        new_scene()
+        results['build'] = timed(parser.build)
+
+    new_scene()
+    results['build_batched'] = timed(parser.build, batched=True)
+    results['extrude'] = timed(buildings_manager.extrude_batched)
+
+    # height controls scattered over the buildings
+    _, _, centres = parser.project_ways([way for way in parser.ways if 'building' in way.tags])
+    rng = random.Random(0)
+    low, high = centres.min(axis=0), centres.max(axis=0)
+    size = (high - low).max()
+    ctrls = [{'ctrl_pos': (rng.uniform(low[0], high[0]), rng.uniform(low[1], high[1]), 0.0),
+              'ctrl_radius': rng.uniform(size * 0.02, size * 0.2),
+              'ctrl_height': rng.uniform(1000, 10000),
+              'ctrl_name': 'ctrl{}'.format(i)} for i in range(scale['ctrls'])]
+
+    results['heights'] = timed(buildings_manager._evaluate_heights, [tuple(centre) for centre in centres.tolist()], ctrls)
+
+    return results
+
+
+def particle_stages(scale, args):
+    """
+    Time working out the initial state of a particle system, then reading it
+    back from the cache
+    """
+
+    new_scene()
+    np_shape, mesh = synthetic_particles.goaled_system(scale['particles'], scale['rings'])
+    cmds.goal(np_shape, g=mesh, w=1)
+
+    sel_list = om.MSelectionList()
+    sel_list.add(np_shape)
+    np_obj = om.MObject()
+    np_dag = om.MDagPath()
+    sel_list.getDependNode(0, np_obj)
+    sel_list.getDagPath(0, np_dag)
+
+    np_node = om.MFnDependencyNode(np_obj)
+    np_fn = omfx.MFnParticleSystem(np_dag)
+
+    cache_dir = particle_cache.CACHE_DIR
+    particle_cache.CACHE_DIR = tempfile.mkdtemp(prefix='bench_suite')
+
+    try:
+        results = {'initial_state': timed(particles.set_initial_state, np_node, np_fn),
+                   'initial_cached': timed(particles.set_initial_state, np_node, np_fn)}
+    finally:
+        shutil.rmtree(particle_cache.CACHE_DIR)
+        particle_cache.CACHE_DIR = cache_dir
+
+    return results
+
+
+def run(scales, args):
+    """
+    Run every stage at every scale, keeping the quickest of the repeats
+    :return: dict of scale to stage to results
+    """
+
+    results = {}
+
+    for name in scales:
+        scale = SCALES[name]
+        results[name] = {}
+
+        for _ in range(args.repeat):
+            stages = osm_stages(scale, args)
+            stages.update(particle_stages(scale, args))
+
+            for stage, result in stages.iteritems():
+                best = results[name].get(stage)
+                if best is None or result['seconds'] < best['seconds']:
+                    results[name][stage] = result
+
+    return results
+
+
+def compare(results, previous, tolerance):
+    """
+    Print the results next to an earlier run
+    :param tolerance: how many times slower a stage can get before it counts
+                      as a regression
+    :return: list of (scale, stage) that regressed
+    """
+
+    regressions = []
+
+    print '{:<8} {:<16} {:>10} {:>10} {:>7}'.format('scale', 'stage', 'before', 'after', 'ratio')
+
+    for scale in sorted(results):
+        for stage in sorted(results[scale]):
+            after = results[scale][stage]['seconds']
+            before = previous.get(scale, {}).get(stage, {}).get('seconds')
+            if before is None:
+                print '{:<8} {:<16} {:>10} {:>9.3f}s {:>7}'.format(scale, stage, '-', after, '-')
+                continue
+
+            ratio = after / max(before, 1e-6)
+            flag = ''
+            # stages of a few milliseconds are mostly noise, ignore tiny changes
+            if ratio > tolerance and after - before > 0.01:
+                regressions.append((scale, stage))
+                flag = ' slower'
+
+            print '{:<8} {:<16} {:>9.3f}s {:>9.3f}s {:>6.2f}x{}'.format(scale, stage, before, after, ratio, flag)
+
+    return regressions
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--scales', nargs='+', default=['small', 'medium'], choices=sorted(SCALES))
+    arg_parser.add_argument('--repeat', type=int, default=1, help='runs of each scale, the quickest is kept')
+    arg_parser.add_argument('--single-max', type=int, default=10000,
+                            help='most buildings to time the one object per building build on')
+    arg_parser.add_argument('--output', default=os.path.join(tempfile.gettempdir(), 'bench_suite.json'),
+                            help='json file to write the results to')
+    arg_parser.add_argument('--compare', help='json results of an earlier run to compare against')
+    arg_parser.add_argument('--tolerance', type=float, default=1.25,
+                            help='how many times slower than the earlier run a stage can be')
+    args = arg_parser.parse_args()
+
+    # the tools print as they go, only the results are wanted here
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        results = run(args.scales, args)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+    report = {'python': platform.python_version(),
+              'platform': platform.platform(),
+              'maya': 'stand-in' if scene else cmds.about(version=True),
+              'numpy': np.__version__,
+              'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+              'results': results}
+
+    with open(args.output, 'w') as out:
+        json.dump(report, out, indent=2, sort_keys=True)
+
+    previous = {}
+    if args.compare:
+        with open(args.compare) as old:
+            previous = json.load(old)['results']
+
+    regressions = compare(results, previous, args.tolerance)
+
+    print 'results written to {}'.format(args.output)
+
+    if regressions:
+        print '{} stages regressed'.format(len(regressions))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""
+Writes synthetic osm files for benchmarking the osm tools
+"""
+
+import random
+import argparse
+from math import sin, cos, pi
+
+
+HEADER = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+          '<osm version="0.6" generator="synthetic_osm">\n'
+          ' <bounds minlat="{}" minlon="{}" maxlat="{}" maxlon="{}"/>\n')
+
+BUILDING_TAGS = ['yes', 'house', 'residential', 'commercial', 'apartments']
+
+# highway values roads are given, weighted roughly like a city
+HIGHWAY_TAGS = ['primary', 'secondary', 'tertiary'] + ['residential'] * 4 + ['service'] * 2 + ['footway'] * 3
+
+# the sort of tags real buildings carry on top of building, with a few values each
+EXTRA_TAGS = [('source', ['bing', 'survey', 'os_opendata']),
+              ('addr:city', ['London']),
+              ('addr:postcode', ['SW1A 1AA', 'SE1 7PB', 'N1 9GU', 'E1 6AN']),
+              ('addr:street', ['High Street', 'Station Road', 'Church Lane', 'Park Road', 'Victoria Road']),
+              ('addr:housenumber', [str(n) for n in range(1, 200)]),
+              ('roof:shape', ['flat', 'gabled', 'hipped']),
+              ('building:material', ['brick', 'concrete', 'glass'])]
+
+
+def write_osm(path, buildings=1000, nodes_per_building=5, extra_nodes=0,
+              min_lat=51.5, min_lon=-0.15, size=0.05, seed=0, extra_tags=0,
+              roads=0, nodes_per_road=8):
+    """
+    Write a synthetic osm file of square-ish buildings
+    :param path: file to write
+    :param buildings: number of building ways
+    :param nodes_per_building: number of unique nodes in each footprint
+    :param extra_nodes: number of untagged nodes not used by any building
+    :param size: width and height of the bounds in degrees
+    :param seed: random seed so the same arguments give the same file
+    :param extra_tags: number of tags from EXTRA_TAGS to give each building
+    :param roads: number of highway ways, each a wandering line of nodes
+    :param nodes_per_road: number of nodes in each road
+    :return: path of the file written
+    """
+
+    rng = random.Random(seed)
+    max_lat = min_lat + size
+    max_lon = min_lon + size
+
+    # footprints are roughly 10-40m across
+    radius = 0.0001
+
+    with open(path, 'w') as osm:
+        osm.write(HEADER.format(min_lat, min_lon, max_lat, max_lon))
+
+        node_id = 1
+        for i in range(buildings):
+            lat = rng.uniform(min_lat, max_lat)
+            lon = rng.uniform(min_lon, max_lon)
+            scale = rng.uniform(0.5, 2.0) * radius
+
+            for j in range(nodes_per_building):
+                angle = 2 * pi * j / nodes_per_building
+                osm.write(' <node id="{}" version="1" lat="{:.7f}" lon="{:.7f}"/>\n'.format(
+                    node_id, lat + scale * cos(angle), lon + scale * sin(angle)))
+                node_id += 1
+
+        # every hundredth extra node gets a tag like a real point of interest
+        for i in range(extra_nodes):
+            node = ' <node id="{}" version="1" lat="{:.7f}" lon="{:.7f}"'.format(
+                node_id, rng.uniform(min_lat, max_lat), rng.uniform(min_lon, max_lon))
+            if i % 100 == 0:
+                osm.write(node + '>\n  <tag k="amenity" v="bench"/>\n </node>\n')
+            else:
+                osm.write(node + '/>\n')
+            node_id += 1
+
+        # roads wander off from a random start in roughly 50m steps
+        road_start = node_id
+        step = 0.0005
+        for i in range(roads):
+            lat = rng.uniform(min_lat, max_lat)
+            lon = rng.uniform(min_lon, max_lon)
+            heading = rng.uniform(0, 2 * pi)
+
+            for j in range(nodes_per_road):
+                osm.write(' <node id="{}" version="1" lat="{:.7f}" lon="{:.7f}"/>\n'.format(node_id, lat, lon))
+                heading += rng.uniform(-0.5, 0.5)
+                lat += step * cos(heading)
+                lon += step * sin(heading)
+                node_id += 1
+
+        way_id = 1
+        for i in range(buildings):
+            first = i * nodes_per_building + 1
+            osm.write(' <way id="{}" version="1">\n'.format(way_id))
+            for ref in range(first, first + nodes_per_building):
+                osm.write('  <nd ref="{}"/>\n'.format(ref))
+            osm.write('  <nd ref="{}"/>\n'.format(first))
+            osm.write('  <tag k="building" v="{}"/>\n'.format(rng.choice(BUILDING_TAGS)))
+            if i % 4 == 0:
+                osm.write('  <tag k="building:levels" v="{}"/>\n'.format(rng.randint(1, 12)))
+            for key, values in EXTRA_TAGS[:extra_tags]:
+                osm.write('  <tag k="{}" v="{}"/>\n'.format(key, rng.choice(values)))
+            osm.write(' </way>\n')
+            way_id += 1
+
+        for i in range(roads):
+            first = road_start + i * nodes_per_road
+            osm.write(' <way id="{}" version="1">\n'.format(way_id))
+            for ref in range(first, first + nodes_per_road):
+                osm.write('  <nd ref="{}"/>\n'.format(ref))
+            osm.write('  <tag k="highway" v="{}"/>\n'.format(rng.choice(HIGHWAY_TAGS)))
+            osm.write(' </way>\n')
+            way_id += 1
+
+        osm.write('</osm>\n')
+
+    return path
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument('path')
+    arg_parser.add_argument('--buildings', type=int, default=1000)
+    arg_parser.add_argument('--nodes-per-building', type=int, default=5)
+    arg_parser.add_argument('--extra-nodes', type=int, default=0)
+    arg_parser.add_argument('--seed', type=int, default=0)
+    arg_parser.add_argument('--extra-tags', type=int, default=0)
+    arg_parser.add_argument('--roads', type=int, default=0)
+    arg_parser.add_argument('--nodes-per-road', type=int, default=8)
+    args = arg_parser.parse_args()
+
+    write_osm(args.path, args.buildings, args.nodes_per_building, args.extra_nodes,
+              seed=args.seed, extra_tags=args.extra_tags, roads=args.roads, nodes_per_road=args.nodes_per_road)
@@ -0,0 +1,86 @@
+"""
+Synthetic goal meshes and particle systems for benchmarking the particle
+tools. Works against the maya stand-in or maya itself, install the stand-in
+(maya_standin.install) before importing this
+"""
+
+import numpy as np
+import maya.cmds as cmds
+import maya.api.OpenMaya as om2
+
+import maya_standin
+
+
+def sphere_mesh(rings, segments, radius=100.0):
+    """
+    Create a uv sphere goal mesh with one uv per vertex
+    :return: name of the mesh
+    """
+
+    # rings of vertices from the bottom to the top, the seam vertex is
+    # repeated so the uvs can wrap
+    theta = np.linspace(0.05, np.pi - 0.05, rings)
+    phi = np.linspace(0, 2 * np.pi, segments + 1)
+    theta, phi = np.meshgrid(theta, phi, indexing='ij')
+
+    points = np.column_stack(((radius * np.sin(theta) * np.cos(phi)).ravel(),
+                              (radius * np.sin(theta) * np.sin(phi)).ravel(),
+                              (radius * -np.cos(theta)).ravel()))
+    us = (phi / (2 * np.pi)).ravel()
+    vs = (theta / np.pi).ravel()
+
+    ring, seg = np.meshgrid(np.arange(rings - 1), np.arange(segments), indexing='ij')
+    first = (ring * (segments + 1) + seg).ravel()
+    connects = np.column_stack((first, first + 1, first + segments + 2, first + segments + 1)).ravel()
+
+    mesh_fn = om2.MFnMesh()
+    mesh_obj = mesh_fn.create(om2.MPointArray(points.tolist()),
+                              om2.MIntArray([4] * len(first)),
+                              om2.MIntArray(connects.tolist()),
+                              om2.MFloatArray(us.tolist()),
+                              om2.MFloatArray(vs.tolist()))
+    if maya_standin.install() is None:
+        mesh_fn.assignUVs(om2.MIntArray([4] * len(first)), om2.MIntArray(connects.tolist()))
+
+    return om2.MFnDependencyNode(mesh_obj).name()
+
+
+def random_particles(count, radius=100.0, spread=0.1, seed=0, fill=False):
+    """
+    Get particles scattered in a shell around the sphere
+    :param spread: how far in and out of the sphere the shell goes, as a
+                   fraction of the radius
+    :param fill: scatter the particles evenly through the inside of the sphere
+                 instead, e.g. a goal the particles start inside of
+    """
+
+    rng = np.random.RandomState(seed)
+    directions = rng.normal(size=(count, 3))
+    directions /= np.sqrt((directions**2).sum(axis=1))[:, None]
+
+    if fill:
+        return directions * (radius * rng.uniform(0, 1, count) ** (1.0 / 3))[:, None]
+
+    return directions * rng.uniform(radius * (1 - spread), radius * (1 + spread), count)[:, None]
+
+
+def particle_system(count, radius=100.0, spread=0.1, seed=0):
+    """
+    Create an nParticle system of particles scattered around a sphere of radius
+    :return: name of the nParticle shape
+    """
+
+    positions = [tuple(position) for position in random_particles(count, radius, spread, seed).tolist()]
+
+    return cmds.nParticle(p=positions)[1]
+
+
+def goaled_system(count, rings=64, radius=100.0, spread=0.1, seed=0):
+    """
+    Create a sphere goal mesh and a particle system around it, not yet goaled
+    :return: (nParticle shape, goal mesh)
+    """
+
+    mesh = sphere_mesh(rings, rings * 2, radius)
+
+    return particle_system(count, radius, spread, seed), mesh
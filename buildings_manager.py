@@ -1,9 +1,30 @@
 import math
 from math import sqrt, pow
-import random
+from collections import defaultdict
+from itertools import izip
 
 import maya.cmds as cmds
+import maya.api.OpenMaya as om2
 
+import profiling
+import scene_query
+import random_streams
+
+# without numpy the heights are worked out a building at a time
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# what the last incremental build saw and applied, see build(incremental=True).
+# Nodes are kept by uuid so a new scene or a reimport with the same names
+# doesn't pick up the old nodes
+_last_build = {'group': None,
+               'uuids': None,
+               'grid': None,
+               'ctrls': {},
+               'buildings': {}}
 
 
 
@@ -32,26 +53,234 @@ def _create_height_ctrl(radius = 10000, height=10000):
 def extrude_building(building=None, height=None):
     """
     Given an object will extrude it upwards
+    :param height: how far to extrude, defaults to the height from the osm
+                   tags and then to random stories from the footprint area
+    :return: name of the extrude node
     """
 
     building_face = '{}.f[0]'.format(building)
 
     if not height:
-        building_scale = math.ceil(cmds.polyEvaluate(building_face, worldArea=True)/1000000)
+        # read what the build stored on the building with the api rather than
+        # querying it with commands
+        building_fn = om2.MFnDependencyNode(scene_query.get_dag_path(building).node())
+
+        if building_fn.hasAttribute('osmHeight'):
+            height = building_fn.findPlug('osmHeight', False).asDouble()
+
+    if not height:
+        # the stories come from the way's own stream, buildings from before
+        # the way id was stored fall back to their name
+        way_id = building
+        if building_fn.hasAttribute('osmWayId'):
+            way_id = int(building_fn.findPlug('osmWayId', False).asDouble())
+
+        height = get_story_heights([cmds.polyEvaluate(building_face, worldArea=True)], [way_id])[0]
+
+    extrude = cmds.polyExtrudeFacet(building_face, kft=True, ltz=height, sma=0)
+    cmds.polyNormalPerVertex(building, ufn=True)
+
+    return extrude[0]
+
+
+def get_story_heights(areas, ids=None):
+    """
+    Get a height for buildings from their footprint area, a random number of
+    stories scaled by how big the building is
+    :param areas: footprint area of each building
+    :param ids: stable id of each building (osm way id or name), the stories
+                are drawn from each building's own stream so the same building
+                always gets the same height. Defaults to the building's index
+    :return: list of heights
+    """
+
+    heights = []
+
+    if ids is None:
+        ids = range(len(areas))
+    stories = random_streams.randint('buildings', 'stories', list(ids), 1, 3)
+
+    for area, num_stories in izip(areas, stories):
+        building_scale = math.ceil(area/1000000)
         if building_scale > 12:
             building_scale = 12
 
-        num_stories = math.floor(random.uniform(1, 3))*building_scale
+        num_stories = num_stories*building_scale
 
-        height = 450 * num_stories
+        heights.append(450 * num_stories)
 
-    cmds.polyExtrudeFacet(building_face, kft=True, ltz=height, sma=0)
-    cmds.polyNormalPerVertex(building, ufn=True)
+    return heights
+
+
+def extrude_footprints(points, counts, heights=None, ids=None):
+    """
+    Work out the walls and roofs for many footprints at once. Each building
+    gets a bottom and a top ring of vertices, one roof face and a quad per
+    wall, with the roof always facing up. Needs numpy
+    :param points: (P, 3) array of footprint vertices, one building after another
+    :param counts: (B,) number of vertices in each footprint
+    :param heights: (B,) height to extrude each footprint along z, if None the
+                    random stories heights are used from the footprint areas
+    :param ids: stable id of each building for the random stories, see get_story_heights
+    :return: (vertices, face_counts, face_connects, heights) where the first
+             three are ready for MFnMesh.create
+    """
+
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    counts = np.asarray(counts, dtype=np.int64)
+
+    num_blds = len(counts)
+    starts = np.zeros(num_blds, dtype=np.int64)
+    np.cumsum(counts[:-1], out=starts[1:])
+
+    # for every point, where its building starts, how many points it has and
+    # which point of the building it is
+    bld_start = np.repeat(starts, counts)
+    bld_count = np.repeat(counts, counts)
+    local = np.arange(len(points)) - bld_start
+    following = bld_start + (local + 1) % bld_count
+
+    # signed area of each footprint, clockwise ones get reversed so the roof
+    # faces up and the walls face out
+    cross = points[:, 0] * points[following, 1] - points[following, 0] * points[:, 1]
+    signed_areas = np.add.reduceat(cross, starts) / 2 if num_blds else np.zeros(0)
+    clockwise = np.repeat(signed_areas < 0, counts)
+
+    if heights is None:
+        heights = get_story_heights(np.abs(signed_areas).tolist(), ids)
+    heights = np.asarray(heights, dtype=np.float64)
+    points = points[np.where(clockwise, bld_start + bld_count - 1 - local, bld_start + local)]
+
+    # vertices are laid out per building as [bottom ring, top ring]
+    vertices = np.empty((len(points) * 2, 3))
+    bottom = 2 * bld_start + local
+    top = bottom + bld_count
+    vertices[bottom] = points
+    vertices[top] = points
+    vertices[top, 2] += np.repeat(heights, counts)
+
+    # faces are laid out per building as [roof, wall 0, wall 1, ...]
+    face_counts = np.full(num_blds + len(points), 4, dtype=np.int64)
+    face_counts[starts + np.arange(num_blds)] = counts
+
+    # each building uses 5 connects per point, n for the roof and 4 per wall
+    face_connects = np.empty(len(points) * 5, dtype=np.int64)
+    block = 5 * bld_start
+    face_connects[block + local] = top
+
+    bottom_next = 2 * bld_start + (local + 1) % bld_count
+    wall = block + bld_count + 4 * local
+    face_connects[wall] = bottom
+    face_connects[wall + 1] = bottom_next
+    face_connects[wall + 2] = bottom_next + bld_count
+    face_connects[wall + 3] = top
+
+    return vertices, face_counts, face_connects, heights
+
+
+@profiling.timed('extrude')
+def extrude_batched(meshes=None, heights=None, history=True):
+    """
+    Extrude every footprint of combined building meshes (see
+    OSMParser.build_batched) in one go, writing all the walls and roofs of a
+    mesh with a single api call rather than a polyExtrudeFacet per building.
+    Needs numpy
+    :param meshes: footprint meshes to extrude, defaults to every combined
+                   mesh in the buildings group
+    :param heights: dict of mesh to per building heights, meshes not in it
+                    use the heights OSMParser.build_batched stored on them in
+                    osmHeight, or random stories heights from the footprint areas
+    :param history: if True the footprint mesh is kept (hidden) and the
+                    buildings are written to a new <mesh>_extruded mesh so
+                    they can be extruded again, if False the footprint mesh is
+                    replaced in place and no extra nodes are left behind,
+                    including a <mesh>_extruded from an earlier run
+    :return: list of the extruded meshes
+    """
+
+    if meshes is None:
+        meshes = [name for name, _ in scene_query.get_children('_buildings')
+                  if cmds.attributeQuery('osmWayId', node=name, exists=True)
+                  and not cmds.attributeQuery('buildingHeight', node=name, exists=True)]
+
+    heights = heights or {}
+    extruded = []
+
+    for mesh in meshes:
+        if cmds.attributeQuery('buildingHeight', node=mesh, exists=True):
+            print '{} is already extruded!'.format(mesh)
+            continue
+
+        mesh_heights = heights.get(mesh)
+        if mesh_heights is None and cmds.attributeQuery('osmHeight', node=mesh, exists=True):
+            mesh_heights = cmds.getAttr('{}.osmHeight'.format(mesh))
+
+        mesh_fn = om2.MFnMesh(scene_query.get_dag_path(mesh))
 
+        with profiling.span('read'):
+            footprint_counts, footprint_connects = mesh_fn.getVertices()
+            points = np.array(mesh_fn.getPoints(om2.MSpace.kObject), dtype=np.float64)[:, :3]
+            points = points[np.array(footprint_connects, dtype=np.int64)]
+            way_ids = cmds.getAttr('{}.osmWayId'.format(mesh))
 
-def build():
+        with profiling.span('walls'):
+            vertices, face_counts, face_connects, mesh_heights = extrude_footprints(points,
+                                                                                  footprint_counts,
+                                                                                  mesh_heights,
+                                                                                  way_ids)
+
+        profiling.count('extruded', len(footprint_counts))
+
+        with profiling.span('create'):
+            vertices = om2.MPointArray(vertices.tolist())
+            face_counts = om2.MIntArray(face_counts.tolist())
+            face_connects = om2.MIntArray(face_connects.tolist())
+
+        if history:
+            result = '{}_extruded'.format(mesh)
+            if cmds.objExists(result):
+                cmds.delete(result)
+
+            with profiling.span('create'):
+                result_fn = om2.MFnMesh()
+                result_obj = result_fn.create(vertices, face_counts, face_connects)
+            result = om2.MFnDependencyNode(result_obj).setName(result)
+            cmds.sets(result, e=True, forceElement='initialShadingGroup')
+
+            parent = cmds.listRelatives(mesh, parent=True)
+            if parent:
+                cmds.parent(result, parent[0])
+            cmds.setAttr('{}.visibility'.format(mesh), False)
+
+            cmds.addAttr(result, ln='osmWayId', dt='doubleArray')
+            cmds.setAttr('{}.osmWayId'.format(result), cmds.getAttr('{}.osmWayId'.format(mesh)), type='doubleArray')
+        else:
+            # a run with history before this one left its mesh next to the
+            # hidden footprint, the footprint takes its place now
+            previous = '{}_extruded'.format(mesh)
+            if cmds.objExists(previous):
+                cmds.delete(previous)
+                cmds.setAttr('{}.visibility'.format(mesh), True)
+
+            with profiling.span('create'):
+                mesh_fn.createInPlace(vertices, face_counts, face_connects)
+            result = mesh
+
+        cmds.addAttr(result, ln='buildingHeight', dt='doubleArray')
+        cmds.setAttr('{}.buildingHeight'.format(result), mesh_heights.tolist(), type='doubleArray')
+
+        extruded.append(result)
+
+    return extruded
+
+
+@profiling.timed('build')
+def build(incremental=False):
     """
     Builds the current scene
+    :param incremental: only update the buildings whose height changed since
+                        the last incremental build, editing their existing
+                        extrude rather than adding another one
     """
 
     ctrls = []
@@ -73,55 +302,304 @@ def build():
         buildings_grp = buildings_grp[0]
 
 
-    # go through the objects in our height ctrls group and get the data that we need from them
-    for i in cmds.listRelatives(height_ctrl_grp, children=True):
+    # go through the objects in our height ctrls group and get the data that we need from them,
+    # all of them are read in one pass over the group
+    with profiling.span('query'):
+        ctrl_names, ctrl_positions, ctrl_radii, ctrl_heights = scene_query.get_height_ctrls(height_ctrl_grp)
+    if np is not None:
+        ctrl_positions, ctrl_radii, ctrl_heights = ctrl_positions.tolist(), ctrl_radii.tolist(), ctrl_heights.tolist()
+
+    for i, name in enumerate(ctrl_names):
 
         data = {}
 
-        data['ctrl_pos'] = cmds.getAttr('{}.translate'.format(i))[0]
-        data['ctrl_radius'] = cmds.getAttr('{}.sx'.format(i))
-        data['ctrl_height'] = cmds.getAttr('{}.height'.format(i))
-        data['ctrl_name'] = i
+        data['ctrl_pos'] = tuple(ctrl_positions[i])
+        data['ctrl_radius'] = ctrl_radii[i]
+        data['ctrl_height'] = ctrl_heights[i]
+        data['ctrl_name'] = name
 
         ctrls.append(data)
 
     buildings = []
 
-    # go through each building and see if it is in range of the ctrl
-    for bld in cmds.listRelatives(buildings_grp, children=True):
-        bld_pos = cmds.xform(bld, q=True, rp=True, ws=True)
+    if incremental:
+        cmds.select(_build_incremental(buildings_grp, ctrls))
+        return
+
+    with profiling.span('query'):
+        bld_names, bld_positions = scene_query.get_pivots(buildings_grp)
+
+    with profiling.span('heights'):
+        bld_heights = _evaluate_heights(bld_positions, ctrls)
+
+    # go through each building that is in range of a ctrl
+    for bld, bld_height in izip(bld_names, bld_heights):
+
+        if bld_height is not None:
+
+            print '{} in radius! Extrude {}'.format(bld, bld_height)
+
+            with profiling.span('extrude'):
+                extrude_building(bld, bld_height)
+
+            buildings.append(bld)
+
+    profiling.count('extruded', len(buildings))
+
+
+
+
+
+    cmds.select(buildings)
 
-        heights = []
 
-        for ctrl in ctrls:
-            ctrl_pos = ctrl['ctrl_pos']
-            ctrl_radius = ctrl['ctrl_radius']
-            ctrl_height = ctrl['ctrl_height']
 
-            mag = get_mag(ctrl_pos, bld_pos)
+
+def _build_incremental(buildings_grp, ctrls):
+    """
+    Update only the buildings affected by height ctrls that changed since the
+    last call. Pivots are only queried again when the buildings change, so
+    tweaking one ctrl costs time in the buildings it touches
+    :param buildings_grp: the buildings group
+    :param ctrls: list of ctrl data dicts as gathered in build()
+    :return: list of the buildings that were updated
+    """
+
+    state = _last_build
+
+    # a different group (new scene, reimport) means nothing we know is valid
+    group_uuid = cmds.ls(buildings_grp, uuid=True)[0]
+    if group_uuid != state['group']:
+        state.update(group=group_uuid, uuids=None, grid=None, ctrls={}, buildings={})
+
+    known = state['buildings']
+
+    ctrl_state = dict((ctrl['ctrl_name'], (tuple(ctrl['ctrl_pos']), ctrl['ctrl_radius'], ctrl['ctrl_height']))
+                      for ctrl in ctrls)
+
+    bld_names, bld_uuids = scene_query.get_uuids(buildings_grp)
+
+    if bld_uuids != state['uuids']:
+        # the buildings changed so everything needs evaluating, keep what we
+        # know about the buildings that are still there
+        for uuid in set(known) - set(bld_uuids):
+            del known[uuid]
+
+        with profiling.span('query'):
+            _, bld_pivots = scene_query.get_pivots(buildings_grp)
+        if np is not None:
+            bld_pivots = bld_pivots.tolist()
+
+        for uuid, pivot in izip(bld_uuids, bld_pivots):
+            record = known.setdefault(uuid, {'height': None, 'extrude': None})
+            record['pivot'] = pivot
+
+        radii = sorted(abs(ctrl['ctrl_radius']) for ctrl in ctrls)
+        state['grid'] = PivotGrid(bld_pivots, radii[len(radii) // 2] if radii else 1)
+        state['uuids'] = bld_uuids
+
+        affected = range(len(bld_uuids))
+
+    else:
+        # the buildings a ctrl affected before and after it changed
+        old_state = state['ctrls']
+        changed = set()
+        for name in set(old_state) | set(ctrl_state):
+            if old_state.get(name) != ctrl_state.get(name):
+                changed.update(ctrl for ctrl in (old_state.get(name), ctrl_state.get(name)) if ctrl)
+
+        affected = set()
+        for ctrl_pos, ctrl_radius, _ in changed:
+            affected.update(state['grid'].query(ctrl_pos, abs(ctrl_radius)))
+        affected = sorted(affected)
+
+    state['ctrls'] = ctrl_state
+
+    bld_heights = _evaluate_heights([known[bld_uuids[i]]['pivot'] for i in affected], ctrls)
+
+    buildings = []
+
+    for i, bld_height in izip(affected, bld_heights):
+        bld = bld_names[i]
+        record = known[bld_uuids[i]]
+
+        if bld_height == record['height']:
+            continue
+
+        # the extrude is kept by uuid too, look it up again if it was deleted
+        extrude = cmds.ls(record['extrude']) if record['extrude'] else None
+        if not extrude:
+            extrude = _find_extrude(bld)
+            record['extrude'] = extrude and cmds.ls(extrude, uuid=True)[0]
+        else:
+            extrude = extrude[0]
+
+        # a building that is out of range of every ctrl now is flattened back down
+        if extrude:
+            cmds.setAttr('{}.localTranslateZ'.format(extrude), bld_height or 0)
+        elif bld_height:
+            extrude = extrude_building(bld, bld_height)
+            record['extrude'] = cmds.ls(extrude, uuid=True)[0]
+        else:
+            continue
+
+        print '{} changed! Height {}'.format(bld, bld_height)
+
+        record['height'] = bld_height
+        buildings.append(bld)
+
+    return buildings
+
+
+def _find_extrude(building):
+    """
+    Get the most recent extrude in a building's history, if it has one
+    """
+
+    extrudes = cmds.ls(cmds.listHistory(building) or [], type='polyExtrudeFace')
+
+    return extrudes[0] if extrudes else None
+
+
+def _evaluate_heights(bld_positions, ctrls):
+    """
+    Get the height of each building, with numpy if we have it
+    :return: list with the height of each building, None if it is out of range
+    """
+
+    if np is None:
+        return get_heights(bld_positions, ctrls)
+
+    heights, in_range = get_heights_np(np.asarray(bld_positions, dtype=np.float64).reshape(-1, 3),
+                                       np.array([ctrl['ctrl_pos'] for ctrl in ctrls], dtype=np.float64).reshape(-1, 3),
+                                       np.array([ctrl['ctrl_radius'] for ctrl in ctrls], dtype=np.float64),
+                                       np.array([ctrl['ctrl_height'] for ctrl in ctrls], dtype=np.float64))
+
+    return [float(height) if hit else None for height, hit in izip(heights, in_range)]
+
+
+def get_heights(bld_positions, ctrls):
+    """
+    Work out the height of each building from the height ctrls that it is in
+    range of, the average of each ctrl's height scaled by how close it is.
+    This is the pure python version, get_heights_np does the same with numpy
+    :param bld_positions: list of building pivots
+    :param ctrls: list of dicts with ctrl_pos, ctrl_radius and ctrl_height
+    :return: list with the height of each building, None if it is out of range
+    """
+
+    # index the buildings so each ctrl only looks at the ones near it
+    radii = sorted(abs(ctrl['ctrl_radius']) for ctrl in ctrls)
+    grid = PivotGrid(bld_positions, radii[len(radii) // 2] if radii else 1)
+
+    bld_heights = defaultdict(list)
+
+    for ctrl in ctrls:
+        ctrl_pos = ctrl['ctrl_pos']
+        ctrl_radius = ctrl['ctrl_radius']
+        ctrl_height = ctrl['ctrl_height']
+
+        for i in grid.query(ctrl_pos, abs(ctrl_radius)):
+            mag = get_mag(ctrl_pos, bld_positions[i])
             mag_ratio = 1 - (mag / ctrl_radius)
 
             #if mag_ratio < 1 and> 0:
             if 0 <= mag_ratio <= 1:
                 height = ctrl_height * mag_ratio
-                heights.append(height)
+                bld_heights[i].append(height)
 
-        if heights:
+    heights = [None] * len(bld_positions)
+    for i, bld_height in bld_heights.iteritems():
+        heights[i] = sum(bld_height) / len(bld_height)
 
-            bld_height = sum(heights) / len(heights)
+    return heights
 
-            print '{} in radius! Extrude {}'.format(bld, bld_height)
 
-            extrude_building(bld, bld_height)
+def get_heights_np(bld_positions, ctrl_positions, ctrl_radii, ctrl_heights, max_elements=1 << 22):
+    """
+    Vectorised get_heights. Building/ctrl distances are worked out as one
+    broadcast, in chunks of buildings so memory stays bounded for big scenes
+    :param bld_positions: (N, 3) array of building pivots
+    :param ctrl_positions: (M, 3) array of ctrl positions
+    :param ctrl_radii: (M,) array of ctrl radii
+    :param ctrl_heights: (M,) array of ctrl heights
+    :param max_elements: max size of the (chunk, M) arrays worked on at once
+    :return: (heights, in_range) arrays of shape (N,), heights are only
+             meaningful where in_range is True
+    """
 
-            buildings.append(bld)
+    num_blds = len(bld_positions)
+    heights = np.zeros(num_blds)
+    in_range = np.zeros(num_blds, dtype=bool)
 
+    if not num_blds or not len(ctrl_positions):
+        return heights, in_range
 
+    chunk = max(1, max_elements // len(ctrl_positions))
 
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for start in range(0, num_blds, chunk):
+            end = min(start + chunk, num_blds)
 
+            offsets = bld_positions[start:end, None, :] - ctrl_positions[None, :, :]
+            mag = np.sqrt(np.einsum('ijk,ijk->ij', offsets, offsets))
+            mag_ratio = 1 - (mag / ctrl_radii)
 
-    cmds.select(buildings)
+            hits = (mag_ratio >= 0) & (mag_ratio <= 1)
+            num_hits = hits.sum(axis=1)
+            total = np.where(hits, ctrl_heights * mag_ratio, 0).sum(axis=1)
+
+            in_range[start:end] = num_hits > 0
+            heights[start:end] = np.where(num_hits > 0, total / np.maximum(num_hits, 1), 0)
+
+    return heights, in_range
+
+
+class PivotGrid(object):
+    """
+    Uniform grid over building pivots so a height control only has to look at
+    the buildings near it rather than every building in the scene
+    """
 
+    def __init__(self, positions, cell_size):
+        self.cell_size = float(cell_size) or 1.0
+        self.cells = defaultdict(list)
+
+        for i, pos in enumerate(positions):
+            self.cells[self._cell(pos)].append(i)
+
+    def _cell(self, pos):
+        return (int(math.floor(pos[0] / self.cell_size)),
+                int(math.floor(pos[1] / self.cell_size)),
+                int(math.floor(pos[2] / self.cell_size)))
+
+    def query(self, centre, radius):
+        """
+        Get the indices of every position in the cells that overlap a sphere.
+        This can include positions just outside the radius, the caller still
+        does the exact distance test
+        """
+
+        lo = self._cell([c - radius for c in centre])
+        hi = self._cell([c + radius for c in centre])
+
+        num_cells = (hi[0] - lo[0] + 1) * (hi[1] - lo[1] + 1) * (hi[2] - lo[2] + 1)
+
+        # a big radius covers more cells than are filled, check the filled ones
+        if num_cells > len(self.cells):
+            cells = [cell for cell in self.cells
+                     if all(lo[axis] <= cell[axis] <= hi[axis] for axis in range(3))]
+        else:
+            cells = [(x, y, z)
+                     for x in range(lo[0], hi[0] + 1)
+                     for y in range(lo[1], hi[1] + 1)
+                     for z in range(lo[2], hi[2] + 1)]
+
+        indices = []
+        for cell in cells:
+            indices.extend(self.cells.get(cell, ()))
+
+        return indices
 
 
 
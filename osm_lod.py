@@ -0,0 +1,365 @@
+"""
+Level of detail for imported osm buildings. The map is split into square
+tiles and each tile is built as one combined, extruded mesh at the level
+chosen for it:
+
+    LOD_FULL    every building as it is in the osm file
+    LOD_SIMPLE  footprints simplified with Douglas-Peucker, small ones culled
+    LOD_BLOCK   buildings merged into one box per block of the map, as tall
+                as the average building in it
+
+Only one level of a tile is visible at a time, levels already built are kept
+hidden so moving the camera back and forth just swaps visibility. The full
+detail is built per tile too, so use this instead of OSMParser.build.
+Needs numpy
+"""
+
+import time
+
+import maya.cmds as cmds
+import maya.api.OpenMaya as om2
+
+import numpy as np
+
+import buildings_manager
+from osm_tiles import TileGrid
+from osm_manager import footprint_areas
+
+
+LOD_FULL = 0
+LOD_SIMPLE = 1
+LOD_BLOCK = 2
+
+LOD_GROUP = '_buildings_lod'
+
+
+def _segment_distances(points, start, end):
+    """
+    Get the distance of 2d points from the segment start-end
+    """
+
+    segment = end - start
+    length = segment.dot(segment)
+    if length == 0:
+        return np.sqrt(((points - start)**2).sum(axis=1))
+
+    t = np.clip((points - start).dot(segment) / length, 0, 1)
+    nearest = start + t[:, None] * segment
+    return np.sqrt(((points - nearest)**2).sum(axis=1))
+
+
+def simplify_ring(points, tolerance):
+    """
+    Simplify a closed footprint with Douglas-Peucker in the xy plane
+    :param points: (N, 3) array of the footprint's points, not repeating the first
+    :param tolerance: max distance a removed point can be from the simplified outline
+    :return: indices of the points to keep, in order
+    """
+
+    num_points = len(points)
+    if num_points <= 3:
+        return np.arange(num_points)
+
+    xy = points[:, :2]
+
+    # a ring has no end points, split it at the first point and the point
+    # furthest from it and simplify both halves
+    furthest = int(((xy - xy[0])**2).sum(axis=1).argmax())
+
+    keep = np.zeros(num_points, dtype=bool)
+    keep[0] = keep[furthest] = True
+
+    # the second half runs from the furthest point back round to the first
+    stack = [(0, furthest), (furthest, num_points)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+
+        distances = _segment_distances(xy[first + 1:last], xy[first], xy[last % num_points])
+        i = int(distances.argmax())
+        if distances[i] > tolerance:
+            split = first + 1 + i
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+
+    return np.nonzero(keep)[0]
+
+
+def simplify_footprints(points, counts, tolerance, min_area):
+    """
+    Simplify many footprints and cull the small ones
+    :param points: (P, 3) array of footprint points, one building after another
+    :param counts: (B,) number of points in each footprint
+    :param tolerance: Douglas-Peucker tolerance
+    :param min_area: footprints smaller than this are dropped
+    :return: (points, counts, kept) where kept is the index of each building
+             that survived
+    """
+
+    areas = footprint_areas(points, counts)
+    starts = np.concatenate(([0], np.cumsum(counts)))
+
+    new_points = []
+    new_counts = []
+    kept = []
+
+    for i, count in enumerate(counts):
+        if areas[i] < min_area:
+            continue
+
+        footprint = points[starts[i]:starts[i + 1]]
+        footprint = footprint[simplify_ring(footprint, tolerance)]
+        if len(footprint) < 3:
+            continue
+
+        new_points.append(footprint)
+        new_counts.append(len(footprint))
+        kept.append(i)
+
+    if not kept:
+        return np.zeros((0, 3)), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    return np.concatenate(new_points), np.array(new_counts, dtype=np.int64), np.array(kept, dtype=np.int64)
+
+
+def block_footprints(points, counts, centres, heights, block_size):
+    """
+    Merge buildings into one rectangle per block of the map, covering every
+    building whose centre is in that block
+    :param points: (P, 3) array of footprint points, one building after another
+    :param counts: (B,) number of points in each footprint
+    :param centres: (B, 3) centre of each building
+    :param heights: (B,) height of each building
+    :param block_size: width of a block
+    :return: (points, counts, heights) of the block rectangles, each block is
+             the average height of its buildings
+    """
+
+    if not len(counts):
+        return np.zeros((0, 3)), np.zeros(0, dtype=np.int64), np.zeros(0)
+
+    cells = np.floor(centres[:, :2] / block_size).astype(np.int64)
+    _, block = np.unique(cells, axis=0, return_inverse=True)
+    point_block = np.repeat(block, counts)
+
+    num_blocks = block.max() + 1
+    lo = np.full((num_blocks, 2), np.inf)
+    hi = np.full((num_blocks, 2), -np.inf)
+    np.minimum.at(lo, point_block, points[:, :2])
+    np.maximum.at(hi, point_block, points[:, :2])
+
+    # anticlockwise rectangles so the faces point up
+    rects = np.zeros((num_blocks, 4, 3))
+    rects[:, 0, :2] = lo
+    rects[:, 1, 0], rects[:, 1, 1] = hi[:, 0], lo[:, 1]
+    rects[:, 2, :2] = hi
+    rects[:, 3, 0], rects[:, 3, 1] = lo[:, 0], hi[:, 1]
+
+    block_heights = np.bincount(block, heights, num_blocks) / np.bincount(block, minlength=num_blocks)
+
+    return rects.reshape(-1, 3), np.full(num_blocks, 4, dtype=np.int64), block_heights
+
+
+def create_extruded_mesh(points, counts, heights, name):
+    """
+    Extrude footprints (see buildings_manager.extrude_footprints) into a
+    mesh with a single MFnMesh.create call
+    :return: name of the mesh transform
+    """
+
+    vertices, face_counts, face_connects, _ = buildings_manager.extrude_footprints(points, counts, heights)
+
+    mesh_fn = om2.MFnMesh()
+    mesh_obj = mesh_fn.create(om2.MPointArray(vertices.tolist()),
+                              om2.MIntArray(face_counts.tolist()),
+                              om2.MIntArray(face_connects.tolist()))
+
+    mesh = om2.MFnDependencyNode(mesh_obj).setName(name)
+    cmds.sets(mesh, e=True, forceElement='initialShadingGroup')
+
+    return mesh
+
+
+class LODBuilder(object):
+    """
+    Builds the buildings of a parsed osm file as per tile meshes at different
+    levels of detail. Distances are in scene units (cm)
+    """
+
+    def __init__(self, parser, tile_size=50000.0, tolerance=100.0, min_area=200000.0, block_size=5000.0, grid=None):
+        """
+        :param parser: OSMParser that has already been parsed
+        :param tile_size: rough width of a tile, the tiles are stretched to fit the map
+        :param tolerance: Douglas-Peucker tolerance for LOD_SIMPLE
+        :param min_area: smallest footprint kept at LOD_SIMPLE
+        :param block_size: width of the blocks buildings merge into at LOD_BLOCK
+        :param grid: TileGrid to use instead of one made from tile_size, e.g.
+                     the grid of an OSMTiles so the tiles match
+        """
+
+        self.grid = grid or TileGrid.from_tile_size(parser.length, parser.height, tile_size)
+        self.tolerance = tolerance
+        self.min_area = min_area
+        self.block_size = block_size
+
+        buildings, points, counts, centres = parser.get_footprints()
+        heights = parser.get_heights(buildings, points, counts)
+
+        # which tile each building is in, by its centre
+        tiles, tile_of = np.unique(self.grid.get_tiles(centres), axis=0, return_inverse=True)
+        self.tiles = [tuple(tile) for tile in tiles.tolist()]
+
+        # sort the buildings by tile so each tile is a contiguous slice
+        order = np.argsort(tile_of, kind='mergesort')
+        old_starts = np.concatenate(([0], np.cumsum(counts)[:-1])) if len(counts) else np.zeros(0, dtype=np.int64)
+        new_starts = np.concatenate(([0], np.cumsum(counts[order])[:-1])) if len(counts) else np.zeros(0, dtype=np.int64)
+        point_order = np.arange(len(points)) + np.repeat(old_starts[order] - new_starts, counts[order])
+
+        self.points = points[point_order]
+        self.counts = counts[order]
+        self.centres = centres[order]
+        self.heights = heights[order]
+
+        bld_bounds = np.searchsorted(tile_of[order], np.arange(len(tiles) + 1))
+        point_starts = np.concatenate(([0], np.cumsum(self.counts)))
+        self.slices = dict((tile, (bld_bounds[i], bld_bounds[i + 1], point_starts[bld_bounds[i]], point_starts[bld_bounds[i + 1]]))
+                           for i, tile in enumerate(self.tiles))
+
+        self.levels = {}
+        self.times = {}
+
+        # tile to dict of level to mesh (None if the tile is empty at that
+        # level), and the level each tile is showing
+        self.built = {}
+        self.shown = {}
+
+    def _tile_buildings(self, tile):
+        """
+        Get the points, counts, centres and heights of the buildings in a tile at full detail
+        """
+
+        first, last, first_point, last_point = self.slices[tile]
+
+        return (self.points[first_point:last_point], self.counts[first:last],
+                self.centres[first:last], self.heights[first:last])
+
+    def generate(self, level):
+        """
+        Work out the footprints of every tile at a level of detail, only done
+        once per level
+        :return: dict of tile to (points, counts, heights)
+        """
+
+        if level in self.levels:
+            return self.levels[level]
+
+        start = time.time()
+        tiles = {}
+
+        for tile in self.tiles:
+            points, counts, centres, heights = self._tile_buildings(tile)
+
+            if level == LOD_SIMPLE:
+                points, counts, kept = simplify_footprints(points, counts, self.tolerance, self.min_area)
+                heights = heights[kept]
+            elif level == LOD_BLOCK:
+                points, counts, heights = block_footprints(points, counts, centres, heights, self.block_size)
+
+            tiles[tile] = (points, counts, heights)
+
+        self.levels[level] = tiles
+        self.times[level] = time.time() - start
+
+        return tiles
+
+    def choose_levels(self, camera_pos=None, level=None, distances=(100000.0, 300000.0)):
+        """
+        Pick the level of every tile, either one fixed level or by how far the
+        tile is from the camera
+        :param camera_pos: world position of the camera
+        :param level: use this level for every tile
+        :param distances: tiles further than distances[0] use LOD_SIMPLE and
+                          further than distances[1] use LOD_BLOCK
+        :return: dict of tile to level
+        """
+
+        if level is not None or camera_pos is None:
+            return dict((tile, LOD_FULL if level is None else level) for tile in self.tiles)
+
+        centres = np.array([self.grid.tile_centre(tile) for tile in self.tiles]).reshape(-1, 3)
+        tile_distances = np.sqrt(((centres - np.asarray(camera_pos, dtype=np.float64))**2).sum(axis=1))
+        levels = np.searchsorted(np.asarray(distances), tile_distances)
+
+        return dict(zip(self.tiles, levels.tolist()))
+
+    def build(self, camera=None, level=None, distances=(100000.0, 300000.0)):
+        """
+        Show every tile at its level, building the level's mesh into the lod
+        group the first time it is needed and hiding the tile's other levels.
+        Tiles already showing the right level are left alone so this can be
+        re-run as the camera moves
+        :param camera: camera to pick levels by distance from
+        :param level: fixed level for every tile, overrides the camera
+        :param distances: see choose_levels
+        :return: list of the tile meshes built
+        """
+
+        if not cmds.ls(LOD_GROUP):
+            cmds.group(empty=True, n=LOD_GROUP)
+
+        camera_pos = cmds.xform(camera, q=True, t=True, ws=True) if camera else None
+        levels = self.choose_levels(camera_pos, level, distances)
+
+        meshes = []
+
+        for tile, tile_level in sorted(levels.items()):
+            if self.shown.get(tile) == tile_level:
+                continue
+
+            tile_meshes = self.built.setdefault(tile, {})
+
+            mesh = tile_meshes.get(tile_level)
+            if tile_level not in tile_meshes or (mesh and not cmds.objExists(mesh)):
+                mesh = self._build_tile(tile, tile_level)
+                tile_meshes[tile_level] = mesh
+                if mesh:
+                    meshes.append(mesh)
+
+            # swap the levels over
+            for other in tile_meshes.itervalues():
+                if other and other != mesh and cmds.objExists(other):
+                    cmds.setAttr('{}.visibility'.format(other), False)
+            if mesh:
+                cmds.setAttr('{}.visibility'.format(mesh), True)
+
+            self.shown[tile] = tile_level
+
+        return meshes
+
+    def _build_tile(self, tile, level):
+        """
+        Build the extruded mesh of a tile at a level
+        :return: name of the mesh, None if the tile has nothing at that level
+        """
+
+        points, counts, heights = self.generate(level)[tile]
+        if not len(counts):
+            return None
+
+        name = '{}_lod{}'.format(self.grid.tile_name(tile), level)
+        mesh = create_extruded_mesh(points, counts, heights, name)
+        cmds.parent(mesh, LOD_GROUP)
+
+        return mesh
+
+    def poly_counts(self, level):
+        """
+        Get the total (faces, vertices) of every tile at a level once extruded,
+        a roof and a wall per footprint edge for each building
+        """
+
+        tiles = self.generate(level)
+        return (sum(len(counts) + len(points) for points, counts, _ in tiles.values()),
+                sum(2 * len(points) for points, _, _ in tiles.values()))
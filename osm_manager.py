@@ -1,20 +1,72 @@
+import os
 import re
+import sys
 import math
+import time
+import struct
 import random
+import marshal
+import hashlib
+import multiprocessing
+from array import array
+from cStringIO import StringIO
+from itertools import izip, imap
 
 import xml.etree.cElementTree as ET
 from math import sin, cos, sqrt, atan2, radians
 
 import maya.cmds as cmds
+# api 2.0 takes python sequences directly, which is what makes batched
+# mesh creation cheap
+import maya.api.OpenMaya as om2
+
+import profiling
+import scene_query
+import random_streams
+
+# numpy isn't shipped with every maya, fall back to the scalar maths without it
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 
 osmFile = "F:\Maya\map.osm"
 
 R = 637300.0
 
+# normal given to every building footprint vertex
+UP = (0, 0, 1)
+
+# scene units (cm) in a metre and in a story, for turning height tags into heights
+METRE = 100.0
+STORY_HEIGHT = 450.0
+
+# a height tag value, e.g. 12, 12.5 m, 40ft or 40'
+_HEIGHT_VALUE = re.compile(r"\s*([0-9]*\.?[0-9]+)\s*(m|ft|')?", re.IGNORECASE)
+
+# binary cache written next to the osm file, bump the version if the layout changes
+CACHE_EXTENSION = '.cache'
+CACHE_VERSION = 1
+_CACHE_HEADER = struct.Struct('<4sIqd20s16s4d')
+# where the mtime is in the header, after the magic, version and size
+_CACHE_MTIME_OFFSET = struct.calcsize('<4sIq')
+
+# start of a top level osm element, used to split the file into chunks
+_ELEMENT_START = re.compile(r'<(?:bounds|node|way|relation)[\s/>]')
+
+# anything that can't go in a maya attribute name gets swapped for _
+_TAG_KEY_CHARS = re.compile('[^a-zA-Z0-9]')
+
+# most distinct keys and values a TagCleaner remembers before starting over
+TAG_CACHE_SIZE = 1 << 14
+
 
 def latlong_distance(lat_long_1, lat_long_2):
-    
+
+    if np is not None:
+        return float(latlong_distances(lat_long_1, lat_long_2))
+
     lat1 = radians(lat_long_1[0])
     lon1 = radians(lat_long_1[1])
     lat2 = radians(lat_long_2[0])
@@ -30,6 +82,123 @@ def latlong_distance(lat_long_1, lat_long_2):
     return distance * 1000
 
 
+def latlong_distances(lat_long_1, lat_long_2):
+    """
+    Vectorised latlong_distance, takes arrays of lat/lon pairs of shape (N, 2)
+    (or a single pair) and returns the N distances in one go. Needs numpy
+    """
+
+    lat_long_1 = np.radians(np.asarray(lat_long_1, dtype=np.float64))
+    lat_long_2 = np.radians(np.asarray(lat_long_2, dtype=np.float64))
+
+    lat1 = lat_long_1[..., 0]
+    lon1 = lat_long_1[..., 1]
+    lat2 = lat_long_2[..., 0]
+    lon2 = lat_long_2[..., 1]
+
+    dlon = lon2 - lon1
+    dlat = lat2 - lat1
+
+    a = np.sin(dlat / 2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2)**2
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+    return R * c * 1000
+
+
+class TagCleaner(object):
+    """
+    Cleans and interns tag keys and values. An osm file repeats a few hundred
+    keys millions of times, so each distinct key is only cleaned once and
+    every element shares the same key and value strings
+    """
+
+    def __init__(self, keep=None, cache_size=TAG_CACHE_SIZE):
+        """
+        :param keep: only keep tags with these keys, raw or cleaned, e.g.
+                     ('building', 'height', 'building:levels'). building is
+                     always kept as that's what gets built. None keeps everything
+        :param cache_size: most keys and values to remember, the caches are
+                           emptied when they fill up so odd files can't grow them forever
+        """
+
+        self.keep = frozenset(keep) | frozenset(['building']) if keep else None
+        self.cache_size = cache_size
+
+        # raw key to cleaned key, or None if the key isn't kept
+        self.keys = {}
+        self.values = {}
+
+    def key(self, key):
+        """
+        Get the cleaned key for a raw key
+        :return: cleaned key, or None if the key isn't kept
+        """
+
+        try:
+            return self.keys[key]
+        except KeyError:
+            pass
+
+        # cleaned keys are always ascii so they can go in the interpreter's intern table
+        clean_key = intern(str(_TAG_KEY_CHARS.sub('_', key)))
+        if self.keep is not None and key not in self.keep and clean_key not in self.keep:
+            clean_key = None
+
+        if len(self.keys) >= self.cache_size:
+            self.keys.clear()
+        self.keys[key] = clean_key
+
+        return clean_key
+
+    def value(self, value):
+        """
+        Get the shared copy of a tag value
+        """
+
+        try:
+            return self.values[value]
+        except KeyError:
+            pass
+
+        if len(self.values) >= self.cache_size:
+            self.values.clear()
+        self.values[value] = value
+
+        return value
+
+    def read(self, xml_node):
+        """
+        Get the cleaned tags of an element
+        """
+
+        tags = {}
+        for child in xml_node:
+            if child.tag == 'tag':
+                attrib = child.attrib
+                if 'k' not in attrib:
+                    continue
+                clean_key = self.key(attrib['k'])
+                if clean_key is not None:
+                    tags[clean_key] = self.value(attrib['v'])
+
+        return tags
+
+    def cache_mode(self, mode):
+        """
+        Get the cache mode for a parse mode, caches written with a whitelist
+        only load for the same whitelist
+        """
+
+        if self.keep is None:
+            return mode
+
+        return '{}-{}'.format(mode, hashlib.sha1(' '.join(sorted(self.keep))).hexdigest()[:6])
+
+
+# shared by anything that doesn't bring its own cleaner
+_tag_cleaner = TagCleaner()
+
+
 class OSMNode(object):
 
     def __init__(self):
@@ -39,17 +208,14 @@ class OSMNode(object):
         self.tags = {}
     
     @classmethod
-    def from_xml(cls, xml_node):
+    def from_xml(cls, xml_node, cleaner=None):
         self = cls()
 
         self.id = xml_node.attrib['id']
         self.lat = xml_node.attrib['lat']
         self.lon = xml_node.attrib['lon']
 
-        for child in xml_node:
-            if child.tag == 'tag':
-                clean_tag = re.sub('[^a-zA-Z0-9]', '_', child.attrib['k'])
-                self.tags[clean_tag] = child.attrib['v']
+        self.tags = (cleaner or _tag_cleaner).read(xml_node)
         
         return self
 
@@ -60,32 +226,146 @@ class OSMWay(object):
         self.id = 0
         self.tags = {}
         self.nodes = []
+        # height from the tags, see OSMParser.resolve_heights
+        self.height = None
     
     @classmethod
-    def from_xml(cls, xml_node):
+    def from_xml(cls, xml_node, cleaner=None):
         self = cls()
 
         self.id = xml_node.attrib["id"]
+        self.tags = (cleaner or _tag_cleaner).read(xml_node)
+
         for child in xml_node:
-            if child.tag == "tag" and "k" in child.attrib:
-                clean_tag = re.sub('[^a-zA-Z0-9\n]', '_', child.attrib['k'])
-                self.tags[clean_tag] = child.attrib['v']
-            
             if child.tag == 'nd' and 'ref' in child.attrib:
                 self.nodes.append(child.attrib['ref'])
 
         return self
 
 
+class OSMNodeStore(object):
+    """
+    Columnar store for osm nodes. Node ids are mapped to a dense index and
+    lat/lon are held in float arrays, tags are only kept for tagged nodes
+    """
+
+    def __init__(self):
+        self.index = {}
+        # osm ids overflow a 32 bit 'l' array on windows, doubles hold them exactly
+        self.ids = array('d')
+        self.lat = array('d')
+        self.lon = array('d')
+        self.tags = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getstate__(self):
+        # arrays pickle as lists in python 2, send the raw bytes instead
+        # and rebuild the index on the other side
+        return {'ids': self.ids.tostring(),
+                'lat': self.lat.tostring(),
+                'lon': self.lon.tostring(),
+                'tags': self.tags}
+
+    def __setstate__(self, state):
+        self.ids = array('d', state['ids'])
+        self.lat = array('d', state['lat'])
+        self.lon = array('d', state['lon'])
+        self.tags = state['tags']
+        self.index = dict(izip(imap(int, self.ids), xrange(len(self.ids))))
+
+    def __contains__(self, node_id):
+        return int(node_id) in self.index
+
+    def __iter__(self):
+        return (int(node_id) for node_id in self.ids)
+
+    def __getitem__(self, node_id):
+        """
+        Get a thin OSMNode view of a node so existing callers keep working
+        """
+
+        i = self.index[int(node_id)]
+
+        node = OSMNode()
+        node.id = str(int(self.ids[i]))
+        node.lat = self.lat[i]
+        node.lon = self.lon[i]
+        node.tags = self.tags.get(i, {})
+
+        return node
+
+    def add(self, node_id, lat, lon, tags=None):
+        """
+        Add a node to the store and return its dense index
+        """
+
+        node_id = int(node_id)
+
+        i = self.index.get(node_id)
+        if i is None:
+            i = len(self.ids)
+            self.index[node_id] = i
+            self.ids.append(node_id)
+            self.lat.append(lat)
+            self.lon.append(lon)
+        else:
+            self.lat[i] = lat
+            self.lon[i] = lon
+
+        if tags:
+            self.tags[i] = tags
+
+        return i
+
+    def extend(self, other):
+        """
+        Append all the nodes of another store, osm node ids are unique so
+        the two stores are expected not to overlap
+        """
+
+        offset = len(self.ids)
+
+        self.index.update(izip(imap(int, other.ids), xrange(offset, offset + len(other.ids))))
+        self.ids.extend(other.ids)
+        self.lat.extend(other.lat)
+        self.lon.extend(other.lon)
+
+        for i, tags in other.tags.iteritems():
+            self.tags[i + offset] = tags
+
+    def indices(self, node_ids):
+        """
+        Get the dense indices of a list of node ids
+        """
+
+        index = self.index
+        return [index[int(node_id)] for node_id in node_ids]
+
+    def coords(self, node_id):
+        """
+        Get the (lat, lon) of a node as floats
+        """
+
+        i = self.index[int(node_id)]
+        return self.lat[i], self.lon[i]
+
+
 class OSMParser(object):
     """
     Class to work with osm file
     """
 
-    def __init__(self, osm_file):
+    def __init__(self, osm_file, keep_tags=None):
+        """
+        :param osm_file: osm file to read
+        :param keep_tags: only keep tags with these keys, None keeps them all
+        """
 
         print 'Initialising'
         self.osm_file = osm_file
+        self.tag_cleaner = TagCleaner(keep_tags)
         
         self.min_lat = 0
         self.max_lat = 0
@@ -97,9 +377,8 @@ class OSMParser(object):
         self.height = 0
         
         self.ways = []
-        self.nodes = {}
+        self.nodes = OSMNodeStore()
         self.tagged_nodes = []
-        self.tags = []
 
 
     def get_size(self):
@@ -116,17 +395,86 @@ class OSMParser(object):
         Get the points relative coordinates
         """
 
+        if np is not None:
+            rel_lat, rel_lon, _ = self.project(lat_long)[0]
+            return float(rel_lat), float(rel_lon)
+
         rel_lat = (lat_long[0] - self.min_lat) / (self.max_lat - self.min_lat) * self.length
         rel_lon = (lat_long[1] - self.min_long) / (self.max_long - self.min_long) * self.height
 
         return rel_lat, rel_lon
 
 
+    def project(self, lat_long):
+        """
+        Get the relative coordinates of many points in one go. Needs numpy
+        :param lat_long: array like of lat/lon pairs, shape (N, 2)
+        :return: (N, 3) float64 array of x, y, z with z always 0
+        """
+
+        lat_long = np.asarray(lat_long, dtype=np.float64).reshape(-1, 2)
+
+        xyz = np.zeros((len(lat_long), 3))
+        xyz[:, 0] = (lat_long[:, 0] - self.min_lat) / (self.max_lat - self.min_lat) * self.length
+        xyz[:, 1] = (lat_long[:, 1] - self.min_long) / (self.max_long - self.min_long) * self.height
+
+        return xyz
+
+
+    def project_nodes(self):
+        """
+        Get the relative coordinates of every node in the file, row i is the
+        node with dense index i in the node store. Needs numpy
+        :return: (N, 3) float64 array
+        """
+
+        # the node store arrays are read in place, no copy of the lat/lon
+        lat_long = np.empty((len(self.nodes), 2))
+        lat_long[:, 0] = np.frombuffer(self.nodes.lat, dtype=np.float64)
+        lat_long[:, 1] = np.frombuffer(self.nodes.lon, dtype=np.float64)
+
+        return self.project(lat_long)
+
+
+    def project_ways(self, ways, node_xyz=None):
+        """
+        Get the positions and centres of many ways in one go. Needs numpy
+        :param ways: list of OSMWays, each must have at least one node
+        :param node_xyz: result of project_nodes() if already computed
+        :return: (points, counts, centres) where points is the (P, 3) array of
+                 every way's positions one after the other, counts is how many
+                 points each way has and centres is the (W, 3) centre of each way
+        """
+
+        if not ways:
+            return np.zeros((0, 3)), np.zeros(0, dtype=np.int64), np.zeros((0, 3))
+
+        if node_xyz is None:
+            node_xyz = self.project_nodes()
+
+        counts = np.array([len(way.nodes) for way in ways], dtype=np.int64)
+        indices = np.fromiter((i for way in ways for i in self.nodes.indices(way.nodes)),
+                              dtype=np.int64,
+                              count=int(counts.sum()))
+
+        points = node_xyz[indices]
+
+        # centres are the mean of each way's points, done as one reduction
+        starts = np.zeros(len(ways), dtype=np.int64)
+        np.cumsum(counts[:-1], out=starts[1:])
+        centres = np.add.reduceat(points, starts, axis=0) / counts[:, None]
+
+        return points, counts, centres
+
+
     def get_centre_pos(self, positions):
         """
         Get the centre point of a list of positions
         """
 
+        if np is not None:
+            return tuple(np.mean(np.asarray(positions, dtype=np.float64), axis=0).tolist())
+
         # get the length of the positions array
         dims = len(positions)
 
@@ -149,95 +497,883 @@ class OSMParser(object):
         return (x, y, z)
 
 
-    def build(self):
+    def build(self, batched=False, chunk_size=None, bld_group='_buildings', name=None):
         """
         Build the osm file
+        :param batched: create the buildings as faces of combined meshes
+                        rather than one object per building, see build_batched
+        :param chunk_size: max number of buildings per combined mesh
+        :param bld_group: group to put the buildings in
+        :param name: what to name the buildings or meshes, they are numbered
+                     after it. Defaults to building or buildings_mesh
+        """
+
+        if batched:
+            return self.build_batched(chunk_size, bld_group, name or 'buildings_mesh')
+
+        with profiling.span('build'):
+            self._build(bld_group, name or 'building')
+
+
+    def _build(self, bld_group, name):
+        """
+        Build every building as its own object, see build
         """
+
         print 'Building'
 
 
         # first get a group to put everything in
-        bld_group = '_buildings'
-
         if not cmds.ls(bld_group):
             cmds.group(empty=True, n=bld_group)
 
-        # create a something to store the number of the building we are on
-        num_buildings = 0
+        # create a something to store the number of the building we are on,
+        # carrying on from any buildings already in the group
+        num_existing = len(scene_query.get_children(bld_group))
+        num_buildings = num_existing
 
-        # go through our ways and find the buildings
-        for way in self.ways:
-            if 'building' in way.tags:
-                
-                positions = []
+        buildings = self.get_buildings()
+
+        # project every building in one go, then slice out each footprint
+        with profiling.span('project'):
+            if np is not None:
+                points, counts, centres = self.project_ways(buildings)
+                footprints = zip([positions.tolist() for positions in np.split(points, np.cumsum(counts)[:-1])],
+                                 [tuple(centre) for centre in centres.tolist()])
+            else:
+                footprints = self._scalar_footprints(buildings)
 
-                for node_id in way.nodes:
-                    node = self.nodes[node_id]
-                    pos_xy = self.get_relative_coordinates([float(node.lat), float(node.lon)])
-                    positions.append((pos_xy[0], pos_xy[1], 0))
+        # go through our buildings and create them
+        for way, (positions, centre_pos) in izip(buildings, footprints):
 
+            with profiling.span('create'):
                 building = cmds.polyCreateFacet(p=positions)
 
-                centre_pos = self.get_centre_pos(positions)
                 cmds.xform( building[0], ws=True, piv=centre_pos )
 
-                # make sure all the vertices have the correct normals
-                for i in range(cmds.polyEvaluate(building[0], vertex=True)):
-                    cmds.select('{}.vtx[{}]'.format(building[0], i))
-                    cmds.polyNormalPerVertex(xyz=(0,0,1))
+            # make sure all the vertices have the correct normals, one call for
+            # the whole building and the user's selection is left alone
+            with profiling.span('normals'):
+                cmds.polyNormalPerVertex('{}.vtx[*]'.format(building[0]), xyz=UP)
 
-
-                new_building = cmds.rename(building[0], 'building_{0:03d}'.format(num_buildings+1))
+            with profiling.span('create'):
+                new_building = cmds.rename(building[0], '{0}_{1:03d}'.format(name, num_buildings+1))
                 cmds.parent(new_building, bld_group)
 
-                num_buildings += 1
+                # keep the way id so extruding seeds the random stories from
+                # it, and the tagged height so it doesn't need to guess one
+                cmds.addAttr(new_building, ln='osmWayId', at='double', dv=float(way.id))
+                if way.height is not None:
+                    cmds.addAttr(new_building, ln='osmHeight', dv=way.height)
+
+            num_buildings += 1
         
-        print 'Build {} buildings!'.format(num_buildings)
+        profiling.count('buildings', num_buildings - num_existing)
+        print 'Build {} buildings!'.format(num_buildings - num_existing)
                     
             
 
     
-    def parse(self):
+    def build_batched(self, chunk_size=None, bld_group='_buildings', name='buildings_mesh'):
+        """
+        Build every building footprint as a face of one combined mesh, or of a
+        few meshes of chunk_size buildings, each created with a single
+        MFnMesh.create call. Face i of a mesh is building i of that mesh, the
+        osm way id and centre of each building are stored on the mesh transform
+        in the osmWayId and buildingCentre attributes and the height to extrude
+        it to in osmHeight. Needs numpy
+        :param chunk_size: max number of buildings per mesh, all in one if None
+        :param bld_group: group to put the meshes in
+        :param name: what to name the meshes, <name>_001 and so on
+        :return: list of the mesh transforms created
+        :raise RuntimeError: without numpy, before anything is added to the scene
+        """
+
+        if np is None:
+            raise RuntimeError('Building batched needs numpy, build one object per building instead')
+
+        with profiling.span('build'):
+            return self._build_batched(chunk_size, bld_group, name)
+
+
+    def _build_batched(self, chunk_size, bld_group, name):
+        """
+        Build the buildings as faces of combined meshes, see build_batched
+        """
+
+        print 'Building (batched)'
+
+        if not cmds.ls(bld_group):
+            cmds.group(empty=True, n=bld_group)
+
+        with profiling.span('project'):
+            buildings, points, counts, centres = self.get_footprints()
+        with profiling.span('heights'):
+            heights = self.get_heights(buildings, points, counts).tolist()
+
+        way_ids = [float(way.id) for way in buildings]
+        starts = np.concatenate(([0], np.cumsum(counts))).tolist()
+
+        chunk_size = chunk_size or max(len(buildings), 1)
+        meshes = []
+
+        for first in range(0, len(buildings), chunk_size):
+            last = min(first + chunk_size, len(buildings))
+
+            chunk_counts = counts[first:last]
+            chunk_points = points[starts[first]:starts[last]]
+
+            with profiling.span('create'):
+                mesh = create_footprint_mesh(chunk_points, chunk_counts, '{0}_{1:03d}'.format(name, len(meshes) + 1))
+
+            cmds.addAttr(mesh, ln='osmWayId', dt='doubleArray')
+            cmds.setAttr('{}.osmWayId'.format(mesh), way_ids[first:last], type='doubleArray')
+
+            chunk_centres = [tuple(centre) for centre in centres[first:last].tolist()]
+            cmds.addAttr(mesh, ln='buildingCentre', dt='vectorArray')
+            cmds.setAttr('{}.buildingCentre'.format(mesh), len(chunk_centres), *chunk_centres, type='vectorArray')
+
+            cmds.addAttr(mesh, ln='osmHeight', dt='doubleArray')
+            cmds.setAttr('{}.osmHeight'.format(mesh), heights[first:last], type='doubleArray')
+
+            cmds.parent(mesh, bld_group)
+            meshes.append(mesh)
+
+        profiling.count('buildings', len(buildings))
+        profiling.count('meshes', len(meshes))
+        print 'Build {} buildings in {} meshes!'.format(len(buildings), len(meshes))
+
+        return meshes
+
+
+    def get_buildings(self):
+        """
+        Get the building ways that can be made into a face, ways with fewer
+        than 3 different nodes are left out and reported
+        :return: list of OSMWays
+        """
+
+        buildings = []
+        degenerate = []
+
+        for way in self.ways:
+            if 'building' not in way.tags:
+                continue
+
+            if len(set(way.nodes)) < 3:
+                degenerate.append(way.id)
+            else:
+                buildings.append(way)
+
+        if degenerate:
+            print 'Skipping {} buildings with fewer than 3 nodes: {}{}'.format(
+                len(degenerate), ', '.join(str(way_id) for way_id in degenerate[:10]), '...' if len(degenerate) > 10 else '')
+
+        return buildings
+
+
+    def get_footprints(self):
+        """
+        Get the projected footprint of every building. Needs numpy
+        :return: (buildings, points, counts, centres), the building ways, their
+                 points one after the other, how many points each has and the
+                 centre of each. Closed ways don't repeat their first node
+        """
+
+        buildings = self.get_buildings()
+
+        points, counts, centres = self.project_ways(buildings)
+
+        # closed ways repeat their first node at the end, a face can't use the
+        # same vertex twice so drop it
+        ends = np.cumsum(counts)
+        closed = np.array([len(way.nodes) > 1 and way.nodes[0] == way.nodes[-1] for way in buildings], dtype=bool)
+        keep = np.ones(len(points), dtype=bool)
+        keep[ends[closed] - 1] = False
+
+        return buildings, points[keep], counts - closed, centres
+
+
+    def resolve_heights(self):
+        """
+        Work out the height of every way from its height or building:levels
+        tags, ways without either are left as None
+        """
+
+        for way in self.ways:
+            way.height = tag_height(way.tags)
+
+
+    def get_heights(self, buildings, points, counts):
+        """
+        Get the height of many buildings at once, from their tags where they
+        have them and from the random stories heuristic on their footprint
+        area where they don't. Needs numpy
+        :param buildings: building ways, see get_footprints
+        :param points: (P, 3) array of the footprint points
+        :param counts: (B,) number of points in each footprint
+        :return: (B,) array of heights, the random stories come from each
+                 building's own stream so a building always gets the same height
+        """
+
+        heights = np.array([way.height for way in buildings], dtype=np.float64)
+
+        missing = np.isnan(heights)
+        if missing.any():
+            areas = footprint_areas(points, counts)
+            way_ids = [way.id for way, no_height in izip(buildings, missing) if no_height]
+            heights[missing] = area_heights(areas[missing], way_ids)
+
+        return heights
+
+
+    def _scalar_footprints(self, buildings):
+        """
+        Get the positions and centre of each building one node at a time,
+        used when numpy isn't available
+        """
+
+        footprints = []
+
+        for way in buildings:
+            positions = []
+
+            for node_id in way.nodes:
+                pos_xy = self.get_relative_coordinates(self.nodes.coords(node_id))
+                positions.append((pos_xy[0], pos_xy[1], 0))
+
+            footprints.append((positions, self.get_centre_pos(positions)))
+
+        return footprints
+
+
+    def parse(self, streaming=False, workers=None, use_cache=True):
         """
         Read in the osm file and get all the data from it
+        :param streaming: only keep building ways and the nodes they reference,
+                          reading the file in two passes
+        :param workers: number of processes to parse the file with, if more
+                        than 1 the file is parsed in parallel chunks
+        :param use_cache: load from the binary cache next to the osm file if it
+                          matches, otherwise write one after parsing
+        """
+
+        mode = self.tag_cleaner.cache_mode('streaming' if streaming else 'full')
+        cache_file = '{}.{}{}'.format(self.osm_file, mode, CACHE_EXTENSION)
+
+        start = time.time()
+
+        with profiling.span('parse'):
+            if use_cache:
+                with profiling.span('load_cache'):
+                    loaded = self.load_cache(cache_file, mode)
+                if loaded:
+                    print 'Loaded cache in {:.2f}s'.format(time.time() - start)
+                    self._count_parsed()
+                    return
+
+            with profiling.span('xml'):
+                if streaming:
+                    self.parse_streaming()
+                elif workers and workers > 1:
+                    self.parse_parallel(workers)
+                else:
+                    self.parse_serial()
+
+            with profiling.span('heights'):
+                self.resolve_heights()
+
+            print 'Parsed in {:.2f}s'.format(time.time() - start)
+            self._count_parsed()
+
+            # the cache is only a speed up, a parse shouldn't fail because the
+            # folder the osm file is in can't be written to
+            if use_cache:
+                with profiling.span('save_cache'):
+                    try:
+                        self.save_cache(cache_file, mode)
+                    except (IOError, OSError) as e:
+                        print 'Could not write cache {}: {}'.format(cache_file, e)
+
+
+    def _count_parsed(self):
+        profiling.count('nodes', len(self.nodes))
+        profiling.count('ways', len(self.ways))
+
+
+    def parse_serial(self):
+        """
+        Read in the whole osm file in a single pass
         """
 
         print 'parsing'
-        tags = []
-        
         
         for _, child in ET.iterparse(self.osm_file):
             if child.tag == 'bounds':
-                #this is the extents of the mapping data
-                self.min_lat = float(child.attrib['minlat'])
-                self.max_lat = float(child.attrib['maxlat'])
-                self.min_long = float(child.attrib['minlon'])
-                self.max_long = float(child.attrib['maxlon'])
-                
-                self.get_size()
+                self._read_bounds(child.attrib)
                 child.clear()
             
             if child.tag == "way":
-                way = OSMWay.from_xml(child)
-                tags.extend(way.tags.keys())
-                self.ways.append(way)
+                self.ways.append(OSMWay.from_xml(child, self.tag_cleaner))
                 child.clear()
             
             if child.tag == 'node':
+                self._add_node(child)
+                child.clear()
+
+
+    def parse_streaming(self):
+        """
+        Read in the osm file in two passes, keeping only what the buildings need.
+        The first pass keeps the building ways and the node ids they reference,
+        the second pass only materialises those nodes. Peak memory scales with
+        the number of buildings rather than the size of the file
+        """
 
-                node = OSMNode.from_xml(child)
-                tags.extend(node.tags.keys())
-                self.nodes[node.id] = node
+        print 'parsing (streaming)'
 
-                if node.tags.keys():
-                    self.tagged_nodes.append(node)
+        # first pass, find the buildings and the nodes they use
+        building_refs = set()
 
-                child.clear()
+        for child in self._iter_elements():
+            if child.tag == 'bounds':
+                self._read_bounds(child.attrib)
+
+            elif child.tag == 'way':
+                way = OSMWay.from_xml(child, self.tag_cleaner)
+                if 'building' in way.tags:
+                    self.ways.append(way)
+                    building_refs.update(int(ref) for ref in way.nodes)
+
+        # second pass, only read the coordinates of the nodes we need
+        for child in self._iter_elements():
+            if child.tag == 'node' and int(child.attrib['id']) in building_refs:
+                self._add_node(child)
+
+        print 'Kept {} buildings and {} nodes'.format(len(self.ways), len(self.nodes))
+
+
+    def parse_parallel(self, workers=None):
+        """
+        Read in the osm file using a pool of processes. The file is split into
+        byte ranges on element boundaries, each range is parsed into compact
+        arrays by a worker and the results are merged back in file order so the
+        result matches parse()
+        :param workers: number of processes, defaults to the number of cores
+        """
+
+        workers = workers or multiprocessing.cpu_count()
+
+        # a few chunks per worker keeps the pool busy if chunks are uneven
+        chunks = _find_chunks(self.osm_file, workers * 4)
+
+        print 'parsing ({} chunks on {} workers)'.format(len(chunks), workers)
+
+        _set_worker_executable()
+        pool = multiprocessing.Pool(workers)
+        try:
+            keep = self.tag_cleaner.keep
+            results = pool.map(_parse_chunk, [(self.osm_file, start, end, keep) for start, end in chunks])
+        finally:
+            pool.close()
+            pool.join()
+
+        for bounds, nodes, ways in results:
+            if bounds:
+                self._read_bounds(bounds)
+
+            offset = len(self.nodes)
+            self.nodes.extend(nodes)
+
+            for i in sorted(nodes.tags):
+                self.tagged_nodes.append(self.nodes[int(self.nodes.ids[i + offset])])
+
+            way_ids, way_tags, way_refs, way_offsets = ways
+            way_refs = array('d', way_refs)
+            way_offsets = array('l', way_offsets)
+
+            for i, way_id in enumerate(way_ids):
+                way = OSMWay()
+                way.id = way_id
+                way.tags = way_tags[i]
+                way.nodes = [str(int(ref)) for ref in way_refs[way_offsets[i]:way_offsets[i + 1]]]
+                self.ways.append(way)
+
+
+    def save_cache(self, cache_file, mode='full', key=None):
+        """
+        Write the parsed data to a compact binary cache. Node coordinates, way
+        node refs and offsets are written as raw arrays and tags are interned
+        into a single string table
+        :param cache_file: path of the cache to write
+        :param mode: how the data was parsed, a cache only loads for the same mode
+        :param key: (size, mtime, digest) of the osm file if already known
+        """
+
+        strings = {}
+
+        def intern_tags(tags, pairs):
+            for key, value in tags.iteritems():
+                pairs.append(strings.setdefault(key, len(strings)))
+                pairs.append(strings.setdefault(value, len(strings)))
+
+        tagged = array('i', sorted(self.nodes.tags))
+        node_tag_offsets = array('i', [0])
+        node_tag_pairs = array('i')
+        for i in tagged:
+            intern_tags(self.nodes.tags[i], node_tag_pairs)
+            node_tag_offsets.append(len(node_tag_pairs))
+
+        way_ids = array('d')
+        way_refs = array('d')
+        way_offsets = array('i', [0])
+        way_tag_offsets = array('i', [0])
+        way_tag_pairs = array('i')
+        for way in self.ways:
+            way_ids.append(float(way.id))
+            way_refs.extend(float(ref) for ref in way.nodes)
+            way_offsets.append(len(way_refs))
+            intern_tags(way.tags, way_tag_pairs)
+            way_tag_offsets.append(len(way_tag_pairs))
+
+        string_table = [None] * len(strings)
+        for string, i in strings.iteritems():
+            string_table[i] = string
+
+        size, mtime, digest = key or _source_key(self.osm_file)
+
+        sections = [self.nodes.ids, self.nodes.lat, self.nodes.lon,
+                    tagged, node_tag_offsets, node_tag_pairs,
+                    way_ids, way_refs, way_offsets, way_tag_offsets, way_tag_pairs]
+
+        # write to a temp file first so an interrupted write never leaves a bad cache
+        temp_file = cache_file + '.tmp'
+        with open(temp_file, 'wb') as cache:
+            cache.write(_CACHE_HEADER.pack('OSMC', CACHE_VERSION, size, mtime, digest, mode,
+                                           self.min_lat, self.max_lat, self.min_long, self.max_long))
+            for section in sections:
+                data = section.tostring()
+                cache.write(struct.pack('<q', len(data)))
+                cache.write(data)
+
+            data = marshal.dumps(string_table)
+            cache.write(struct.pack('<q', len(data)))
+            cache.write(data)
+
+        if os.path.exists(cache_file):
+            os.remove(cache_file)
+        os.rename(temp_file, cache_file)
+
+
+    def load_cache(self, cache_file, mode='full'):
+        """
+        Load parsed data from a binary cache if it was written for the current
+        contents of the osm file. Each array is read straight from the file
+        into its array. A truncated or corrupt cache is deleted so the file
+        gets parsed again
+        :param cache_file: path of the cache to load
+        :param mode: how the data should have been parsed
+        :return: True if the cache was loaded
+        """
+
+        if not os.path.exists(cache_file):
+            return False
+
+        try:
+            with open(cache_file, 'rb') as cache:
+                header = _CACHE_HEADER.unpack(cache.read(_CACHE_HEADER.size))
+                magic, version, size, mtime, digest, cache_mode = header[:6]
+
+                if magic != 'OSMC' or version != CACHE_VERSION or cache_mode.rstrip('\0') != mode:
+                    return False
+
+                # a moved or deleted osm file is a miss, there's nothing to
+                # check the cache against
+                try:
+                    source_size = os.path.getsize(self.osm_file)
+                    source_mtime = os.path.getmtime(self.osm_file)
+                except OSError:
+                    return False
+
+                # size and mtime are cheap to check, only hash the file if the
+                # mtime moved without the size changing
+                if size != source_size:
+                    return False
+                touched = mtime != source_mtime
+                if touched and digest != _source_key(self.osm_file)[2]:
+                    return False
+
+                sections = []
+                # typecodes of the sections in the order save_cache writes them
+                for typecode in 'dddiiiddiii':
+                    section = array(typecode)
+                    section.fromstring(_read_section(cache))
+                    sections.append(section)
+
+                string_table = marshal.loads(_read_section(cache))
+
+            nodes, tagged_nodes, ways = self._from_cache(sections, string_table)
+
+        except (IOError, EOFError, ValueError, TypeError, IndexError, struct.error) as e:
+            print 'Ignoring bad cache {}: {}'.format(cache_file, e)
+            try:
+                os.remove(cache_file)
+            except OSError:
+                pass
+            return False
+
+        # the file was only touched, store its new mtime so the next load
+        # doesn't have to hash it again
+        if touched:
+            try:
+                with open(cache_file, 'r+b') as cache:
+                    cache.seek(_CACHE_MTIME_OFFSET)
+                    cache.write(struct.pack('<d', source_mtime))
+            except (IOError, OSError) as e:
+                print 'Could not update cache {}: {}'.format(cache_file, e)
+
+        self.min_lat, self.max_lat, self.min_long, self.max_long = header[6:]
+        self.get_size()
+
+        self.nodes = nodes
+        self.tagged_nodes = tagged_nodes
+        self.ways = ways
+
+        self.resolve_heights()
+
+        return True
+
+
+    def _from_cache(self, sections, string_table):
+        """
+        Turn the arrays read from a cache back into the node store and ways
+        :return: (nodes, tagged_nodes, ways)
+        """
+
+        (ids, lat, lon, tagged, node_tag_offsets, node_tag_pairs,
+         way_ids, way_refs, way_offsets, way_tag_offsets, way_tag_pairs) = sections
+
+        if not len(ids) == len(lat) == len(lon) or len(way_offsets) != len(way_ids) + 1:
+            raise ValueError('section lengths don\'t match')
+
+        def read_tags(pairs, start, end):
+            return dict((string_table[pairs[j]], string_table[pairs[j + 1]]) for j in xrange(start, end, 2))
+
+        nodes = OSMNodeStore()
+        nodes.ids = ids
+        nodes.lat = lat
+        nodes.lon = lon
+        nodes.index = dict(izip(imap(int, ids), xrange(len(ids))))
+
+        tagged_nodes = []
+        for n, i in enumerate(tagged):
+            nodes.tags[i] = read_tags(node_tag_pairs, node_tag_offsets[n], node_tag_offsets[n + 1])
+            tagged_nodes.append(nodes[int(ids[i])])
+
+        ways = []
+        for i, way_id in enumerate(way_ids):
+            way = OSMWay()
+            way.id = str(int(way_id))
+            way.tags = read_tags(way_tag_pairs, way_tag_offsets[i], way_tag_offsets[i + 1])
+            way.nodes = [str(int(ref)) for ref in way_refs[way_offsets[i]:way_offsets[i + 1]]]
+            ways.append(way)
+
+        return nodes, tagged_nodes, ways
+
+
+    def _iter_elements(self):
+        """
+        Iterate over the top level elements of the osm file, clearing each one
+        out of the tree after it has been handled so memory stays flat
+        """
+
+        context = ET.iterparse(self.osm_file, events=('start', 'end'))
+        _, root = next(context)
+
+        for event, child in context:
+            if event == 'end' and child.tag in ('bounds', 'node', 'way', 'relation'):
+                yield child
+                root.clear()
+
+
+    def _read_bounds(self, attrib):
+        """
+        Read the extents of the mapping data from the attributes of a bounds element
+        """
+
+        self.min_lat = float(attrib['minlat'])
+        self.max_lat = float(attrib['maxlat'])
+        self.min_long = float(attrib['minlon'])
+        self.max_long = float(attrib['maxlon'])
+
+        self.get_size()
+
+
+    def _add_node(self, xml_node):
+        """
+        Add a node element to the node store and return its tags
+        """
+
+        node_tags = self.tag_cleaner.read(xml_node)
+
+        node_id = xml_node.attrib['id']
+        self.nodes.add(node_id,
+                       float(xml_node.attrib['lat']),
+                       float(xml_node.attrib['lon']),
+                       node_tags)
+
+        if node_tags:
+            self.tagged_nodes.append(self.nodes[node_id])
+
+        return node_tags
         
         
 
-parser = OSMParser(osmFile)
-parser.parse()
-parser.build()
+def parse_height(value):
+    """
+    Get the number of metres in a height tag value
+    :return: metres, or None if the value can't be read
+    """
+
+    # some values list more than one height, just go with the first
+    match = _HEIGHT_VALUE.match(value.split(';')[0].replace(',', '.'))
+    if not match:
+        return None
+
+    height = float(match.group(1))
+    if match.group(2) and match.group(2).lower() in ('ft', "'"):
+        height *= 0.3048
+
+    return height
+
+
+def tag_height(tags):
+    """
+    Get the height of a building from its cleaned tags, the height tag wins
+    over building:levels
+    :return: height in scene units, or None if neither tag can be read
+    """
+
+    if 'height' in tags:
+        height = parse_height(tags['height'])
+        if height:
+            return height * METRE
+
+    if 'building_levels' in tags:
+        levels = parse_height(tags['building_levels'])
+        if levels:
+            return math.ceil(levels) * STORY_HEIGHT
+
+    return None
+
+
+def footprint_areas(points, counts):
+    """
+    Get the area of many footprints at once. Needs numpy
+    :param points: (P, 3) array of footprint points, one building after another
+    :param counts: (B,) number of points in each footprint
+    :return: (B,) array of areas
+    """
+
+    counts = np.asarray(counts, dtype=np.int64)
+    if not len(counts):
+        return np.zeros(0)
+
+    starts = np.zeros(len(counts), dtype=np.int64)
+    np.cumsum(counts[:-1], out=starts[1:])
+
+    bld_start = np.repeat(starts, counts)
+    following = bld_start + (np.arange(len(points)) - bld_start + 1) % np.repeat(counts, counts)
+
+    cross = points[:, 0] * points[following, 1] - points[following, 0] * points[:, 1]
+    return np.abs(np.add.reduceat(cross, starts)) / 2
+
+
+def area_heights(areas, way_ids):
+    """
+    The random stories heuristic of buildings_manager.get_story_heights done
+    for many areas at once. Needs numpy
+    :param areas: (B,) footprint areas
+    :param way_ids: (B,) osm way ids, the stories are drawn from each way's
+                    stream of the buildings random seed
+    :return: (B,) array of heights
+    """
+
+    areas = np.asarray(areas, dtype=np.float64)
+
+    building_scale = np.minimum(np.ceil(areas / 1000000), 12)
+    num_stories = random_streams.randint('buildings', 'stories', way_ids, 1, 3) * building_scale
+
+    return STORY_HEIGHT * num_stories
+
+
+def create_footprint_mesh(points, counts, name):
+    """
+    Create a mesh of footprint faces with a single MFnMesh.create call, each
+    face using its own vertices in order. Every normal points up
+    :param points: (P, 3) array of footprint points, one face after another
+    :param counts: (F,) number of points in each face
+    :param name: name to give the mesh transform
+    :return: name of the mesh transform
+    """
+
+    mesh_fn = om2.MFnMesh()
+    mesh_obj = mesh_fn.create(om2.MPointArray(points.tolist()),
+                              om2.MIntArray(counts.tolist()),
+                              om2.MIntArray(range(len(points))))
+
+    # create leaves the function set on the new shape, every vertex
+    # points straight up so set them all in one call
+    num_vertices = len(points)
+    with profiling.span('normals'):
+        mesh_fn.setVertexNormals(om2.MVectorArray([UP] * num_vertices), om2.MIntArray(range(num_vertices)))
+
+    mesh = om2.MFnDependencyNode(mesh_obj).setName(name)
+    cmds.sets(mesh, e=True, forceElement='initialShadingGroup')
+
+    return mesh
+
+
+def _source_key(osm_file):
+    """
+    Get what a cache is keyed on for an osm file
+    :return: (size, mtime, sha1 digest)
+    """
+
+    sha = hashlib.sha1()
+    with open(osm_file, 'rb') as osm:
+        for block in iter(lambda: osm.read(1 << 20), ''):
+            sha.update(block)
+
+    return os.path.getsize(osm_file), os.path.getmtime(osm_file), sha.digest()
+
+
+def _read_section(cache):
+    """
+    Read one length prefixed section of a cache file
+    :raise EOFError: if the file ends before the section does
+    """
+
+    length, = struct.unpack('<q', cache.read(8))
+    data = cache.read(length)
+    if len(data) != length:
+        raise EOFError('cache ends part way through a section')
+
+    return data
+
+
+def _next_element(osm, offset, end):
+    """
+    Find the byte offset of the first top level element at or after offset
+    """
+
+    block = 1 << 16
+
+    while offset < end:
+        osm.seek(offset)
+        # read a little past the block so a match can't straddle two reads
+        match = _ELEMENT_START.search(osm.read(block + 16))
+        if match:
+            return min(offset + match.start(), end)
+        offset += block
+
+    return end
+
+
+def _find_chunks(osm_file, num_chunks):
+    """
+    Split an osm file into byte ranges that start on top level element boundaries
+    :return: list of (start, end) byte offsets covering every element in the file
+    """
+
+    size = os.path.getsize(osm_file)
+
+    with open(osm_file, 'rb') as osm:
+        # everything before the first element is the xml header and osm tag,
+        # everything from the closing osm tag is the end of the file
+        tail_start = max(0, size - (1 << 16))
+        osm.seek(tail_start)
+        tail = osm.read()
+        end = tail_start + tail.rfind('</osm>') if '</osm>' in tail else size
+
+        start = _next_element(osm, 0, end)
+
+        offsets = [start]
+        for i in range(1, num_chunks):
+            offset = _next_element(osm, start + (end - start) * i // num_chunks, end)
+            if offsets[-1] < offset < end:
+                offsets.append(offset)
+        offsets.append(end)
+
+    return zip(offsets[:-1], offsets[1:])
+
+
+def _parse_chunk(args):
+    """
+    Parse one byte range of an osm file in a worker process
+    :param args: (osm_file, start, end, tag keys to keep or None)
+    :return: (bounds attributes or None, OSMNodeStore, packed ways) where the
+             ways are (ids, tags, refs bytes, offsets bytes) with the refs of
+             way i being refs[offsets[i]:offsets[i + 1]]
+    """
+
+    osm_file, start, end, keep = args
+    cleaner = TagCleaner(keep)
+
+    with open(osm_file, 'rb') as osm:
+        osm.seek(start)
+        data = osm.read(end - start)
+
+    bounds = None
+    nodes = OSMNodeStore()
+
+    way_ids = []
+    way_tags = []
+    way_refs = array('d')
+    way_offsets = array('l', [0])
+
+    for _, child in ET.iterparse(StringIO('<osm>' + data + '</osm>')):
+        if child.tag == 'bounds':
+            bounds = dict(child.attrib)
+            child.clear()
+
+        elif child.tag == 'way':
+            way = OSMWay.from_xml(child, cleaner)
+            way_ids.append(way.id)
+            way_tags.append(way.tags)
+            way_refs.extend(float(ref) for ref in way.nodes)
+            way_offsets.append(len(way_refs))
+            child.clear()
+
+        elif child.tag == 'node':
+            nodes.add(child.attrib['id'],
+                      float(child.attrib['lat']),
+                      float(child.attrib['lon']),
+                      cleaner.read(child))
+            child.clear()
+
+    return bounds, nodes, (way_ids, way_tags, way_refs.tostring(), way_offsets.tostring())
+
+
+def _set_worker_executable():
+    """
+    Inside maya sys.executable is maya itself, point multiprocessing at mayapy
+    so the workers don't try to start the gui
+    """
+
+    exe_dir, exe_name = os.path.split(sys.executable)
+    if not exe_name.lower().startswith('maya') or exe_name.lower().startswith('mayapy'):
+        return
+
+    mayapy = os.path.join(exe_dir, 'mayapy' + os.path.splitext(exe_name)[1])
+    if os.path.exists(mayapy):
+        multiprocessing.set_executable(mayapy)
+
+
+if __name__ == '__main__':
+    # workers re-import this module, only build when run as a script
+    parser = OSMParser(osmFile)
+    parser.parse()
+    parser.build()
 
 
@@ -0,0 +1,243 @@
+"""
+Roads and paths for imported osm files. The highway ways a parse keeps are
+grouped into classes (ROAD_CLASSES) and each class is built in one go from
+the projected node arrays as one flat mesh of quads the width of the road,
+one MFnMesh.create call per class. The ways are only kept as curves in
+get_roads, a curve shape per way is what makes big maps slow to build and
+draw, and maya has no single shape for a set of separate polylines.
+
+The streaming parse only keeps buildings, so parse the full file (or in
+parallel) before building roads. If the parser has a tag whitelist it needs
+to keep highway, and width for the widths to be read.
+Needs numpy
+"""
+
+import maya.cmds as cmds
+import maya.api.OpenMaya as om2
+
+import numpy as np
+
+import profiling
+import osm_manager
+from osm_manager import METRE
+
+
+ROAD_GROUP = '_roads'
+
+# highway values that are built together, anything else with a highway tag is 'other'
+ROAD_CLASSES = {'motorway': ('motorway', 'motorway_link', 'trunk', 'trunk_link'),
+                'primary': ('primary', 'primary_link'),
+                'secondary': ('secondary', 'secondary_link', 'tertiary', 'tertiary_link'),
+                'street': ('residential', 'unclassified', 'living_street', 'road'),
+                'service': ('service',),
+                'path': ('footway', 'path', 'cycleway', 'bridleway', 'steps', 'pedestrian', 'track')}
+
+# width of a ribbon for each class when the way has no width tag
+ROAD_WIDTHS = {'motorway': 12 * METRE,
+               'primary': 10 * METRE,
+               'secondary': 8 * METRE,
+               'street': 6 * METRE,
+               'service': 4 * METRE,
+               'path': 2 * METRE,
+               'other': 4 * METRE}
+
+_HIGHWAY_CLASSES = dict((highway, road_class) for road_class, highways in ROAD_CLASSES.iteritems()
+                        for highway in highways)
+
+
+def road_class(tags):
+    """
+    Get the class of a way from its tags
+    :return: class name, or None if the way isn't a road
+    """
+
+    highway = tags.get('highway')
+    if highway is None:
+        return None
+
+    return _HIGHWAY_CLASSES.get(highway, 'other')
+
+
+def road_width(tags, road_class):
+    """
+    Get the width of a road from its width tag, or the class width
+    :return: width in scene units
+    """
+
+    if 'width' in tags:
+        width = osm_manager.parse_height(tags['width'])
+        if width:
+            return width * METRE
+
+    return ROAD_WIDTHS[road_class]
+
+
+def get_roads(parser, classes=None):
+    """
+    Get the projected roads of a parsed osm file grouped by class, every way
+    is projected from the one array of node positions
+    :param parser: OSMParser that has already been parsed
+    :param classes: only get these classes, all of them if None
+    :return: dict of class to (ways, points, counts, widths) with the points
+             of every way one after the other
+    """
+
+    grouped = {}
+    for way in parser.ways:
+        if len(way.nodes) < 2:
+            continue
+
+        way_class = road_class(way.tags)
+        if way_class is None or (classes is not None and way_class not in classes):
+            continue
+
+        grouped.setdefault(way_class, []).append(way)
+
+    if not grouped:
+        return {}
+
+    node_xyz = parser.project_nodes()
+
+    roads = {}
+    for way_class, ways in grouped.iteritems():
+        points, counts, _ = parser.project_ways(ways, node_xyz)
+        widths = np.array([road_width(way.tags, way_class) for way in ways], dtype=np.float64)
+        roads[way_class] = (ways, points, counts, widths)
+
+    return roads
+
+
+def road_ribbons(points, counts, widths):
+    """
+    Work out flat ribbons along many roads at once. Each road point gets a
+    vertex either side of it, mitred at the corners so the ribbon keeps its
+    width, and each segment becomes a quad facing up
+    :param points: (P, 3) array of the road points, one road after another
+    :param counts: (R,) number of points in each road, at least 2
+    :param widths: (R,) width of each road
+    :return: (vertices, face_counts, face_connects) ready for MFnMesh.create
+    """
+
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    counts = np.asarray(counts, dtype=np.int64)
+
+    num_points = len(points)
+    starts = np.zeros(len(counts), dtype=np.int64)
+    np.cumsum(counts[:-1], out=starts[1:])
+
+    local = np.arange(num_points) - np.repeat(starts, counts)
+    last = local == np.repeat(counts - 1, counts)
+
+    # direction of each segment, the last point of a road has no segment of
+    # its own. Repeated points give zero length segments, which are left at 0
+    directions = np.zeros((num_points, 2))
+    directions[:-1] = points[1:, :2] - points[:-1, :2]
+    directions[last] = 0
+    lengths = np.sqrt((directions**2).sum(axis=1))
+    moving = lengths > 1e-9
+    directions[moving] /= lengths[moving][:, None]
+
+    # each point sits between the segment before it and the one after it
+    before = np.zeros((num_points, 2))
+    before[1:] = directions[:-1]
+    before[local == 0] = 0
+    tangents = before + directions
+
+    # a road doubling back on itself has no tangent, fall back to the segment
+    tangent_lengths = np.sqrt((tangents**2).sum(axis=1))
+    flat = tangent_lengths < 1e-9
+    tangents[flat] = np.where(moving[flat][:, None], directions[flat], before[flat])
+    tangent_lengths[flat] = np.sqrt((tangents[flat]**2).sum(axis=1))
+    tangent_lengths[tangent_lengths < 1e-9] = 1
+    tangents /= tangent_lengths[:, None]
+
+    # the mitre gets longer as the corner gets sharper, capped so hairpins
+    # don't shoot off
+    normals = np.column_stack((-tangents[:, 1], tangents[:, 0]))
+    segment = np.where((local == 0)[:, None] | ~moving[:, None], directions, before)
+    cos_half = np.abs((tangents * segment).sum(axis=1))
+    cos_half[~(np.abs(segment).sum(axis=1) > 0)] = 1
+    offsets = normals * (np.repeat(widths, counts) / 2 / np.maximum(cos_half, 0.5))[:, None]
+
+    # vertices are laid out as [left, right] per point
+    vertices = np.repeat(points, 2, axis=0)
+    vertices[0::2, :2] += offsets
+    vertices[1::2, :2] -= offsets
+
+    # a quad for each segment, right to left so it faces up
+    first = np.flatnonzero(~last)
+    face_connects = np.column_stack((2 * first + 1, 2 * first + 3, 2 * first + 2, 2 * first)).ravel()
+    face_counts = np.full(len(first), 4, dtype=np.int64)
+
+    return vertices, face_counts, face_connects
+
+
+def create_ribbon_mesh(vertices, face_counts, face_connects, name):
+    """
+    Create a ribbon mesh with a single MFnMesh.create call, every normal points up
+    :return: name of the mesh transform
+    """
+
+    mesh_fn = om2.MFnMesh()
+    mesh_obj = mesh_fn.create(om2.MPointArray(vertices.tolist()),
+                              om2.MIntArray(face_counts.tolist()),
+                              om2.MIntArray(face_connects.tolist()))
+
+    num_vertices = len(vertices)
+    with profiling.span('normals'):
+        mesh_fn.setVertexNormals(om2.MVectorArray([osm_manager.UP] * num_vertices), om2.MIntArray(range(num_vertices)))
+
+    mesh = om2.MFnDependencyNode(mesh_obj).setName(name)
+    cmds.sets(mesh, e=True, forceElement='initialShadingGroup')
+
+    return mesh
+
+
+@profiling.timed('roads')
+def build_roads(parser, classes=None, road_group=ROAD_GROUP, name='roads'):
+    """
+    Build the roads of a parsed osm file, one ribbon mesh per road class. The
+    osm way id of every road is stored on the mesh in osmWayId, in the order
+    of the ribbons, and the width of each in roadWidth
+    :param parser: OSMParser that has already been parsed (not streaming)
+    :param classes: only build these classes, see ROAD_CLASSES, all if None
+    :param road_group: group to put the roads in
+    :param name: what to name the objects, <name>_<class>
+    :return: list of the objects created
+    """
+
+    print 'Building roads'
+
+    if not cmds.ls(road_group):
+        cmds.group(empty=True, n=road_group)
+
+    with profiling.span('project'):
+        roads = get_roads(parser, classes)
+
+    built = []
+
+    for way_class in sorted(roads):
+        ways, points, counts, widths = roads[way_class]
+        obj_name = '{}_{}'.format(name, way_class)
+
+        if cmds.objExists(obj_name):
+            cmds.delete(obj_name)
+
+        with profiling.span('ribbons'):
+            vertices, face_counts, face_connects = road_ribbons(points, counts, widths)
+        with profiling.span('create'):
+            obj = create_ribbon_mesh(vertices, face_counts, face_connects, obj_name)
+
+        cmds.addAttr(obj, ln='osmWayId', dt='doubleArray')
+        cmds.setAttr('{}.osmWayId'.format(obj), [float(way.id) for way in ways], type='doubleArray')
+
+        cmds.addAttr(obj, ln='roadWidth', dt='doubleArray')
+        cmds.setAttr('{}.roadWidth'.format(obj), widths.tolist(), type='doubleArray')
+
+        cmds.parent(obj, road_group)
+        built.append(obj)
+
+        profiling.count('roads', len(ways))
+        print 'Build {} {} roads'.format(len(ways), way_class)
+
+    return built
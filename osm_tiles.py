@@ -0,0 +1,327 @@
+"""
+Tiled import of big osm files. The bounds of the map are split into a grid
+of tiles, each building going in the tile its centre falls in. Splitting
+writes a small cache per tile, after that a tile can be loaded, built into
+its own group and unloaded again without touching the rest of the map.
+TileGrid is also what osm_lod tiles the map with, so a tile covers the same
+buildings in both
+"""
+
+import os
+import math
+
+import maya.cmds as cmds
+
+import osm_manager
+from osm_manager import OSMParser, OSMNodeStore, np
+
+
+class TileGrid(object):
+    """
+    Grid of rows x cols tiles over the bounds of a map, in scene units
+    """
+
+    def __init__(self, length=0, height=0, rows=4, cols=4):
+        """
+        :param length: length (latitude) of the map, see OSMParser.get_size
+        :param height: height (longitude) of the map
+        :param rows: number of tiles along the length of the map
+        :param cols: number of tiles along the height of the map
+        """
+
+        self.length = length
+        self.height = height
+        self.rows = rows
+        self.cols = cols
+
+
+    @classmethod
+    def from_tile_size(cls, length, height, tile_size):
+        """
+        Get a grid of tiles about tile_size wide, stretched to fit the map exactly
+        """
+
+        return cls(length, height,
+                   max(1, int(math.ceil(length / tile_size))),
+                   max(1, int(math.ceil(height / tile_size))))
+
+
+    def get_tile(self, position):
+        """
+        Get the tile a position is in, positions outside the bounds go in the
+        nearest edge tile
+        """
+
+        row = int(math.floor(position[0] / self.length * self.rows)) if self.length else 0
+        col = int(math.floor(position[1] / self.height * self.cols)) if self.height else 0
+
+        return (min(max(row, 0), self.rows - 1), min(max(col, 0), self.cols - 1))
+
+
+    def get_tiles(self, positions):
+        """
+        Same as get_tile for many positions at once. Needs numpy
+        :param positions: (N, 3) array of positions
+        :return: (N, 2) int array of the row and col of each position
+        """
+
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+        tiles = np.zeros((len(positions), 2), dtype=np.int64)
+
+        if self.length:
+            tiles[:, 0] = np.floor(positions[:, 0] / self.length * self.rows)
+        if self.height:
+            tiles[:, 1] = np.floor(positions[:, 1] / self.height * self.cols)
+
+        return np.clip(tiles, 0, [self.rows - 1, self.cols - 1])
+
+
+    def tile_bounds(self, tile):
+        """
+        Get the (min_x, min_y, max_x, max_y) of a tile
+        """
+
+        tile_length = float(self.length) / self.rows
+        tile_height = float(self.height) / self.cols
+
+        return (tile[0] * tile_length, tile[1] * tile_height,
+                (tile[0] + 1) * tile_length, (tile[1] + 1) * tile_height)
+
+
+    def tile_centre(self, tile):
+        min_x, min_y, max_x, max_y = self.tile_bounds(tile)
+        return ((min_x + max_x) / 2, (min_y + max_y) / 2, 0.0)
+
+
+    def tile_name(self, tile):
+        """
+        Get the prefix of everything built for a tile
+        """
+
+        return 'tile_{}_{}'.format(tile[0], tile[1])
+
+
+    def tiles_near(self, position, radius):
+        """
+        Get every tile that overlaps a circle around a position
+        """
+
+        tiles = []
+
+        for row in range(self.rows):
+            for col in range(self.cols):
+                min_x, min_y, max_x, max_y = self.tile_bounds((row, col))
+
+                # distance from the position to the nearest point of the tile
+                dx = max(min_x - position[0], 0, position[0] - max_x)
+                dy = max(min_y - position[1], 0, position[1] - max_y)
+
+                if dx * dx + dy * dy <= radius * radius:
+                    tiles.append((row, col))
+
+        return tiles
+
+
+
+class OSMTiles(object):
+    """
+    Grid of tiles over an osm file
+    """
+
+    def __init__(self, osm_file, rows=4, cols=4):
+        """
+        :param osm_file: osm file to tile
+        :param rows: number of tiles along the length (latitude) of the map
+        :param cols: number of tiles along the height (longitude) of the map
+        """
+
+        self.osm_file = osm_file
+
+        # the size of the map is filled in once the file or a tile is read
+        self.grid = TileGrid(rows=rows, cols=cols)
+
+        # tile to OSMParser holding just that tile's buildings
+        self.loaded = {}
+
+
+    def tile_file(self, tile):
+        """
+        Get the cache file a tile is written to
+        """
+
+        return '{}.tile_{}_{}{}'.format(self.osm_file, tile[0], tile[1], osm_manager.CACHE_EXTENSION)
+
+
+    def tile_group(self, tile):
+        """
+        Get the group a tile's buildings are built into
+        """
+
+        return '_buildings_{}_{}'.format(tile[0], tile[1])
+
+
+    def split(self):
+        """
+        Read the buildings of the osm file and write a cache for every tile
+        that has any. Only needs doing once per osm file, the tile caches are
+        keyed on the osm file like the main cache
+        :return: dict of tile to number of buildings
+        """
+
+        parser = OSMParser(self.osm_file)
+        parser.parse(streaming=True)
+
+        self.grid.length = parser.length
+        self.grid.height = parser.height
+
+        buildings = parser.get_buildings()
+
+        # the centre of each way decides its tile
+        if np is not None:
+            tiles = [tuple(tile) for tile in self.grid.get_tiles(parser.project_ways(buildings)[2]).tolist()]
+        else:
+            tiles = [self.grid.get_tile(centre) for _, centre in parser._scalar_footprints(buildings)]
+
+        tile_ways = {}
+        for way, tile in zip(buildings, tiles):
+            tile_ways.setdefault(tile, []).append(way)
+
+        key = osm_manager._source_key(self.osm_file)
+
+        for tile, ways in tile_ways.iteritems():
+            # every tile keeps the bounds of the whole map so they line up
+            tile_parser = self._empty_parser(parser)
+            tile_parser.ways = ways
+
+            for way in ways:
+                for node_id in way.nodes:
+                    if node_id not in tile_parser.nodes:
+                        lat, lon = parser.nodes.coords(node_id)
+                        tile_parser.nodes.add(node_id, lat, lon)
+
+            tile_parser.save_cache(self.tile_file(tile), 'tile', key)
+
+        print 'Split {} buildings into {} tiles'.format(len(buildings), len(tile_ways))
+
+        return dict((tile, len(ways)) for tile, ways in tile_ways.iteritems())
+
+
+    def _empty_parser(self, parser):
+        """
+        Get a parser with the bounds of another and no data
+        """
+
+        tile_parser = OSMParser(self.osm_file)
+
+        tile_parser.min_lat = parser.min_lat
+        tile_parser.max_lat = parser.max_lat
+        tile_parser.min_long = parser.min_long
+        tile_parser.max_long = parser.max_long
+        tile_parser.get_size()
+
+        tile_parser.nodes = OSMNodeStore()
+
+        return tile_parser
+
+
+    def load(self, tile):
+        """
+        Load a tile's buildings from its cache
+        :return: the tile's OSMParser, or None if the tile has no cache
+        """
+
+        if tile in self.loaded:
+            return self.loaded[tile]
+
+        parser = OSMParser(self.osm_file)
+        if not parser.load_cache(self.tile_file(tile), 'tile'):
+            print 'No cache for tile {}, has the file been split?'.format(tile)
+            return None
+
+        self.grid.length = parser.length
+        self.grid.height = parser.height
+
+        self.loaded[tile] = parser
+        return parser
+
+
+    def build(self, tile, batched=False, chunk_size=None):
+        """
+        Build a tile into its own group, loading it first if needed
+        :return: the tile's group, or None if it has no buildings
+        """
+
+        parser = self.load(tile)
+        if parser is None:
+            return None
+
+        group = self.tile_group(tile)
+        if cmds.ls(group):
+            return group
+
+        name = '{}_{}'.format(self.grid.tile_name(tile), 'buildings_mesh' if batched else 'building')
+        parser.build(batched, chunk_size, bld_group=group, name=name)
+
+        return group
+
+
+    def unload(self, tile):
+        """
+        Delete a tile's group from the scene and drop its data
+        """
+
+        group = self.tile_group(tile)
+        if cmds.ls(group):
+            cmds.delete(group)
+
+        self.loaded.pop(tile, None)
+
+
+    def update(self, position, radius, batched=False):
+        """
+        Build the tiles near a position and unload the rest, e.g. to follow
+        the camera around the map
+        :return: list of the tiles now built
+        """
+
+        # bounds come from the tile caches, any tile will do
+        if not self.grid.length:
+            for tile in ((row, col) for row in range(self.grid.rows) for col in range(self.grid.cols)):
+                if os.path.exists(self.tile_file(tile)) and self.load(tile):
+                    break
+
+        wanted = set(self.grid.tiles_near(position, radius))
+
+        for tile in list(self.loaded):
+            if tile not in wanted:
+                self.unload(tile)
+
+        built = []
+        for tile in sorted(wanted):
+            if os.path.exists(self.tile_file(tile)) and self.build(tile, batched):
+                built.append(tile)
+
+        return built
+
+
+    def export(self, tile, tile_file=None):
+        """
+        Export a built tile to its own maya file so it can be referenced
+        :param tile_file: file to write, defaults to next to the osm file
+        :return: the file written
+        """
+
+        tile_file = tile_file or '{}.tile_{}_{}.ma'.format(os.path.splitext(self.osm_file)[0], tile[0], tile[1])
+
+        cmds.select(self.build(tile))
+        cmds.file(tile_file, exportSelected=True, type='mayaAscii', force=True)
+
+        return tile_file
+
+
+    def reference(self, tile, tile_file):
+        """
+        Reference a tile file exported with export into the scene
+        """
+
+        return cmds.file(tile_file, reference=True, namespace=self.grid.tile_name(tile))
@@ -0,0 +1,258 @@
+"""
+On disk cache of the initial state set_initial_state works out for a particle
+system. An entry is keyed on everything the state is made from, the particle
+positions and ids, the goal mesh's points and uvs and the parameters, so
+pressing the button again with nothing changed reads the per particle arrays
+back from a small binary file instead of working them out again.
+
+The cache keeps the most recently used entries, up to MAX_ENTRIES files and
+MAX_BYTES on disk, and the oldest are deleted as new ones are written
+"""
+
+import os
+import glob
+import struct
+import hashlib
+import tempfile
+from array import array
+from itertools import chain
+
+import maya.api.OpenMaya as om2
+
+# without numpy the arrays are read and written with the array module
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# where the cache files go, change it to share a cache between machines
+CACHE_DIR = os.path.join(tempfile.gettempdir(), 'particle_state_cache')
+CACHE_EXTENSION = '.pstate'
+
+# bump the version if the layout or what goes into the state changes
+CACHE_VERSION = 1
+_CACHE_HEADER = struct.Struct('<4sI20sI')
+_SECTION_HEADER = struct.Struct('<16sq')
+
+# most entries and bytes kept before the least recently used are deleted
+MAX_ENTRIES = 64
+MAX_BYTES = 1 << 29
+
+
+def state_key(positions, ids, goal_mesh, params, digests=None):
+    """
+    Get the key of an initial state
+    :param positions: particle positions, flat or one row per particle
+    :param ids: particle ids
+    :param goal_mesh: name of the goal mesh
+    :param params: dict of the parameters the state is made with
+    :param digests: dict of mesh name to digest, see get_digest
+    :return: hex digest
+    """
+
+    sha = hashlib.sha1()
+    sha.update(struct.pack('<II', CACHE_VERSION, len(ids)))
+    sha.update(_to_bytes(positions, 'd'))
+    sha.update(_to_bytes(ids, 'd'))
+    sha.update(get_digest(goal_mesh, digests))
+    sha.update(repr(sorted(params.items())))
+
+    return sha.hexdigest()
+
+
+def get_digest(mesh, digests=None):
+    """
+    Get the mesh_digest of a mesh, hashing it only if it isn't in digests
+    yet. Passing the same dict to everything that keys on the mesh (the
+    state key and the uv lookup) while it can't change means it's only read
+    and hashed once
+    :param digests: dict of mesh name to digest, filled in as meshes are hashed
+    :return: sha1 digest
+    """
+
+    if digests is None:
+        return mesh_digest(mesh)
+
+    if mesh not in digests:
+        digests[mesh] = mesh_digest(mesh)
+
+    return digests[mesh]
+
+
+def mesh_digest(mesh):
+    """
+    Get a digest of a mesh's world space points, uvs and which uvs go on
+    which face vertices
+    :param mesh: name of the mesh
+    :return: sha1 digest
+    """
+
+    sel_list = om2.MSelectionList()
+    sel_list.add(mesh)
+    mesh_fn = om2.MFnMesh(sel_list.getDagPath(0))
+
+    points = mesh_fn.getPoints(om2.MSpace.kWorld)
+    if np is None:
+        points = list(chain.from_iterable(points))
+
+    us, vs = mesh_fn.getUVs()
+    uv_counts, uv_ids = mesh_fn.getAssignedUVs()
+
+    sha = hashlib.sha1()
+    sha.update(struct.pack('<II', mesh_fn.numVertices(), mesh_fn.numPolygons()))
+    sha.update(_to_bytes(points, 'd'))
+    sha.update(_to_bytes(us, 'f'))
+    sha.update(_to_bytes(vs, 'f'))
+    sha.update(_to_bytes(uv_counts, 'i'))
+    sha.update(_to_bytes(uv_ids, 'i'))
+
+    return sha.digest()
+
+
+def cache_file(key):
+    """
+    Get the path of the cache file for a key
+    """
+
+    return os.path.join(CACHE_DIR, key + CACHE_EXTENSION)
+
+
+def load(key):
+    """
+    Read a cached initial state, marking it as the most recently used
+    :param key: key from state_key
+    :return: dict of array name to values (numpy arrays if numpy is
+             available, otherwise array.array), or None if it isn't cached
+    """
+
+    path = cache_file(key)
+    if not os.path.exists(path):
+        return None
+
+    with open(path, 'rb') as cache:
+        data = cache.read()
+
+    try:
+        magic, version, digest, num_sections = _CACHE_HEADER.unpack_from(data, 0)
+        if magic != 'PSTC' or version != CACHE_VERSION or digest != key.decode('hex'):
+            return None
+
+        arrays = {}
+        offset = _CACHE_HEADER.size
+        for _ in range(num_sections):
+            name, length = _SECTION_HEADER.unpack_from(data, offset)
+            offset += _SECTION_HEADER.size
+
+            if offset + length > len(data):
+                raise ValueError('Truncated section')
+
+            if np is not None:
+                values = np.frombuffer(data, dtype=np.float64, count=length // 8, offset=offset).copy()
+            else:
+                values = array('d')
+                values.fromstring(data[offset:offset + length])
+
+            arrays[name.rstrip('\0')] = values
+            offset += length
+
+    except (struct.error, ValueError):
+        # a bad file is no use to anyone, get rid of it
+        print 'Removing bad particle cache {}'.format(path)
+        os.remove(path)
+        return None
+
+    # the modified time is what the least recently used entries are found by
+    os.utime(path, None)
+
+    return arrays
+
+
+def save(key, arrays):
+    """
+    Write an initial state to the cache, then delete the least recently used
+    entries if the cache has grown past its limits
+    :param key: key from state_key
+    :param arrays: dict of array name (up to 16 characters) to values
+    """
+
+    if not os.path.isdir(CACHE_DIR):
+        os.makedirs(CACHE_DIR)
+
+    path = cache_file(key)
+
+    # the entry only shows up under its key once all of it has been written
+    temp_file = path + '.tmp'
+    with open(temp_file, 'wb') as cache:
+        cache.write(_CACHE_HEADER.pack('PSTC', CACHE_VERSION, key.decode('hex'), len(arrays)))
+        for name in sorted(arrays):
+            data = _to_bytes(arrays[name], 'd')
+            cache.write(_SECTION_HEADER.pack(name, len(data)))
+            cache.write(data)
+
+    if os.path.exists(path):
+        os.remove(path)
+    os.rename(temp_file, path)
+
+    evict()
+
+
+def evict(max_entries=None, max_bytes=None):
+    """
+    Delete the least recently used entries until the cache is within its limits
+    :param max_entries: most entries to keep, MAX_ENTRIES if None
+    :param max_bytes: most bytes to keep, MAX_BYTES if None
+    :return: number of entries deleted
+    """
+
+    max_entries = MAX_ENTRIES if max_entries is None else max_entries
+    max_bytes = MAX_BYTES if max_bytes is None else max_bytes
+
+    entries = sorted(((os.path.getmtime(path), os.path.getsize(path), path) for path in _entries()),
+                     reverse=True)
+
+    removed = 0
+    total = 0
+    for i, (_, size, path) in enumerate(entries):
+        total += size
+        # the newest entry is always kept, however big it is
+        if i >= max_entries or (i and total > max_bytes):
+            os.remove(path)
+            removed += 1
+
+    return removed
+
+
+def invalidate(key=None):
+    """
+    Remove an entry from the cache, or every entry
+    :param key: key from state_key, None to clear the whole cache
+    :return: number of entries removed
+    """
+
+    paths = [cache_file(key)] if key is not None else _entries()
+
+    removed = 0
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+            removed += 1
+
+    return removed
+
+
+def _entries():
+    return glob.glob(os.path.join(CACHE_DIR, '*' + CACHE_EXTENSION))
+
+
+def _to_bytes(values, typecode):
+    """
+    Get the raw bytes of a flat sequence of numbers, numpy and the array
+    module give the same bytes so keys match with or without numpy
+    """
+
+    if np is not None:
+        dtype = {'d': np.float64, 'f': np.float32, 'i': np.int32}[typecode]
+        return np.ascontiguousarray(values, dtype=dtype).tostring()
+
+    return array(typecode, values).tostring()
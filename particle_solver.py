@@ -0,0 +1,273 @@
+"""
+Array at a time version of the goal motion that set_goals used to run as a
+runtime dynExpression. Every frame the goalU/goalV advance, the jitter
+counters and the wrap around are done for the whole particle system at once
+with numpy, from a time change callback, instead of mel running per particle.
+The arrays are read and written with MFnParticleSystem, which doesn't go on
+the undo queue like a setAttr every frame would. Callbacks aren't saved with
+the scene, so attaching a system also adds a script node that attaches every
+system again when the scene is opened.
+
+step() works on plain arrays so it can be run headless, step_reference() is
+the expression written out per particle to check it against.
+Needs numpy
+"""
+
+import maya.cmds as cmds
+import maya.OpenMaya as om
+import maya.OpenMayaFX as omfx
+import maya.api.OpenMaya as om2
+
+import numpy as np
+
+import scene_query
+import random_streams
+
+
+# the per particle attributes the solver reads, and the ones it changes
+STATE_ATTRS = ('goalU', 'goalV', 'verticalSpeedPP', 'rotationRatePP',
+               'jitterIntervalPP', 'jitterStepPP', 'jitterRangePP', 'jitterValuePP')
+CHANGED_ATTRS = ('goalU', 'goalV', 'jitterStepPP', 'jitterValuePP')
+
+# script node that runs attach_all when the scene is opened
+SCRIPT_NODE = 'particleSolverScript'
+
+# particle shape to (callback id, last frame solved)
+_attached = {}
+
+# particle shape to the (state, ids) written on the last frame solved, so
+# they only need reading back from the system after it resets
+_states = {}
+
+
+def jitter_draws(ids, frame):
+    """
+    Get the two random numbers each particle may use for its jitter on a
+    frame, from the particle's own stream so they don't depend on particle order
+    :param ids: particle ids
+    :return: (range draws, value draws) both uniform in [0, 1)
+    """
+
+    frame = int(round(frame))
+    return (random_streams.uniform('particles', 'jitterRange{}'.format(frame), ids),
+            random_streams.uniform('particles', 'jitterValue{}'.format(frame), ids))
+
+
+def step(state, ids, frame):
+    """
+    Move every particle on by one frame, in place
+    :param state: dict of STATE_ATTRS to float arrays, one value per particle
+    :param ids: particle ids, used for the jitter random numbers
+    :param frame: the frame being solved
+    :return: state
+    """
+
+    range_draws, value_draws = jitter_draws(ids, frame)
+
+    goal_u = state['goalU']
+    jitter_step = state['jitterStepPP']
+    jitter_value = state['jitterValuePP']
+
+    state['goalV'] += state['verticalSpeedPP']
+    goal_u += state['rotationRatePP']
+
+    # particles still waiting count up, the rest take their jitter and pick a new one
+    waiting = state['jitterIntervalPP'] > jitter_step
+    jitting = ~waiting
+
+    jitter_step[waiting] += 1
+
+    goal_u[jitting] += jitter_value[jitting]
+    hi_range = range_draws[jitting] * state['jitterRangePP'][jitting]
+    jitter_value[jitting] = hi_range * (2 * value_draws[jitting] - 1)
+    jitter_step[jitting] = 0
+
+    goal_u[goal_u > 1] -= 1
+    goal_u[goal_u < 0] += 1
+
+    return state
+
+
+def step_reference(state, ids, frame):
+    """
+    Same as step but one particle at a time, following the old runtime
+    expression line by line. Only used to check step and time it against
+    """
+
+    range_draws, value_draws = jitter_draws(ids, frame)
+
+    goal_u = state['goalU']
+    goal_v = state['goalV']
+    jitter_step = state['jitterStepPP']
+    jitter_value = state['jitterValuePP']
+
+    for i in range(len(goal_u)):
+        goal_v[i] += state['verticalSpeedPP'][i]
+        goal_u[i] += state['rotationRatePP'][i]
+
+        if state['jitterIntervalPP'][i] > jitter_step[i]:
+            jitter_step[i] += 1
+        else:
+            goal_u[i] += jitter_value[i]
+            hi_range = range_draws[i] * state['jitterRangePP'][i]
+            lo_range = hi_range * -1
+            jitter_value[i] = lo_range + (hi_range - lo_range) * value_draws[i]
+            jitter_step[i] = 0
+
+        if goal_u[i] > 1:
+            goal_u[i] -= 1
+        elif goal_u[i] < 0:
+            goal_u[i] += 1
+
+    return state
+
+
+def _get_particle_fn(np_shape):
+    """
+    Get the particle function set of an nParticle shape
+    """
+
+    sel_list = om.MSelectionList()
+    sel_list.add(np_shape)
+
+    np_dag = om.MDagPath()
+    sel_list.getDagPath(0, np_dag)
+
+    return omfx.MFnParticleSystem(np_dag)
+
+
+def get_state(np_shape):
+    """
+    Read the solver state of a particle system
+    :return: (state, ids)
+    """
+
+    arrays = scene_query.get_particle_arrays(np_shape, STATE_ATTRS + ('particleId',))
+    ids = arrays.pop('particleId').astype(np.int64)
+
+    return arrays, ids
+
+
+def set_state(np_shape, state):
+    """
+    Write the attributes the solver changes back to a particle system. This
+    goes through the api so it isn't undoable, which keeps playback from
+    filling the undo queue
+    """
+
+    part_fn = _get_particle_fn(np_shape)
+
+    for attr in CHANGED_ATTRS:
+        values = state[attr].tolist()
+
+        script_util = om.MScriptUtil()
+        script_util.createFromList(values, len(values))
+        part_fn.setPerParticleAttribute(attr, om.MDoubleArray(script_util.asDoublePtr(), len(values)))
+
+
+def solve(np_shape, frame):
+    """
+    Step a particle system on to a frame, stepping once for every frame since
+    the last one solved, or since the system's start frame if that's later
+    so a run up is solved too. At or before the start frame the system is
+    back at its initial state, which is read again on the next step. Going
+    backwards otherwise does nothing, the system stays where it got to and
+    carries on from there once the frame passes it again
+    """
+
+    callback_id, last_frame = _attached.get(np_shape, (None, None))
+
+    start_frame = cmds.getAttr('{}.startFrame'.format(np_shape))
+
+    if frame <= start_frame or last_frame is None:
+        _attached[np_shape] = (callback_id, frame)
+        _states.pop(np_shape, None)
+        return
+
+    if frame <= last_frame:
+        return
+
+    _attached[np_shape] = (callback_id, frame)
+
+    # the last state written is still good unless particles were born or died
+    state, ids = _states.get(np_shape) or get_state(np_shape)
+    if len(ids) != _get_particle_fn(np_shape).count():
+        state, ids = get_state(np_shape)
+
+    if not len(ids):
+        return
+
+    for solve_frame in range(int(max(last_frame, start_frame)) + 1, int(frame) + 1):
+        step(state, ids, solve_frame)
+
+    set_state(np_shape, state)
+    _states[np_shape] = (state, ids)
+
+
+def _time_changed(time, np_shape):
+    if not cmds.objExists(np_shape):
+        detach(np_shape)
+        return
+
+    solve(np_shape, time.asUnits(om2.MTime.uiUnit()))
+
+
+def attach(np_shape):
+    """
+    Solve a particle system every time the frame changes, and again after
+    the scene is saved and opened
+    """
+
+    add_script_node()
+
+    if np_shape in _attached:
+        return
+
+    callback_id = om2.MDGMessage.addTimeChangeCallback(_time_changed, np_shape)
+    _attached[np_shape] = (callback_id, cmds.currentTime(q=True))
+
+
+def detach(np_shape):
+    """
+    Stop solving a particle system
+    """
+
+    _states.pop(np_shape, None)
+
+    callback_id, _ = _attached.pop(np_shape, (None, None))
+    if callback_id is not None:
+        om2.MMessage.removeCallback(callback_id)
+
+
+def attach_all():
+    """
+    Attach every particle system that has the solver attributes, anything
+    attached before (e.g. in the scene open before this one) is detached first
+    :return: list of the particle shapes attached
+    """
+
+    for np_shape in list(_attached):
+        detach(np_shape)
+
+    shapes = [shape for shape in cmds.ls(type='nParticle') or []
+              if cmds.attributeQuery('jitterValuePP', node=shape, exists=True)]
+
+    for shape in shapes:
+        attach(shape)
+
+    return shapes
+
+
+def add_script_node():
+    """
+    Add the script node that runs attach_all when the scene is opened, if it
+    isn't there already. It imports this module by the name it was imported
+    as, so it works from a package too
+    :return: name of the script node
+    """
+
+    if not cmds.objExists(SCRIPT_NODE):
+        cmds.scriptNode(name=SCRIPT_NODE, scriptType=1, sourceType='python',
+                        beforeScript='import {0}\n{0}.attach_all()'.format(__name__))
+
+    return SCRIPT_NODE
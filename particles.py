@@ -1,8 +1,26 @@
+from itertools import chain
+
 import maya.mel as mel
 import maya.cmds as cmds
 import maya.OpenMaya as om
 import maya.OpenMayaFX as omfx
 
+import profiling
+import scene_query
+import random_streams
+
+# the batched uv lookup and the solver need numpy, without it the goal us come
+# from getUVAtPoint and the goal motion from a runtime expression
+try:
+    import numpy as np
+    import uv_lookup
+    import particle_solver
+except ImportError:
+    np = None
+
+import particle_cache
+
+@profiling.timed('set_goals')
 def set_goals():
     
     sel = cmds.ls(sl=True, l=True)
@@ -64,17 +82,158 @@ def set_goals():
     
     print '#------------------------------#'
     
-    creation_dynExpression = ('.goalV = 0;\n'
+    creation_dynExpression, runtime_dynExpression = _get_expressions()
+    
+    cmds.dynExpression(npShape, creation=True, string=creation_dynExpression)                            
+    
+    # with numpy the runtime motion is solved for the whole system at once
+    # each frame instead of running the expression per particle
+    if np is not None:
+        particle_solver.attach(npShape)
+    else:
+        cmds.dynExpression(npShape, rbd=True,  string=runtime_dynExpression)
+    
+    # now we want to make our goal object a passive rigid body so that
+    # the particles don't go through it
+    _make_collider(obj)
+    
+    # select our particle system to tidy things up
+    cmds.select(npSystem)
+
+
+@profiling.timed('set_goals_batch')
+def set_goals_batch(pairs):
+    """
+    Set up goals for many nParticle systems in one go. The attributes of
+    every system are added with one MDGModifier, each goal mesh's uv lookup
+    is built once and shared by every system goaled to it, and every initial
+    state is worked out before any of them are saved
+    :param pairs: list of (particle system, goal object), the particle system
+                  can be the transform or the nParticle shape
+    :return: list of the nParticle shapes set up
+    """
+    
+    print '#------------------------------#'
+    print 'Setting goals on {} particle systems'.format(len(pairs))
+    
+    # before we start set the time back to the first frame
+    tMin = int(cmds.playbackOptions(q=True, minTime=True))
+    cmds.currentTime(tMin, e=True)
+    
+    systems = []
+    
+    for npSystem, obj in pairs:
+        npShape = npSystem
+        if not cmds.objectType(npShape) == 'nParticle':
+            npShape = (cmds.listRelatives(npSystem, shapes=True, f=True) or [None])[0]
+        
+        if not npShape or not cmds.objectType(npShape) == 'nParticle':
+            print 'Skipping {}, it is not a nParticle system!'.format(npSystem)
+            continue
+        
+        selList = om.MSelectionList()
+        selList.add(npShape)
+        
+        npDag = om.MDagPath()
+        npMObj = om.MObject()
+        
+        selList.getDependNode(0, npMObj)
+        selList.getDagPath(0, npDag)
+        
+        npNode = om.MFnDependencyNode(npMObj)
+        
+        # only one goal is supported, same as set_goals
+        if npNode.findPlug('goalGeometry').numConnectedElements():
+            print 'Skipping {}, it already has a goal!'.format(npSystem)
+            continue
+        
+        cmds.goal(npShape, g=obj, w=1)
+        
+        systems.append((npShape, obj, npNode, omfx.MFnParticleSystem(npDag)))
+    
+    # queue every system's attributes and add them all at once
+    modifier = om.MDGModifier()
+    
+    goals = []
+    for npShape, obj, npNode, npFnPart in systems:
+        goalIndex, goalMeshFn = _get_goal_mesh(npNode)
+        attrs = _get_attrs(goalIndex)
+        _create_attributes(npNode, attrs, modifier)
+        goals.append((goalIndex, goalMeshFn, attrs))
+    
+    modifier.doIt()
+    
+    # work out every initial state, sharing the lookups and goal digests between systems
+    lookups = {}
+    digests = {}
+    states = []
+    for (npShape, obj, npNode, npFnPart), (goalIndex, goalMeshFn, attrs) in zip(systems, goals):
+        if goalMeshFn is None:
+            continue
+        
+        lookup = None
+        if np is not None:
+            goalName = goalMeshFn.fullPathName()
+            if goalName not in lookups:
+                lookups[goalName] = uv_lookup.get_lookup(goalName, digests=digests)
+            lookup = lookups[goalName]
+        
+        _compute_initial_state(npFnPart, goalMeshFn, goalIndex, attrs, lookup, digests=digests)
+        states.append((npShape, obj, npFnPart, attrs))
+    
+    creation_dynExpression, runtime_dynExpression = _get_expressions()
+    
+    for npShape, obj, npFnPart, attrs in states:
+        _apply_initial_state(npFnPart, attrs, verbose=False)
+        
+        cmds.dynExpression(npShape, creation=True, string=creation_dynExpression)
+        if np is not None:
+            particle_solver.attach(npShape)
+        else:
+            cmds.dynExpression(npShape, rbd=True,  string=runtime_dynExpression)
+    
+    # every goal only needs making a collider once
+    for obj in sorted(set(obj for _, obj, _, _ in states)):
+        _make_collider(obj)
+    
+    setup = [npShape for npShape, _, _, _ in states]
+    cmds.select(setup)
+    
+    print 'Set goals on {} particle systems'.format(len(setup))
+    
+    return setup
+
+def _get_expressions():
+    """
+    Get the creation and runtime dynExpressions the goal motion uses
+    :return: (creation expression, runtime expression)
+    """
+    
+    # the random numbers are a hash of the particle id (and the frame) worked
+    # out in the expression, so every particle gets the same numbers each
+    # time the scene is played. Calling seed() would reseed mel's rand for
+    # every other expression in the scene, and ints overflow for big ids
+    expression_seed = random_streams.stream_key('particles', 'expression') % 100000
+    
+    creation_dynExpression = ('$h1 = sin((.particleId + {}) * 12.9898) * 43758.5453;\n'.format(expression_seed) +
+                              '$r1 = $h1 - floor($h1);\n'
+                              '$h2 = sin((.particleId + {}) * 78.233) * 43758.5453;\n'.format(expression_seed) +
+                              '$r2 = $h2 - floor($h2);\n'
+                              '.goalV = 0;\n'
                               '.goalU = 0;\n'
                               '.goalWeight0PP = .2;\n'
-                              '.verticalSpeedPP = rand(0.01, 0.1);\n'
-                              '.rotationRatePP = rand(0.03, 0.05);\n'
+                              '.verticalSpeedPP = 0.01 + 0.09 * $r1;\n'
+                              '.rotationRatePP = 0.03 + 0.02 * $r2;\n'
                               '.jitterIntervalPP = 0;\n'
                               '.jitterStepPP = 0;\n'
                               '.jitterRangePP = 0;\n'
                               '.lifespanPP = 5;'
                               )
-    runtime_dynExpression = ('.goalV += .verticalSpeedPP;\n'
+    runtime_dynExpression = ('$h1 = sin((.particleId + {}) * 12.9898 + frame * 78.233) * 43758.5453;\n'.format(expression_seed) +
+                             '$r1 = $h1 - floor($h1);\n'
+                             '$h2 = sin((.particleId + {}) * 39.3468 + frame * 11.1353) * 43758.5453;\n'.format(expression_seed) +
+                             '$r2 = $h2 - floor($h2);\n'
+                             '.goalV += .verticalSpeedPP;\n'
                              '.goalU += .rotationRatePP;\n\n'
                              'if (.jitterIntervalPP > .jitterStepPP)\n'
                              '{\n'
@@ -83,9 +242,9 @@ def set_goals():
                              'else\n' 
                              '{\n'
                              '\t.goalU += .jitterValuePP;\n'
-                             '\t$hiRange = rand(0, .jitterRangePP);\n'
+                             '\t$hiRange = .jitterRangePP * $r1;\n'
                              '\t$loRange = $hiRange * -1;\n'
-                             '\t.jitterValuePP = rand($loRange, $hiRange);\n'
+                             '\t.jitterValuePP = $loRange + ($hiRange - $loRange) * $r2;\n'
                              '\t.jitterStepPP = 0;\n'
                              '}\n\n'
                              'if (.goalU > 1)\n'
@@ -96,12 +255,14 @@ def set_goals():
                              '{\n'
                              '\t.goalU += 1;\n'
                              '}')
+    
+    return creation_dynExpression, runtime_dynExpression
 
-    cmds.dynExpression(npShape, creation=True, string=creation_dynExpression)                            
-    cmds.dynExpression(npShape, rbd=True,  string=runtime_dynExpression)
+def _make_collider(obj):
+    """
+    Make a goal object a passive rigid body so the particles can collide with it
+    """
     
-    # now we want to make our goal object a passive rigid body so that
-    # the particles don't go through it
     cmds.select(obj)
     
     print 'Selection is: %s' % cmds.ls(sl=True)
@@ -116,10 +277,6 @@ def set_goals():
         # parent the rigid body to keep things tidy
         nRigid = cmds.listRelatives(rigidShape[0], parent=True, f=True)
         #cmds.parent(nRigid, dynamics_grp)
-    
-    # select our particle system to tidy things up
-    cmds.select(npSystem)
-
 
 def _get_goal(dg):
     """
@@ -182,11 +339,15 @@ def _get_goal(dg):
     
     return goal_obj
 
-def set_initial_state(npNode=None, npFnPart=None):
+@profiling.timed('set_initial_state')
+def set_initial_state(npNode=None, npFnPart=None, use_cache=True):
     """
     Given a particle dependency node calculate the start goalU and and goalV values
     :param npNode: Particle dependency node to get goal data from
     :param npFnPart: particle function set we can get the points from and set data
+    :param use_cache: reuse the state worked out last time if the particles,
+                      goal and parameters haven't changed. particle_cache.invalidate()
+                      clears the cache
     """
     print '#----------------------------#'
     print 'Setting initial state'
@@ -195,60 +356,6 @@ def set_initial_state(npNode=None, npFnPart=None):
     tMin = int(cmds.playbackOptions(q=True, minTime=True))
     cmds.currentTime(tMin, e=True)
     
-    # a dict of all the base attributes we want to make sure exist!
-    attrs = {'goalU': {'longName': 'goalU',
-                       'shortName': 'goalU',
-                       'initialState':True,  
-                       'type':om.MFnNumericData.kDoubleArray,  # @UndefinedVariable
-                       'data': om.MDoubleArray()},
-             'goalV': {'longName': 'goalV',
-                       'shortName': 'goalV',
-                       'initialState':True,
-                       'type':om.MFnNumericData.kDoubleArray,  # @UndefinedVariable
-                       'data': om.MDoubleArray()},
-             'verticalSpeedPP': {'longName': 'verticalSpeedPP',
-                                 'shortName': 'vSpePP',
-                                 'initialState':True,
-                                 'type':om.MFnNumericData.kDoubleArray,  # @UndefinedVariable
-                                 'data': om.MDoubleArray()},
-             'rotationRatePP': {'longName': 'rotationRatePP',
-                                  'shortName': 'rotRtPP',
-                                  'initialState':True,
-                                  'type':om.MFnNumericData.kDoubleArray,  # @UndefinedVariable
-                                  'data': om.MDoubleArray()},
-             'jitterIntervalPP': {'longName': 'jitterIntervalPP',
-                                  'shortName': 'jtrIntPP',
-                                  'initialState':True,
-                                  'type':om.MFnNumericData.kDoubleArray,  # @UndefinedVariable
-                                  'data': om.MDoubleArray()},
-             'jitterStepPP': {'longName': 'jitterStepPP',
-                              'shortName': 'jtrStpPP',
-                              'initialState':True,
-                              'type':om.MFnNumericData.kDoubleArray,  # @UndefinedVariable
-                              'data': om.MDoubleArray()},
-             'jitterRangePP': {'longName': 'jitterRangePP',
-                               'shortName': 'jtrRngPP',
-                               'initialState': True,
-                               'type': om.MFnNumericData.kDoubleArray,  # @UndefinedVariable
-                               'data': om.MDoubleArray()},
-             'jitterValuePP': {'longName': 'jitterValuePP',
-                               'shortName': 'jtrValPP',
-                               'initialState':True,
-                               'type':om.MFnNumericData.kDoubleArray,  # @UndefinedVariable
-                               'data': om.MDoubleArray()},
-             'isDonePP': {'longName': 'isDonePP',
-                               'shortName': 'isDonePP',
-                               'initialState':True,
-                               'type':om.MFnNumericData.kDoubleArray,  # @UndefinedVariable
-                               'data': om.MDoubleArray()},
-             'lifespanPP': {'longName': 'lifespanPP',
-                               'shortName': 'lifespanPP',
-                               'initialState':True,
-                               'type':om.MFnNumericData.kDoubleArray,  # @UndefinedVariable
-                               'data': om.MDoubleArray()}}
-    
-    
-    
     # if nothing passed in we assume we are updating intial state
     # so need to setup npNode and npFnPart from selection
     if not npNode:
@@ -294,6 +401,25 @@ def set_initial_state(npNode=None, npFnPart=None):
         return
     
     
+    goalIndex, goalMeshFn = _get_goal_mesh(npNode)
+    if goalMeshFn is None:
+        return
+    
+    # make sure that all the attributes we need exist
+    attrs = _get_attrs(goalIndex)
+    _create_attributes(npNode, attrs)
+    
+    _compute_initial_state(npFnPart, goalMeshFn, goalIndex, attrs, use_cache=use_cache)
+    _apply_initial_state(npFnPart, attrs)
+
+def _get_goal_mesh(npNode):
+    """
+    Get the first goal of a particle system
+    :param npNode: particle dependency node
+    :return: (goal index, mesh function set of the goal), the function set is
+             None if the goal can't be worked out
+    """
+    
     # get the goalGeometry plug. this can tell us what our
     # particle is goaled to
     goalGeo_plug = npNode.findPlug('goalGeometry')
@@ -305,31 +431,111 @@ def set_initial_state(npNode=None, npFnPart=None):
     # get the goal index number (this may not be 0)
     goalIndex = attrName.split('[')[-1].split(']')[0]
     
-    # create the goal weight attribute
-    attrs['goalWeight{}PP'.format(goalIndex)] = {'longName': 'goalWeight%sPP' % goalIndex,
-                                                 'shortName': 'goalWeight%sPP' % goalIndex,
-                                                 'initialState': True, 
-                                                 'type':om.MFnNumericData.kDoubleArray,
-                                                 'data': om.MDoubleArray()}
-    
-    # make sure that all the attributes we need exist
-    _create_attributes(npNode, attrs)
-    
     # get all the objects connected to our goal array plug (should only be 1!)
     mPlugArray = om.MPlugArray()
     goal_plug.connectedTo(mPlugArray, True, False)
     
     if mPlugArray.length() > 1:
         print '###Error :More than one object is connected to this goal plug. Weird!'
-        return
+        return goalIndex, None
     
     goalMeshFn = om.MFnMesh()
     
     # get the node that is connected the plug and get a mesh function set
     goal_obj = mPlugArray[0].node()
-    goal_dagpath = om.MDagPath().getAPathTo(goal_obj)
+    goal_dagpath = om.MDagPath()
+    om.MDagPath.getAPathTo(goal_obj, goal_dagpath)
     goalMeshFn.setObject(goal_dagpath)
     
+    return goalIndex, goalMeshFn
+
+def _get_attrs(goalIndex):
+    """
+    Get the per particle attributes the goal motion needs
+    :param goalIndex: index of the goal, for its goal weight attribute
+    :return: dict of attribute name to the data _create_attributes needs,
+             with an empty MDoubleArray to fill in under 'data'
+    """
+    
+    # a dict of all the base attributes we want to make sure exist!
+    attrs = {'goalU': {'longName': 'goalU',
+                       'shortName': 'goalU',
+                       'initialState':True,  
+                       'type':om.MFnNumericData.kDoubleArray,  # @UndefinedVariable
+                       'data': om.MDoubleArray()},
+             'goalV': {'longName': 'goalV',
+                       'shortName': 'goalV',
+                       'initialState':True,
+                       'type':om.MFnNumericData.kDoubleArray,  # @UndefinedVariable
+                       'data': om.MDoubleArray()},
+             'verticalSpeedPP': {'longName': 'verticalSpeedPP',
+                                 'shortName': 'vSpePP',
+                                 'initialState':True,
+                                 'type':om.MFnNumericData.kDoubleArray,  # @UndefinedVariable
+                                 'data': om.MDoubleArray()},
+             'rotationRatePP': {'longName': 'rotationRatePP',
+                                  'shortName': 'rotRtPP',
+                                  'initialState':True,
+                                  'type':om.MFnNumericData.kDoubleArray,  # @UndefinedVariable
+                                  'data': om.MDoubleArray()},
+             'jitterIntervalPP': {'longName': 'jitterIntervalPP',
+                                  'shortName': 'jtrIntPP',
+                                  'initialState':True,
+                                  'type':om.MFnNumericData.kDoubleArray,  # @UndefinedVariable
+                                  'data': om.MDoubleArray()},
+             'jitterStepPP': {'longName': 'jitterStepPP',
+                              'shortName': 'jtrStpPP',
+                              'initialState':True,
+                              'type':om.MFnNumericData.kDoubleArray,  # @UndefinedVariable
+                              'data': om.MDoubleArray()},
+             'jitterRangePP': {'longName': 'jitterRangePP',
+                               'shortName': 'jtrRngPP',
+                               'initialState': True,
+                               'type': om.MFnNumericData.kDoubleArray,  # @UndefinedVariable
+                               'data': om.MDoubleArray()},
+             'jitterValuePP': {'longName': 'jitterValuePP',
+                               'shortName': 'jtrValPP',
+                               'initialState':True,
+                               'type':om.MFnNumericData.kDoubleArray,  # @UndefinedVariable
+                               'data': om.MDoubleArray()},
+             'isDonePP': {'longName': 'isDonePP',
+                               'shortName': 'isDonePP',
+                               'initialState':True,
+                               'type':om.MFnNumericData.kDoubleArray,  # @UndefinedVariable
+                               'data': om.MDoubleArray()},
+             'lifespanPP': {'longName': 'lifespanPP',
+                               'shortName': 'lifespanPP',
+                               'initialState':True,
+                               'type':om.MFnNumericData.kDoubleArray,  # @UndefinedVariable
+                               'data': om.MDoubleArray()}}
+    
+    # create the goal weight attribute
+    attrs['goalWeight{}PP'.format(goalIndex)] = {'longName': 'goalWeight%sPP' % goalIndex,
+                                                 'shortName': 'goalWeight%sPP' % goalIndex,
+                                                 'initialState': True, 
+                                                 'type':om.MFnNumericData.kDoubleArray,
+                                                 'data': om.MDoubleArray()}
+    
+    return attrs
+
+@profiling.timed('compute')
+def _compute_initial_state(npFnPart, goalMeshFn, goalIndex, attrs, lookup=None, use_cache=True, digests=None):
+    """
+    Work out the initial state of every particle and put it in the attrs data
+    :param npFnPart: particle function set to get the points from
+    :param goalMeshFn: mesh function set of the goal
+    :param goalIndex: index of the goal
+    :param attrs: attributes from _get_attrs to fill in
+    :param lookup: uv_lookup.UVLookup of the goal if already built
+    :param use_cache: read the state from the particle_cache if nothing it
+                      is made from has changed, and write it there if not
+    :param digests: dict of goal mesh digests for the cache key and the uv
+                    lookup, shared between systems so each goal is only hashed once
+    :return: attrs
+    """
+    
+    if digests is None:
+        digests = {}
     
     # get user defined variables
     verticalOffset = 0
@@ -341,67 +547,166 @@ def set_initial_state(npNode=None, npFnPart=None):
     jitterInterval = 10
     jitterRange = 0.01
     
-    # setup a bunch of arrays we are about to calculate
-    # then get a list of all the points in our particle system and iterate through them
-    partPosArray = om.MVectorArray()
-    
-    npFnPart.position(partPosArray)
-    
-    # for each particle we want to calculate information on the intial state
-    # for all of our pp attributes we want to set
-    for i in range(partPosArray.length()):
-        
-        # get our particle point as a vector
-        partPoint = partPosArray[i]
+    # get all the points in our particle system, copied whole out of the
+    # array data rather than a particle at a time
+    with profiling.span('read'):
+        arrays = scene_query.get_particle_arrays(npFnPart.fullPathName(), ('position', 'particleId'))
         
-        # get the goal uvs closest to our point
-        uvArray = [0,0]
-        scriptUtil = om.MScriptUtil()
-        scriptUtil.createFromList(uvArray, 2)
-        uvPoint = scriptUtil.asFloat2Ptr()
-        
-        goalMeshFn.getUVAtPoint(om.MPoint(partPoint), uvPoint, om.MSpace.kWorld)
+        # every particle draws from its own stream worked out from its id, so the
+        # same particle always starts the same way whatever order they come in
+        if np is not None:
+            positions = arrays['position']
+            partIds = arrays['particleId'].astype(np.int64)
+        else:
+            positions = list(chain.from_iterable(arrays['position']))
+            partIds = [int(partId) for partId in arrays['particleId']]
+    
+    numParticles = len(partIds)
+    profiling.count('particles', numParticles)
+    
+    # everything the state is made from, if none of it has changed since
+    # last time the arrays are read back from the cache
+    if use_cache:
+        params = {'verticalOffset': verticalOffset,
+                  'goalWeight_min': goalWeight_min,
+                  'goalWeight_max': goalWeight_max,
+                  'verticleSpeed_min': verticleSpeed_min,
+                  'verticleSpeed_max': verticleSpeed_max,
+                  'rotationSpeed': rotationSpeed,
+                  'jitterInterval': jitterInterval,
+                  'jitterRange': jitterRange,
+                  'seed': random_streams.SEEDS['particles']}
+        with profiling.span('cache'):
+            cacheKey = particle_cache.state_key(positions, partIds, goalMeshFn.fullPathName(), params, digests)
             
-        uPoint = om.MScriptUtil.getFloat2ArrayItem(uvPoint, 0, 0)
-        #vPoint = om.MScriptUtil.getFloat2ArrayItem(uvPoint, 0, 1)
-        
-        # append to our goalU and goalV array 
-        attrs['goalU']['data'].append(uPoint%1)
-        attrs['goalV']['data'].append(random.uniform(0, verticalOffset))
-        
-        goalWeight = random.uniform(goalWeight_min, goalWeight_max)
-        
-        # give this particle a random goal weight
-        attrs['goalWeight%sPP' % goalIndex]['data'].append(goalWeight)
-        #goal_weights.append(1)
-        
-        # set a bunch of attributes used to control motion of particles
-        attrs['verticalSpeedPP']['data'].append(random.uniform(verticleSpeed_min, verticleSpeed_max))
-        
-        adjustedRot = rotationSpeed * (1.1 - goalWeight)
-        
-        attrs['rotationRatePP']['data'].append(random.uniform(0, adjustedRot))
-        attrs['jitterIntervalPP']['data'].append(random.randint(1, jitterInterval))
-        attrs['jitterStepPP']['data'].append(0)
-        attrs['jitterRangePP']['data'].append(jitterRange)
-        attrs['jitterValuePP']['data'].append(random.uniform((-1 * jitterRange), jitterRange))
-        
-        attrs['isDonePP']['data'].append(0)
-        
-        attrs['lifespanPP']['data'].append(100000000000000000)
+            cached = particle_cache.load(cacheKey)
+        if cached is not None:
+            profiling.count('cache_hits')
+            print 'Loaded initial state from cache'
+            return _fill_initial_state(attrs, goalIndex, cached, numParticles, jitterRange)
+    
+    with profiling.span('random'):
+        goalVs = random_streams.uniform('particles', 'goalV', partIds, 0, verticalOffset)
+        goalWeights = random_streams.uniform('particles', 'goalWeight', partIds, goalWeight_min, goalWeight_max)
+        verticalSpeeds = random_streams.uniform('particles', 'verticalSpeed', partIds, verticleSpeed_min, verticleSpeed_max)
+        rotationRates = random_streams.uniform('particles', 'rotationRate', partIds)
+        jitterIntervals = random_streams.randint('particles', 'jitterInterval', partIds, 1, jitterInterval + 1)
+        jitterValues = random_streams.uniform('particles', 'jitterValue', partIds, -1 * jitterRange, jitterRange)
+    
+    # the closest goal uv of every particle, only the u is used
+    with profiling.span('uv_lookup'):
+        goalUs = _get_goal_us(goalMeshFn, positions, lookup, digests)
+    
+    # rotation is slower for particles held tighter to the goal
+    if np is not None:
+        goalUs = np.mod(goalUs, 1)
+        rotationRates = rotationRates * rotationSpeed * (1.1 - goalWeights)
+    else:
+        goalUs = [u % 1 for u in goalUs]
+        rotationRates = [rate * rotationSpeed * (1.1 - weight) for rate, weight in zip(rotationRates, goalWeights)]
+    
+    arrays = {'goalU': goalUs,
+              'goalV': goalVs,
+              'goalWeight': goalWeights,
+              'verticalSpeed': verticalSpeeds,
+              'rotationRate': rotationRates,
+              'jitterInterval': jitterIntervals,
+              'jitterValue': jitterValues}
+    
+    if use_cache:
+        with profiling.span('cache'):
+            particle_cache.save(cacheKey, arrays)
+    
+    return _fill_initial_state(attrs, goalIndex, arrays, numParticles, jitterRange)
+
+def _fill_initial_state(attrs, goalIndex, arrays, numParticles, jitterRange):
+    """
+    Copy the per particle arrays of an initial state into the attrs data,
+    the attributes that start the same for every particle are filled in here
+    :param arrays: dict of the arrays _compute_initial_state works out
+    :return: attrs
+    """
+    
+    # copy every array into its attribute data in one go
+    attrs['goalU']['data'] = _to_double_array(arrays['goalU'])
+    attrs['goalV']['data'] = _to_double_array(arrays['goalV'])
+    attrs['goalWeight%sPP' % goalIndex]['data'] = _to_double_array(arrays['goalWeight'])
+    attrs['verticalSpeedPP']['data'] = _to_double_array(arrays['verticalSpeed'])
+    attrs['rotationRatePP']['data'] = _to_double_array(arrays['rotationRate'])
+    attrs['jitterIntervalPP']['data'] = _to_double_array(arrays['jitterInterval'])
+    attrs['jitterStepPP']['data'] = om.MDoubleArray(numParticles, 0)
+    attrs['jitterRangePP']['data'] = om.MDoubleArray(numParticles, jitterRange)
+    attrs['jitterValuePP']['data'] = _to_double_array(arrays['jitterValue'])
+    attrs['isDonePP']['data'] = om.MDoubleArray(numParticles, 0)
+    attrs['lifespanPP']['data'] = om.MDoubleArray(numParticles, 100000000000000000)
+    
+    return attrs
+
+@profiling.timed('attribute_write')
+def _apply_initial_state(npFnPart, attrs, verbose=True):
+    """
+    Set the per particle attributes worked out by _compute_initial_state and
+    save them as the initial state
+    :param verbose: print each attribute as it is set
+    """
     
     # for each item in our attrs dictionary we want to set the attribute data
     for i in attrs:
-        print 'Setting: %s' % i
+        if verbose:
+            print 'Setting: %s' % i
         if npFnPart.hasAttribute(i):
             npFnPart.setPerParticleAttribute(i, attrs[i]['data'])
     
     
     # save our intial state (NB: if the particle sim has moved on from particle start it 
     # will overwrite their positions. Write a check in at the start of function)
-    npFnPart.saveInitialState()  
+    npFnPart.saveInitialState()
 
-def _create_attributes(npNode, attrs):
+def _get_goal_us(goalMeshFn, positions, lookup=None, digests=None):
+    """
+    Get the u of the closest uv on the goal mesh to every particle
+    :param goalMeshFn: mesh function set of the goal
+    :param positions: particle positions, a row per particle with numpy or
+                      a flat list without
+    :param lookup: uv_lookup.UVLookup of the goal if already built
+    :param digests: goal mesh digests to build the lookup with, see uv_lookup.get_lookup
+    :return: list (or numpy array) of u values
+    """
+    
+    # with numpy every particle is looked up in one batch against a grid of
+    # the goal's triangles, built once per goal mesh
+    if np is not None:
+        lookup = lookup or uv_lookup.get_lookup(goalMeshFn.fullPathName(), digests=digests)
+        return lookup.uvs(positions)[:, 0]
+    
+    # one uv pointer is shared by every lookup rather than making one per particle
+    scriptUtil = om.MScriptUtil()
+    scriptUtil.createFromList([0, 0], 2)
+    uvPoint = scriptUtil.asFloat2Ptr()
+    
+    goalUs = []
+    for i in range(0, len(positions), 3):
+        goalMeshFn.getUVAtPoint(om.MPoint(*positions[i:i + 3]), uvPoint, om.MSpace.kWorld)
+        goalUs.append(om.MScriptUtil.getFloat2ArrayItem(uvPoint, 0, 0))
+    
+    return goalUs
+
+def _to_double_array(values):
+    """
+    Copy a list or numpy array into an MDoubleArray in one go
+    """
+    
+    values = values.tolist() if np is not None and isinstance(values, np.ndarray) else list(values)
+    
+    # MDoubleArray can be made straight from a double pointer, which saves
+    # appending every value on its own
+    scriptUtil = om.MScriptUtil()
+    scriptUtil.createFromList(values, len(values))
+    
+    return om.MDoubleArray(scriptUtil.asDoublePtr(), len(values))
+
+@profiling.timed('attributes')
+def _create_attributes(npNode, attrs, modifier=None):
     """
     Given a dependency node will create a number of different attributes
     required
@@ -411,14 +716,24 @@ def _create_attributes(npNode, attrs):
                         -shortName
                         -type
                         -initialState
+    :param modifier: MDGModifier to queue the new attributes on, they are
+                     only added when its doIt is called. If None they are
+                     added straight away
     """
     
     
     ### NB: Currently only create typed attributes!
-    print '#---------#'
-    print 'creating new attributes!'
+    if modifier is None:
+        print '#---------#'
+        print 'creating new attributes!'
     mFnAttr = om.MFnTypedAttribute()
     
+    def addAttribute(attr):
+        if modifier is None:
+            npNode.addAttribute(attr)
+        else:
+            modifier.addAttribute(npNode.object(), attr)
+    
     for attr in attrs:
         # make sure that the attribute doesn't already exist
         if not npNode.hasAttribute(attrs[attr]['longName']):
@@ -426,11 +741,11 @@ def _create_attributes(npNode, attrs):
             customAttr = mFnAttr.create(attrs[attr]['longName'],
                                         attrs[attr]['shortName'],
                                         attrs[attr]['type'])
-            npNode.addAttribute(customAttr)
+            addAttribute(customAttr)
             
             # if the attribute requires an intial state then add that one to
             if attrs[attr]['initialState']:
                 custom0Attr = mFnAttr.create('%s0' % attrs[attr]['longName'],
                                               '%s0' % attrs[attr]['shortName'],
                                               attrs[attr]['type'])
-                npNode.addAttribute(custom0Attr)
+                addAttribute(custom0Attr)
@@ -0,0 +1,277 @@
+"""
+Timing spans and counters for the hot paths of the osm, buildings and
+particle tools. The tools wrap each phase in a span and count what they
+process, e.g.
+
+    with profiling.span('extrude'):
+        ...
+    profiling.count('buildings', len(buildings))
+
+Spans opened inside other spans are reported under their parent's name
+(parse/xml). With profiling on, the maya commands the tools call are
+counted as well, and cProfile can be run alongside.
+
+Off by default. When off span() hands back one shared object that does
+nothing and count() returns straight away, so the calls are left in the
+tools and only cost anything after enable()
+"""
+
+import sys
+import json
+import time
+import cProfile
+from functools import wraps
+from collections import defaultdict
+
+
+# the tool modules whose maya commands are counted, if they've been imported.
+# Matched on the last part of the module name so they're found when
+# imported from a package too
+TOOL_MODULES = ('osm_manager', 'osm_tiles', 'osm_lod', 'osm_roads', 'buildings_manager', 'scene_query',
+                'particles', 'particle_solver', 'particle_cache', 'uv_lookup')
+
+ENABLED = False
+
+# span path to [calls, total, min, max] seconds
+_spans = {}
+_counters = defaultdict(int)
+_stack = []
+
+_profiler = None
+
+# (module, attribute) to the real cmds or mel module while they're being counted
+_patched = {}
+
+
+class _Span(object):
+
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        _stack.append(self.name)
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.time() - self.start
+        path = '/'.join(_stack)
+        _stack.pop()
+
+        stats = _spans.get(path)
+        if stats is None:
+            _spans[path] = [1, elapsed, elapsed, elapsed]
+        else:
+            stats[0] += 1
+            stats[1] += elapsed
+            stats[2] = min(stats[2], elapsed)
+            stats[3] = max(stats[3], elapsed)
+
+        return False
+
+
+class _NoSpan(object):
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+class _CountedCommands(object):
+    """
+    Stands in for maya.cmds or maya.mel in a tool module, counting every
+    command called through it
+    """
+
+    def __init__(self, module, prefix):
+        self._module = module
+        self._prefix = prefix
+        self._commands = {}
+
+    def __getattr__(self, name):
+        command = self._commands.get(name)
+        if command is not None:
+            return command
+
+        real = getattr(self._module, name)
+        if not callable(real):
+            return real
+
+        key = '{}.{}'.format(self._prefix, name)
+
+        def command(*args, **kwargs):
+            _counters[key] += 1
+            return real(*args, **kwargs)
+
+        self._commands[name] = command
+        return command
+
+
+def span(name):
+    """
+    Time a phase, use as a with statement
+    :param name: name of the phase, nested spans are reported as parent/name
+    """
+
+    if not ENABLED:
+        return _NO_SPAN
+
+    return _Span(name)
+
+
+def count(name, amount=1):
+    """
+    Add to a counter, e.g. the number of buildings created
+    """
+
+    if ENABLED:
+        _counters[name] += amount
+
+
+def timed(name=None):
+    """
+    Decorator that runs a whole function in a span
+    :param name: name of the span, the function's name if None
+    """
+
+    def decorator(func):
+        span_name = name or func.__name__
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return func(*args, **kwargs)
+
+            with _Span(span_name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def enable(commands=True, profile=False):
+    """
+    Start recording
+    :param commands: count the maya commands called by the tool modules
+                     already imported
+    :param profile: run cProfile as well, see write_report
+    """
+
+    global ENABLED, _profiler
+
+    ENABLED = True
+
+    if commands:
+        _count_commands()
+
+    if profile:
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+
+
+def disable():
+    """
+    Stop recording, what was recorded is kept until reset
+    """
+
+    global ENABLED
+
+    ENABLED = False
+
+    for (module, attr), real in _patched.items():
+        setattr(module, attr, real)
+    _patched.clear()
+
+    if _profiler is not None:
+        _profiler.disable()
+
+
+def reset():
+    """
+    Forget everything recorded so far
+    """
+
+    _spans.clear()
+    _counters.clear()
+    del _stack[:]
+
+    if _profiler is not None:
+        _profiler.clear()
+
+
+def report():
+    """
+    Get everything recorded so far
+    :return: dict with 'spans', span path to calls and total, min and max
+             seconds, and 'counters', counter name to count
+    """
+
+    spans = dict((path, {'calls': calls, 'total': total, 'min': low, 'max': high})
+                 for path, (calls, total, low, high) in _spans.iteritems())
+
+    return {'spans': spans, 'counters': dict(_counters)}
+
+
+def write_report(report_file, profile_file=None):
+    """
+    Write the report as json, and the cProfile stats if enable was asked to profile
+    :param report_file: path of the json file
+    :param profile_file: path to dump the cProfile stats to, they can be read
+                         with pstats or snakeviz
+    """
+
+    with open(report_file, 'w') as out:
+        json.dump(report(), out, indent=2, sort_keys=True)
+
+    if profile_file and _profiler is not None:
+        _profiler.dump_stats(profile_file)
+
+
+def print_report():
+    """
+    Print the spans and counters as a table
+    """
+
+    summary = report()
+
+    print '{:<40} {:>7} {:>10} {:>10}'.format('span', 'calls', 'total', 'max')
+    for path in sorted(summary['spans']):
+        stats = summary['spans'][path]
+        print '{:<40} {:>7} {:>9.3f}s {:>9.3f}s'.format(path, stats['calls'], stats['total'], stats['max'])
+
+    print '{:<40} {:>7}'.format('counter', 'count')
+    for name in sorted(summary['counters']):
+        print '{:<40} {:>7}'.format(name, summary['counters'][name])
+
+
+def _count_commands():
+    """
+    Swap the cmds and mel the tool modules use for ones that count calls
+    """
+
+    # py2 keeps None in sys.modules for relative imports that missed
+    modules = [module for name, module in sys.modules.items()
+               if module is not None and name.rsplit('.', 1)[-1] in TOOL_MODULES]
+
+    if not modules:
+        print 'No tool modules imported, maya commands won\'t be counted'
+
+    for module in modules:
+        for attr, prefix in (('cmds', 'cmds'), ('mel', 'mel')):
+            real = getattr(module, attr, None)
+            if real is None or (module, attr) in _patched:
+                continue
+
+            _patched[(module, attr)] = real
+            setattr(module, attr, _CountedCommands(real, prefix))
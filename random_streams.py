@@ -0,0 +1,117 @@
+"""
+Seeded random numbers for the tools. Every subsystem (buildings, particles)
+has its own seed, and every building or particle draws from its own stream
+worked out from a stable id, the osm way id or the particle id. The same id
+always gets the same numbers whatever order things are built in, so builds
+can be cached and compared between runs.
+
+The per id streams are a counter based hash (splitmix64) of the id, so a
+whole array of ids is done in one go with numpy, with the same maths in
+python when numpy isn't there
+"""
+
+import hashlib
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# seed of each subsystem, change with set_seed
+SEEDS = {'buildings': 0,
+         'particles': 0}
+
+_MASK = (1 << 64) - 1
+_GOLDEN = 0x9E3779B97F4A7C15
+_MIX_1 = 0xBF58476D1CE4E5B9
+_MIX_2 = 0x94D049BB133111EB
+
+
+def set_seed(subsystem, seed):
+    """
+    Set the seed a subsystem's streams are made from
+    """
+
+    SEEDS[subsystem] = int(seed)
+
+
+def stream_key(subsystem, name=''):
+    """
+    Get the 64 bit key of a named stream of a subsystem, e.g. the goal weights
+    of the particles. Uses md5 rather than hash() so it's the same in every process
+    """
+
+    digest = hashlib.md5('{}:{}:{}'.format(subsystem, SEEDS.get(subsystem, 0), name)).hexdigest()
+    return int(digest[:16], 16)
+
+
+def stable_id(value):
+    """
+    Get an integer id for anything, ids that are already numbers (or strings
+    of numbers like osm ids) are used as they are, anything else is hashed
+    """
+
+    try:
+        return int(value) & _MASK
+    except (TypeError, ValueError):
+        return int(hashlib.md5(str(value)).hexdigest()[:16], 16)
+
+
+def uniform(subsystem, name, ids, low=0.0, high=1.0):
+    """
+    Get one uniform number in [low, high) per id from the named stream
+    :param name: what the numbers are for, each name is its own stream
+    :param ids: stable ids, one number is returned for each
+    :return: numpy array if numpy is available, otherwise a list
+    """
+
+    key = stream_key(subsystem, name)
+
+    if np is None:
+        return [low + (high - low) * (_mix((stable_id(i) * _GOLDEN + key) & _MASK) >> 11) * 2.0**-53
+                for i in ids]
+
+    if isinstance(ids, np.ndarray):
+        ids = ids.astype(np.uint64)
+    else:
+        ids = np.array([stable_id(i) for i in ids], dtype=np.uint64)
+
+    # uint64 maths wraps around, which is exactly what the hash wants
+    with np.errstate(over='ignore'):
+        hashed = _mix_np(ids * np.uint64(_GOLDEN) + np.uint64(key))
+
+    return low + (high - low) * (hashed >> np.uint64(11)).astype(np.float64) * 2.0**-53
+
+
+def randint(subsystem, name, ids, low, high):
+    """
+    Get one integer in [low, high) per id from the named stream, like numpy's randint
+    """
+
+    values = uniform(subsystem, name, ids, low, high)
+
+    if np is None:
+        return [int(value) for value in values]
+
+    return np.floor(values).astype(np.int64)
+
+
+def _mix(x):
+    """
+    splitmix64 finaliser on a python int
+    """
+
+    x = ((x ^ (x >> 30)) * _MIX_1) & _MASK
+    x = ((x ^ (x >> 27)) * _MIX_2) & _MASK
+    return x ^ (x >> 31)
+
+
+def _mix_np(x):
+    """
+    splitmix64 finaliser on a uint64 array
+    """
+
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(_MIX_1)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(_MIX_2)
+    return x ^ (x >> np.uint64(31))
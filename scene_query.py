@@ -0,0 +1,150 @@
+"""
+Bulk scene queries for the building and particle tools. Walks the children
+of a group once, or reads a particle system's arrays whole, with the api
+instead of running a command per object or a loop per element
+"""
+
+import maya.api.OpenMaya as om2
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def get_dag_path(name):
+    """
+    Get the dag path of a node by name, None if it doesn't exist
+    """
+
+    sel_list = om2.MSelectionList()
+    try:
+        sel_list.add(name)
+    except RuntimeError:
+        return None
+
+    return sel_list.getDagPath(0)
+
+
+def get_children(group):
+    """
+    Get the transforms directly under a group
+    :param group: name of the group
+    :return: list of (name, MDagPath) in child order
+    """
+
+    group_path = get_dag_path(group)
+    if group_path is None:
+        return []
+
+    children = []
+
+    group_fn = om2.MFnDagNode(group_path)
+    for i in range(group_fn.childCount()):
+        child = group_fn.child(i)
+        if not child.hasFn(om2.MFn.kTransform):
+            continue
+
+        child_path = om2.MDagPath(group_path)
+        child_path.push(child)
+        children.append((child_path.partialPathName(), child_path))
+
+    return children
+
+
+def get_uuids(group):
+    """
+    Get the uuid of every child of a group, these stay with a node when it is
+    renamed and a new node never gets an old one's
+    :param group: name of the group
+    :return: (names, uuids) lists in child order
+    """
+
+    names = []
+    uuids = []
+
+    for name, path in get_children(group):
+        names.append(name)
+        uuids.append(om2.MFnDependencyNode(path.node()).uuid().asString())
+
+    return names, uuids
+
+
+def get_pivots(group='_buildings'):
+    """
+    Get the world space rotate pivot of every child of a group
+    :param group: name of the group
+    :return: (names, pivots) where pivots is an (N, 3) array, or a list of
+             (x, y, z) tuples without numpy
+    """
+
+    names = []
+    pivots = []
+
+    for name, path in get_children(group):
+        pivot = om2.MFnTransform(path).rotatePivot(om2.MSpace.kWorld)
+        names.append(name)
+        pivots.append((pivot.x, pivot.y, pivot.z))
+
+    if np is not None:
+        pivots = np.array(pivots, dtype=np.float64).reshape(-1, 3)
+
+    return names, pivots
+
+
+def get_height_ctrls(group='_height_ctrls'):
+    """
+    Get the translate, scale x and height of every height ctrl in a group
+    :param group: name of the group
+    :return: (names, positions, radii, heights), positions is (M, 3) and radii
+             and heights are (M,) arrays, or lists without numpy
+    """
+
+    names = []
+    positions = []
+    radii = []
+    heights = []
+
+    for name, path in get_children(group):
+        transform_fn = om2.MFnTransform(path)
+        translate = transform_fn.translation(om2.MSpace.kTransform)
+
+        names.append(name)
+        positions.append((translate.x, translate.y, translate.z))
+        radii.append(transform_fn.scale()[0])
+        heights.append(transform_fn.findPlug('height', False).asDouble())
+
+    if np is not None:
+        positions = np.array(positions, dtype=np.float64).reshape(-1, 3)
+        radii = np.array(radii, dtype=np.float64)
+        heights = np.array(heights, dtype=np.float64)
+
+    return names, positions, radii, heights
+
+
+def get_particle_arrays(np_shape, attrs):
+    """
+    Get per particle attributes of a particle system straight from their
+    array data, rather than copying an element at a time
+    :param np_shape: name of the particle shape
+    :param attrs: names of doubleArray attributes (particleId, goalU, ...)
+                  or vectorArray ones (position, velocity, ...)
+    :return: dict of attribute to values, (N,) arrays for doubles and (N, 3)
+             for vectors, or lists without numpy
+    """
+
+    shape_fn = om2.MFnDependencyNode(get_dag_path(np_shape).node())
+
+    arrays = {}
+    for attr in attrs:
+        data = shape_fn.findPlug(attr, False).asMObject()
+
+        if data.hasFn(om2.MFn.kVectorArrayData):
+            values = om2.MFnVectorArrayData(data).array()
+            arrays[attr] = (np.array(values, dtype=np.float64).reshape(-1, 3) if np is not None
+                            else [tuple(value) for value in values])
+        else:
+            values = om2.MFnDoubleArrayData(data).array()
+            arrays[attr] = np.array(values, dtype=np.float64) if np is not None else list(values)
+
+    return arrays
@@ -0,0 +1,510 @@
+"""
+Closest point and uv lookups on a goal mesh for many points at once.
+MFnMesh.getUVAtPoint searches the whole mesh for every query, this builds a
+uniform grid over the mesh's world space triangles once and answers all the
+queries in a batch, only testing the triangles in the cells around each point.
+Points far from the surface (e.g. particles filling a goal's volume) would
+have to search a lot of empty cells, they test clusters of triangles nearest
+first instead, skipping every cluster that can't be closer than the best so far.
+Needs numpy
+"""
+
+import maya.api.OpenMaya as om2
+
+import numpy as np
+
+import particle_cache
+
+
+# most point/triangle pairs tested at once, keeps memory down on big batches
+MAX_PAIRS = 1 << 21
+
+# points with no triangles within this many rings of cells are searched by
+# cluster rather than by ring
+FAR_RINGS = 3
+
+# width of a cluster of triangles in grid cells
+CLUSTER_CELLS = 4
+
+# goal mesh name to (digest, UVLookup), see get_lookup
+_lookups = {}
+
+
+class UVLookup(object):
+    """
+    Uniform grid of the triangles of a mesh, each triangle is put in every cell
+    its bounding box touches. Queries near the surface search rings of cells
+    outwards from each point until nothing closer can be in the next ring,
+    queries further away test clusters of triangles in order of how close
+    their bounding boxes are. Either way the result is the same as testing
+    every triangle
+    """
+
+    def __init__(self, vertices, triangles, triangle_uvs, cell_size=None):
+        """
+        :param vertices: (V, 3) world space vertex positions
+        :param triangles: (T, 3) vertex ids of each triangle
+        :param triangle_uvs: (T, 3, 2) uv of each corner of each triangle
+        :param cell_size: width of a grid cell, defaults to the size of an
+                          average triangle
+        """
+
+        self.vertices = np.asarray(vertices, dtype=np.float64).reshape(-1, 3)
+        self.triangles = np.asarray(triangles, dtype=np.int64).reshape(-1, 3)
+        self.triangle_uvs = np.asarray(triangle_uvs, dtype=np.float64).reshape(-1, 3, 2)
+
+        corners = self.vertices[self.triangles]
+        self.a = corners[:, 0]
+        self.b = corners[:, 1]
+        self.c = corners[:, 2]
+        self.ab = self.b - self.a
+        self.ac = self.c - self.a
+
+        tri_min = corners.min(axis=1)
+        tri_max = corners.max(axis=1)
+
+        if cell_size is None:
+            cell_size = (tri_max - tri_min).max(axis=1).mean() if len(corners) else 1.0
+
+        # don't let tiny triangles on a big mesh make a huge grid
+        extent = (tri_max.max(axis=0) - tri_min.min(axis=0)) if len(corners) else np.ones(3)
+        max_cells = max(8 * len(corners), 1)
+        while np.prod(np.floor(extent / cell_size) + 1) > max_cells:
+            cell_size *= 2
+        self.cell_size = float(cell_size) or 1.0
+
+        self.origin = tri_min.min(axis=0) if len(corners) else np.zeros(3)
+        self.dims = (np.floor(extent / self.cell_size) + 1).astype(np.int64)
+
+        # every (cell, triangle) pair from the triangle bounding boxes
+        lo = self._cell(tri_min)
+        hi = self._cell(tri_max)
+        span = hi - lo + 1
+        num_cells = span.prod(axis=1)
+
+        tri_index = np.repeat(np.arange(len(corners)), num_cells)
+        local = np.arange(num_cells.sum()) - np.repeat(np.cumsum(num_cells) - num_cells, num_cells)
+        span = span[tri_index]
+        cells = lo[tri_index] + np.column_stack((local % span[:, 0],
+                                                 local // span[:, 0] % span[:, 1],
+                                                 local // (span[:, 0] * span[:, 1])))
+
+        keys = self._key(cells)
+        order = np.argsort(keys, kind='mergesort')
+        keys = keys[order]
+
+        # cell keys with their triangles as a slice of cell_triangles
+        self.cell_triangles = tri_index[order]
+        self.cell_keys, self.cell_starts = np.unique(keys, return_index=True)
+        self.cell_ends = np.append(self.cell_starts[1:], len(keys))
+
+        # how many rings of empty cells there are around each cell, so the
+        # ring search can skip them and far points go to the clusters
+        self.empty_rings = _empty_rings(self.cell_keys, self.dims, FAR_RINGS)
+
+        # triangles grouped by which block of cells their centre is in, each
+        # cluster a slice of cluster_triangles with the bounding box of its triangles
+        blocks = np.floor((corners.mean(axis=1) - self.origin) / (self.cell_size * CLUSTER_CELLS)).astype(np.int64)
+        if len(blocks):
+            _, cluster_of = np.unique(blocks, axis=0, return_inverse=True)
+        else:
+            cluster_of = np.zeros(0, dtype=np.int64)
+
+        self.cluster_triangles = np.argsort(cluster_of, kind='mergesort')
+        self.cluster_counts = np.bincount(cluster_of)
+        self.cluster_starts = np.cumsum(self.cluster_counts) - self.cluster_counts
+
+        self.cluster_min = np.full((len(self.cluster_counts), 3), np.inf)
+        self.cluster_max = np.full((len(self.cluster_counts), 3), -np.inf)
+        np.minimum.at(self.cluster_min, cluster_of, tri_min)
+        np.maximum.at(self.cluster_max, cluster_of, tri_max)
+
+    @classmethod
+    def from_mesh(cls, mesh, cell_size=None):
+        """
+        Build a lookup from a mesh in the scene, using maya's triangulation
+        :param mesh: name of the mesh
+        """
+
+        sel_list = om2.MSelectionList()
+        sel_list.add(mesh)
+        mesh_fn = om2.MFnMesh(sel_list.getDagPath(0))
+
+        vertices = np.array(mesh_fn.getPoints(om2.MSpace.kWorld), dtype=np.float64)[:, :3]
+        counts, connects = mesh_fn.getVertices()
+        counts = np.array(counts, dtype=np.int64)
+        connects = np.array(connects, dtype=np.int64)
+
+        tri_counts, tri_vertices = mesh_fn.getTriangles()
+        tri_counts = np.array(tri_counts, dtype=np.int64)
+        triangles = np.array(tri_vertices, dtype=np.int64).reshape(-1, 3)
+
+        # uv of every face vertex, faces without uvs get 0, 0
+        uv_counts, uv_ids = mesh_fn.getAssignedUVs()
+        us, vs = mesh_fn.getUVs()
+        face_vertex_uv = np.zeros((len(connects), 2))
+        has_uvs = np.repeat(np.array(uv_counts, dtype=np.int64) > 0, counts)
+        if has_uvs.any():
+            uv_ids = np.array(uv_ids, dtype=np.int64)
+            face_vertex_uv[has_uvs] = np.column_stack((np.array(us)[uv_ids], np.array(vs)[uv_ids]))
+
+        # the triangles only give vertex ids, find the face vertex each corner
+        # is so the uvs can be looked up, faces are searched by (face, vertex)
+        num_vertices = max(len(vertices), 1)
+        face_keys = np.repeat(np.arange(len(counts)), counts) * num_vertices + connects
+        order = np.argsort(face_keys, kind='mergesort')
+
+        tri_faces = np.repeat(np.arange(len(counts)), tri_counts)
+        corner_keys = (tri_faces[:, None] * num_vertices + triangles).ravel()
+        face_vertices = order[np.searchsorted(face_keys[order], corner_keys)]
+
+        return cls(vertices, triangles, face_vertex_uv[face_vertices].reshape(-1, 3, 2), cell_size)
+
+    def _cell(self, points):
+        return np.floor((points - self.origin) / self.cell_size).astype(np.int64)
+
+    def _key(self, cells):
+        return (cells[:, 0] * self.dims[1] + cells[:, 1]) * self.dims[2] + cells[:, 2]
+
+    def closest(self, points):
+        """
+        Get the closest point on the mesh to every point
+        :param points: (N, 3) world space points
+        :return: (positions, triangles, barycentrics) the closest positions,
+                 the triangle each is on and where in the triangle it is
+        """
+
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        num_points = len(points)
+
+        best_d2 = np.full(num_points, np.inf)
+        best_tri = np.zeros(num_points, dtype=np.int64)
+        best_bary = np.zeros((num_points, 3))
+        best_bary[:, 0] = 1
+
+        if not len(self.triangles):
+            return points.copy(), best_tri - 1, best_bary
+
+        cells = self._cell(points)
+
+        # rings of cells without triangles are skipped, points off the grid or
+        # with nothing in the first few rings are far from the surface
+        on_grid = ((cells >= 0) & (cells < self.dims)).all(axis=1)
+        ring = np.full(num_points, FAR_RINGS, dtype=np.int64)
+        ring[on_grid] = self.empty_rings[self._key(cells[on_grid])]
+
+        far = ring >= FAR_RINGS
+        self._test_clusters(points, np.flatnonzero(far), best_d2, best_tri, best_bary)
+
+        # how far each point is inside its own cell from the nearest side
+        local = points - self.origin - cells * self.cell_size
+        inset = np.minimum(local, self.cell_size - local).min(axis=1)
+
+        last_ring = ring + self.dims.max()
+
+        pending = np.flatnonzero(~far)
+
+        while len(pending):
+            for r in np.unique(ring[pending]):
+                group = pending[ring[pending] == r]
+                offsets = _shell(r)
+
+                # a shell with more cells than the grid has is slower than
+                # just testing every triangle
+                if len(offsets) >= len(self.cell_keys):
+                    self._test_all(points, group, best_d2, best_tri, best_bary)
+                    last_ring[group] = r
+                else:
+                    self._test_shell(points, cells, group, offsets, best_d2, best_tri, best_bary)
+
+            # done once nothing in the next ring can be closer than the best so far
+            reach = ring[pending] * self.cell_size + inset[pending]
+            done = (best_d2[pending] <= reach * reach) | (ring[pending] >= last_ring[pending])
+
+            ring[pending] += 1
+            pending = pending[~done]
+
+        positions = (self.a[best_tri] +
+                     best_bary[:, 1, None] * self.ab[best_tri] +
+                     best_bary[:, 2, None] * self.ac[best_tri])
+
+        return positions, best_tri, best_bary
+
+    def uvs(self, points):
+        """
+        Get the uv of the closest point on the mesh to every point, like
+        calling getUVAtPoint on each one
+        :param points: (N, 3) world space points
+        :return: (N, 2) array of uvs
+        """
+
+        _, triangles, barycentrics = self.closest(points)
+
+        if not len(self.triangles):
+            return np.zeros((len(triangles), 2))
+
+        return (barycentrics[:, :, None] * self.triangle_uvs[triangles]).sum(axis=1)
+
+    def _test_shell(self, points, cells, group, offsets, best_d2, best_tri, best_bary):
+        """
+        Test a group of points against the triangles in one shell of cells
+        around each of them
+        """
+
+        # chunk the points so the pairs stay under MAX_PAIRS
+        per_cell = max(len(self.cell_triangles) // max(len(self.cell_keys), 1), 1)
+        chunk = max(MAX_PAIRS // (len(offsets) * per_cell), 1)
+
+        for first in range(0, len(group), chunk):
+            chunk_points = group[first:first + chunk]
+
+            shell = (cells[chunk_points][:, None, :] + offsets[None, :, :]).reshape(-1, 3)
+            owner = np.repeat(chunk_points, len(offsets))
+
+            on_grid = ((shell >= 0) & (shell < self.dims)).all(axis=1)
+            shell = shell[on_grid]
+            owner = owner[on_grid]
+
+            keys = self._key(shell)
+            found = np.searchsorted(self.cell_keys, keys)
+            found = np.minimum(found, len(self.cell_keys) - 1)
+            hit = self.cell_keys[found] == keys
+
+            starts = self.cell_starts[found[hit]]
+            counts = self.cell_ends[found[hit]] - starts
+            owner = owner[hit]
+
+            pair_point = np.repeat(owner, counts)
+            local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+            pair_tri = self.cell_triangles[np.repeat(starts, counts) + local]
+
+            self._update(points, pair_point, pair_tri, best_d2, best_tri, best_bary)
+
+    def _test_clusters(self, points, group, best_d2, best_tri, best_bary):
+        """
+        Test a group of points against the clusters of triangles, nearest
+        bounding box first, until the next cluster's box is further away than
+        the closest triangle found
+        """
+
+        num_clusters = len(self.cluster_counts)
+        if not len(group) or not num_clusters:
+            return
+
+        chunk = max(MAX_PAIRS // num_clusters, 1)
+
+        for first in range(0, len(group), chunk):
+            chunk_points = group[first:first + chunk]
+            chunk_xyz = points[chunk_points]
+
+            # squared distance from each point to each cluster's box
+            lower = np.zeros((len(chunk_points), num_clusters))
+            for axis in range(3):
+                gap = np.maximum(self.cluster_min[:, axis] - chunk_xyz[:, axis, None], 0)
+                gap = np.maximum(gap, chunk_xyz[:, axis, None] - self.cluster_max[:, axis])
+                lower += gap * gap
+
+            order = np.argsort(lower, axis=1)
+            lower = lower[np.arange(len(chunk_points))[:, None], order]
+
+            pending = np.arange(len(chunk_points))
+
+            for k in range(num_clusters):
+                pending = pending[lower[pending, k] < best_d2[chunk_points[pending]]]
+                if not len(pending):
+                    break
+
+                clusters = order[pending, k]
+                starts = self.cluster_starts[clusters]
+                counts = self.cluster_counts[clusters]
+
+                pair_point = np.repeat(chunk_points[pending], counts)
+                local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+                pair_tri = self.cluster_triangles[np.repeat(starts, counts) + local]
+
+                self._update(points, pair_point, pair_tri, best_d2, best_tri, best_bary)
+
+    def _test_all(self, points, group, best_d2, best_tri, best_bary):
+        """
+        Test a group of points against every triangle
+        """
+
+        num_tris = len(self.triangles)
+        chunk = max(MAX_PAIRS // num_tris, 1)
+
+        for first in range(0, len(group), chunk):
+            chunk_points = group[first:first + chunk]
+            pair_point = np.repeat(chunk_points, num_tris)
+            pair_tri = np.tile(np.arange(num_tris), len(chunk_points))
+
+            self._update(points, pair_point, pair_tri, best_d2, best_tri, best_bary)
+
+    def _update(self, points, pair_point, pair_tri, best_d2, best_tri, best_bary):
+        """
+        Keep the closest of some point/triangle pairs for each point, the
+        pairs of each point must be next to each other
+        """
+
+        if not len(pair_point):
+            return
+
+        a = self.a[pair_tri]
+        ab = self.ab[pair_tri]
+        ac = self.ac[pair_tri]
+
+        ap = points[pair_point] - a
+        bary = closest_barycentrics(ap, ab, ac)
+        offset = bary[:, 1, None] * ab + bary[:, 2, None] * ac - ap
+        d2 = np.einsum('ij,ij->i', offset, offset)
+
+        # the closest pair of each point, pairs of a point are in one run so the
+        # smallest distance of each run is found without sorting
+        starts = np.flatnonzero(np.concatenate(([True], pair_point[1:] != pair_point[:-1])))
+        run = np.repeat(np.arange(len(starts)), np.diff(np.append(starts, len(pair_point))))
+        smallest = np.minimum.reduceat(d2, starts)
+        candidates = np.flatnonzero(d2 == smallest[run])
+        first = candidates[np.concatenate(([True], run[candidates][1:] != run[candidates][:-1]))]
+
+        point_ids = pair_point[first]
+        better = d2[first] < best_d2[point_ids]
+        point_ids = point_ids[better]
+        first = first[better]
+
+        best_d2[point_ids] = d2[first]
+        best_tri[point_ids] = pair_tri[first]
+        best_bary[point_ids] = bary[first]
+
+
+def closest_barycentrics(ap, ab, ac):
+    """
+    Get the barycentric coordinates of the closest point on many triangles
+    to many points, from Real-Time Collision Detection 5.1.5. Everything is
+    relative to the first corner a of each triangle
+    :param ap: (N, 3) point minus a
+    :param ab: (N, 3) second corner minus a
+    :param ac: (N, 3) third corner minus a
+    :return: (N, 3) barycentric coordinates
+    """
+
+    d1 = np.einsum('ij,ij->i', ab, ap)
+    d2 = np.einsum('ij,ij->i', ac, ap)
+    ab_ab = np.einsum('ij,ij->i', ab, ab)
+    ab_ac = np.einsum('ij,ij->i', ab, ac)
+    ac_ac = np.einsum('ij,ij->i', ac, ac)
+
+    # the same dot products from b and c, p - b is ap - ab and so on
+    d3 = d1 - ab_ab
+    d4 = d2 - ab_ac
+    d5 = d1 - ab_ac
+    d6 = d2 - ac_ac
+
+    va = d3 * d6 - d5 * d4
+    vb = d5 * d2 - d1 * d6
+    vc = d1 * d4 - d3 * d2
+
+    # inside the face, everything else overrides this below
+    with np.errstate(divide='ignore', invalid='ignore'):
+        denom = 1.0 / (va + vb + vc)
+        v = vb * denom
+        w = vc * denom
+
+        # closest to an edge
+        edge_bc = (va <= 0) & (d4 - d3 >= 0) & (d5 - d6 >= 0)
+        t = (d4 - d3) / ((d4 - d3) + (d5 - d6))
+        v = np.where(edge_bc, 1 - t, v)
+        w = np.where(edge_bc, t, w)
+
+        edge_ac = (vb <= 0) & (d2 >= 0) & (d6 <= 0)
+        t = d2 / (d2 - d6)
+        v = np.where(edge_ac, 0, v)
+        w = np.where(edge_ac, t, w)
+
+        edge_ab = (vc <= 0) & (d1 >= 0) & (d3 <= 0)
+        t = d1 / (d1 - d3)
+        v = np.where(edge_ab, t, v)
+        w = np.where(edge_ab, 0, w)
+
+    # closest to a corner
+    corner_c = (d6 >= 0) & (d5 <= d6)
+    v[corner_c] = 0
+    w[corner_c] = 1
+
+    corner_b = (d3 >= 0) & (d4 <= d3)
+    v[corner_b] = 1
+    w[corner_b] = 0
+
+    corner_a = (d1 <= 0) & (d2 <= 0)
+    v[corner_a] = 0
+    w[corner_a] = 0
+
+    # degenerate triangles, just use the first corner
+    bad = ~(np.isfinite(v) & np.isfinite(w))
+    v[bad] = 0
+    w[bad] = 0
+
+    return np.column_stack((1 - v - w, v, w))
+
+
+def _empty_rings(cell_keys, dims, max_rings):
+    """
+    Get how many rings of empty cells surround every cell of a grid, counting
+    up to max_rings
+    :param cell_keys: keys of the cells with triangles in
+    :param dims: (3,) size of the grid
+    :return: int8 array indexed by cell key
+    """
+
+    reached = np.zeros(int(dims.prod()), dtype=bool)
+    reached[cell_keys] = True
+    reached = reached.reshape(dims)
+
+    rings = np.full(reached.shape, max_rings, dtype=np.int8)
+
+    for r in range(max_rings):
+        rings[reached & (rings == max_rings)] = r
+
+        # grow by a cell each way along each axis, which grows by a whole ring
+        for axis in range(3):
+            grown = reached.copy()
+            before = [slice(None)] * 3
+            after = [slice(None)] * 3
+            before[axis] = slice(None, -1)
+            after[axis] = slice(1, None)
+            grown[tuple(after)] |= reached[tuple(before)]
+            grown[tuple(before)] |= reached[tuple(after)]
+            reached = grown
+
+    return rings.ravel()
+
+
+def _shell(r):
+    """
+    Get the cell offsets exactly r cells away from a cell
+    """
+
+    steps = np.arange(-r, r + 1)
+    offsets = np.stack(np.meshgrid(steps, steps, steps, indexing='ij'), axis=-1).reshape(-1, 3)
+
+    return offsets[np.abs(offsets).max(axis=1) == r]
+
+
+def get_lookup(mesh, cell_size=None, digests=None):
+    """
+    Get the lookup for a goal mesh, reusing the last one built for it if the
+    mesh hasn't changed since
+    :param mesh: name of the mesh
+    :param digests: dict of mesh digests shared with the particle_cache key,
+                    see particle_cache.get_digest
+    :return: UVLookup
+    """
+
+    key = particle_cache.get_digest(mesh, digests)
+
+    cached = _lookups.get(mesh)
+    if cached and cached[0] == key:
+        return cached[1]
+
+    lookup = UVLookup.from_mesh(mesh, cell_size)
+    _lookups[mesh] = (key, lookup)
+
+    return lookup